@@ -0,0 +1,38 @@
+"""ETag helpers for pages rendered per user (see product.views.allProduct and user.views.profile_view)."""
+import hashlib
+
+from django.contrib.messages import get_messages
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+
+def page_etag(request, *parts):
+    """Weak ETag for a page built from `parts` for ``request.user``.
+
+    Also covers what every page shows of the user (the navbar greeting) and
+    the CSRF secret, so a page with an embedded form token is sent again
+    once the token rotates (e.g. after logging in again).
+    """
+    user = request.user
+    key = [user.pk, user.name, user.is_superuser, request.META.get('CSRF_COOKIE', ''), *parts]
+    digest = hashlib.sha1(repr(key).encode()).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def not_modified(request, etag):
+    """Return a 304 (or 412) response if the request's conditions settle it, else None.
+
+    Never answers 304 while flash messages are waiting to be shown.
+    """
+    if request.method not in ('GET', 'HEAD') or len(get_messages(request)):
+        return None
+    response = get_conditional_response(request, etag=etag)
+    if response is not None and response.status_code == 304:
+        with_etag(response, etag)
+    return response
+
+
+def with_etag(response, etag):
+    """Set `etag` on `response` and make browsers revalidate before reusing it."""
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
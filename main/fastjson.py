@@ -0,0 +1,53 @@
+"""JSON encoding for the API views, with orjson when it is installed.
+
+The views hand over plain rows (``values()`` dicts or feed items), so no
+model instances or Django serializers are involved. Decimals come out as
+numbers, like the prices in the upstream feed, and datetimes as ISO 8601.
+Both encoders produce the same JSON; API_JSON_ENCODER picks one
+('orjson' or 'json'), defaulting to orjson if it can be imported.
+"""
+import datetime
+import decimal
+import json
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def _dumps_orjson(data):
+    if orjson is None:
+        raise ImproperlyConfigured("API_JSON_ENCODER is 'orjson' but orjson is not installed.")
+    return orjson.dumps(data, default=_default)
+
+
+def _dumps_json(data):
+    return json.dumps(data, default=_default, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+ENCODERS = {
+    'orjson': _dumps_orjson,
+    'json': _dumps_json,
+}
+
+
+def dumps(data):
+    """Encode `data` to JSON bytes with the API_JSON_ENCODER encoder."""
+    return ENCODERS[settings.API_JSON_ENCODER](data)
+
+
+def json_response(data, status=200):
+    return HttpResponse(dumps(data), content_type='application/json', status=status)
@@ -0,0 +1,285 @@
+"""Request, database, upstream and cache metrics in the Prometheus text format.
+
+Recording never takes a lock: every thread adds to its own shard (plain
+dicts keyed by metric name and label values), and the shards are only
+summed when metrics are read. To aggregate several worker processes, point
+METRICS_DIR at a directory they share: a background thread in each process
+writes its totals to ``<pid>.json`` there every METRICS_FLUSH_INTERVAL
+seconds, and /metrics sums every file. Files of exited workers are kept,
+since their counts still belong in the totals; empty the directory when the
+whole deployment restarts.
+
+/metrics answers 403 unless METRICS_TOKEN is set and the scraper sends it
+as "Authorization: Bearer <token>".
+"""
+import bisect
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+from . import timing
+
+logger = logging.getLogger(__name__)
+
+# Methods counted by name; anything else is counted as 'other'
+METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# name -> (type, help, label names, histogram buckets)
+METRICS = {
+    'snapnshop_http_requests_total': (
+        'counter', 'HTTP requests by URL name, method and status code.', ('view', 'method', 'status'), None),
+    'snapnshop_http_request_duration_seconds': (
+        'histogram', 'Time to respond, by URL name.', ('view',), LATENCY_BUCKETS),
+    'snapnshop_db_queries': (
+        'histogram', 'Database queries run per request, by URL name.', ('view',), QUERY_BUCKETS),
+    'snapnshop_upstream_request_duration_seconds': (
+        'histogram', 'Upstream calls by endpoint, including retries.', ('endpoint',), LATENCY_BUCKETS),
+    'snapnshop_upstream_errors_total': (
+        'counter', 'Upstream calls that failed (error) or were refused by an open circuit breaker (circuit_open).',
+        ('endpoint', 'reason'), None),
+    'snapnshop_catalog_cache_total': (
+        'counter', 'Catalog cache lookups and refreshes by result.', ('result',), None),
+}
+
+
+class _Shard:
+    def __init__(self):
+        self.counters = {}    # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [count per bucket..., +Inf count, sum]
+
+
+_local = threading.local()
+_shards = []
+_shards_lock = threading.Lock()  # only taken when a thread records its first metric
+_collectors = []
+
+
+def _shard():
+    try:
+        return _local.shard
+    except AttributeError:
+        shard = _local.shard = _Shard()
+        with _shards_lock:
+            _shards.append(shard)
+        return shard
+
+
+def inc(name, labels, value=1):
+    counters = _shard().counters
+    key = (name, labels)
+    counters[key] = counters.get(key, 0) + value
+
+
+def observe(name, labels, value):
+    histograms = _shard().histograms
+    key = (name, labels)
+    buckets = METRICS[name][3]
+    counts = histograms.get(key)
+    if counts is None:
+        counts = histograms[key] = [0] * (len(buckets) + 2)
+    counts[bisect.bisect_left(buckets, value)] += 1
+    counts[-1] += value
+
+
+def register_collector(collect):
+    """Have `collect()` called at every read; it returns ``(counter name, labels, value)`` totals.
+
+    For counts another module keeps anyway (e.g. the catalog cache), so
+    recording them costs nothing extra.
+    """
+    _collectors.append(collect)
+
+
+def snapshot():
+    """This process's totals: ``{'counters': [...], 'histograms': [...]}`` as [name, labels, value] lists."""
+    counters, histograms = {}, {}
+    with _shards_lock:
+        shards = list(_shards)
+    for shard in shards:
+        # Copying a dict is atomic under the GIL, so the owning thread may keep writing
+        for key, value in shard.counters.copy().items():
+            counters[key] = counters.get(key, 0) + value
+        for key, counts in shard.histograms.copy().items():
+            _add(histograms, key, list(counts))
+    for collect in _collectors:
+        for name, labels, value in collect():
+            counters[(name, labels)] = counters.get((name, labels), 0) + value
+    return {
+        'counters': [[name, list(labels), value] for (name, labels), value in counters.items()],
+        'histograms': [[name, list(labels), counts] for (name, labels), counts in histograms.items()],
+    }
+
+
+def _add(histograms, key, counts):
+    total = histograms.get(key)
+    if total is None:
+        histograms[key] = counts
+    else:
+        histograms[key] = [a + b for a, b in zip(total, counts)]
+
+
+def _flush():
+    """Write this process's totals to METRICS_DIR/<pid>.json."""
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=settings.METRICS_DIR, prefix='.tmp-')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(snapshot(), f)
+    os.replace(tmp, os.path.join(settings.METRICS_DIR, f'{os.getpid()}.json'))
+
+
+_flusher_pid = None
+
+
+def _flush_forever():
+    while True:
+        time.sleep(settings.METRICS_FLUSH_INTERVAL)
+        if not settings.METRICS_DIR:
+            continue  # unset since the thread started (e.g. settings overridden in tests)
+        try:
+            _flush()
+        except Exception:
+            # A full disk or a removed directory must not stop the flushes that follow
+            logger.exception('Could not write metrics to %s', settings.METRICS_DIR)
+
+
+def start_flusher():
+    """Start the thread that shares this process's totals through METRICS_DIR (once per process)."""
+    global _flusher_pid
+    if settings.METRICS_DIR and _flusher_pid != os.getpid():
+        _flusher_pid = os.getpid()
+        threading.Thread(target=_flush_forever, daemon=True, name='metrics-flush').start()
+
+
+def _after_fork():
+    # A worker forked from a parent that already recorded metrics starts from
+    # zero, and needs its own flusher if the parent had one (gunicorn --preload)
+    global _local, _shards_lock
+    _local = threading.local()
+    _shards_lock = threading.Lock()
+    _shards.clear()
+    if _flusher_pid is not None:
+        start_flusher()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def totals():
+    """Totals of every process sharing METRICS_DIR, or of this process without one."""
+    if not settings.METRICS_DIR:
+        data = [snapshot()]
+    else:
+        _flush()
+        data = []
+        for filename in os.listdir(settings.METRICS_DIR):
+            if filename.endswith('.json'):
+                try:
+                    with open(os.path.join(settings.METRICS_DIR, filename)) as f:
+                        data.append(json.load(f))
+                except (OSError, ValueError):
+                    continue  # removed or replaced while listing
+    counters, histograms = {}, {}
+    for process in data:
+        for name, labels, value in process['counters']:
+            key = (name, tuple(labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, counts in process['histograms']:
+            _add(histograms, (name, tuple(labels)), counts)
+    return counters, histograms
+
+
+def _number(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    return '{%s}' % ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) if pairs else ''
+
+
+def exposition():
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    counters, histograms = totals()
+    lines = []
+    for name, (kind, help_text, label_names, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind == 'counter':
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{_labels(label_names, labels)} {_number(value)}')
+            continue
+        for (metric, labels), counts in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip((*buckets, '+Inf'), counts):
+                cumulative += count
+                le = bound if bound == '+Inf' else f'{bound:g}'
+                lines.append(f'{name}_bucket{_labels(label_names, labels, [("le", le)])} {cumulative}')
+            lines.append(f'{name}_sum{_labels(label_names, labels)} {_number(counts[-1])}')
+            lines.append(f'{name}_count{_labels(label_names, labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    # Closed until METRICS_TOKEN is set: the series list every view and upstream host
+    if not settings.METRICS_TOKEN or not constant_time_compare(
+        request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {settings.METRICS_TOKEN}'
+    ):
+        return HttpResponseForbidden()
+    return HttpResponse(exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class MetricsMiddleware:
+    """Count every response and time it, by URL name (``unmatched`` for URLs that resolve to no view)."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        timing.install()
+        start_flusher()
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        with timing.timed() as timings:
+            response = self.get_response(request)
+        self.record(request, response, timings)
+        return response
+
+    async def __acall__(self, request):
+        with timing.timed() as timings:
+            response = await self.get_response(request)
+        self.record(request, response, timings)
+        return response
+
+    def record(self, request, response, timings):
+        match = request.resolver_match
+        view = (match.url_name or match.view_name) if match else 'unmatched'
+        method = request.method if request.method in METHODS else 'other'
+        inc('snapnshop_http_requests_total', (view, method, str(response.status_code)))
+        observe('snapnshop_http_request_duration_seconds', (view,), time.perf_counter() - timings.started)
+        observe('snapnshop_db_queries', (view,), timings.queries)
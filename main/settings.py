@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
+import importlib.util
 import os
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -45,6 +46,9 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'main.staticfiles.StaticFilesMiddleware',
+    'main.metrics.MetricsMiddleware',
+    'main.timing.RequestTimingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -55,18 +59,29 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'main.urls'
 AUTH_USER_MODEL = 'user.User'
+# Log in with username or email in one lookup and one password check
+AUTHENTICATION_BACKENDS = ['user.backends.UsernameOrEmailBackend']
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, timing renders for RequestTimingMiddleware
+        'BACKEND': 'main.timing.TimedDjangoTemplates',
+        'NAME': 'django',
         'DIRS': [os.path.join(BASE_DIR, 'template')],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            # Compiled templates are kept in memory, in development too
+            # (Django's autoreloader clears them when a template changes)
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
         },
     },
 ]
@@ -80,10 +95,60 @@ WSGI_APPLICATION = 'main.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
     }
 }
 
+# Production SQLite profile, off unless SQLITE_PRODUCTION=1 (compare with `manage.py bench_sqlite`).
+# Applied to every new connection:
+# - WAL journaling, so readers and the one writer no longer block each other
+# - IMMEDIATE transactions take the write lock at BEGIN, so a transaction that
+#   reads before it writes waits out the busy timeout ('timeout', in seconds)
+#   instead of failing at once with "database is locked"
+# - synchronous=NORMAL: with WAL a power cut may lose the latest commits, never corrupts
+# - reads through a 256 MiB memory map, and a 16 MiB page cache per connection
+# Connections are then kept open for SQLITE_CONN_MAX_AGE seconds, checked before reuse.
+SQLITE_PRODUCTION = os.environ.get('SQLITE_PRODUCTION', '0') == '1'
+SQLITE_PRODUCTION_OPTIONS = {
+    'transaction_mode': 'IMMEDIATE',
+    'timeout': 20,
+    'init_command': (
+        'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL; '
+        'PRAGMA mmap_size=268435456; PRAGMA cache_size=-16000'
+    ),
+}
+SQLITE_CONN_MAX_AGE = int(os.environ.get('SQLITE_CONN_MAX_AGE', 600))
+
+if SQLITE_PRODUCTION:
+    DATABASES['default'].update(
+        OPTIONS=SQLITE_PRODUCTION_OPTIONS,
+        CONN_MAX_AGE=SQLITE_CONN_MAX_AGE,
+        CONN_HEALTH_CHECKS=True,
+    )
+
+# Caches
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# 'ratelimit' holds the login/register token buckets. Local memory is per
+# process; with several worker processes use the file backend (LOCATION is a
+# directory) or django.core.cache.backends.db.DatabaseCache (LOCATION is a
+# table made by `manage.py createcachetable`) so the limits are shared.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Rendered product cards (see product/templatetags/product_cards.py)
+    'template_fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'template_fragments',
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    },
+    'ratelimit': {
+        'BACKEND': os.environ.get('RATELIMIT_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('RATELIMIT_CACHE_LOCATION', 'ratelimit'),
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -121,11 +186,108 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+# Serve hashed, precompressed files from STATIC_ROOT (see main/staticfiles.py); needs
+# `manage.py collectstatic` first. Templates only link the hashed names with DEBUG off.
+STATIC_MANIFEST = os.environ.get('STATIC_MANIFEST', '0' if DEBUG else '1') == '1'
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': (
+            'main.staticfiles.CompressedManifestStaticFilesStorage' if STATIC_MANIFEST
+            else 'django.contrib.staticfiles.storage.StaticFilesStorage'
+        ),
+    },
+}
 
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Products per page in the profile's product list
+PROFILE_PAGE_SIZE = 20
+
+# Upstream product catalog
+# 'api' serves the (cached) upstream feed, 'db' serves the table filled by `manage.py sync_catalog`
+CATALOG_SOURCE = os.environ.get('CATALOG_SOURCE', 'api')
+CATALOG_API_URL = os.environ.get('CATALOG_API_URL', 'https://fakestoreapi.com/products')
+# Seconds a fetched catalog is served as fresh before a background refresh (0 disables caching)
+CATALOG_CACHE_TTL = int(os.environ.get('CATALOG_CACHE_TTL', 300))
+# Seconds to wait for the upstream API before giving up
+CATALOG_FETCH_TIMEOUT = float(os.environ.get('CATALOG_FETCH_TIMEOUT', 5))
+# Seconds to wait for a connection to an upstream host
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', 2))
+# Upstream calls in flight at once per process (async client pool size)
+UPSTREAM_MAX_CONCURRENCY = int(os.environ.get('UPSTREAM_MAX_CONCURRENCY', 100))
+# Extra attempts after a failed upstream call (network error, 429 or 5xx)
+UPSTREAM_RETRIES = int(os.environ.get('UPSTREAM_RETRIES', 2))
+# Base delay in seconds for exponential, fully jittered retry backoff
+UPSTREAM_RETRY_BACKOFF = float(os.environ.get('UPSTREAM_RETRY_BACKOFF', 0.2))
+# Retries allowed per upstream call on average, and the burst of retries allowed on top
+UPSTREAM_RETRY_BUDGET = float(os.environ.get('UPSTREAM_RETRY_BUDGET', 0.2))
+UPSTREAM_RETRY_RESERVE = int(os.environ.get('UPSTREAM_RETRY_RESERVE', 10))
+# Consecutive failures that open an endpoint's circuit breaker, and seconds it stays open
+UPSTREAM_BREAKER_THRESHOLD = int(os.environ.get('UPSTREAM_BREAKER_THRESHOLD', 5))
+UPSTREAM_BREAKER_RESET = float(os.environ.get('UPSTREAM_BREAKER_RESET', 30))
+# Products per page when the catalog is served from the database
+CATALOG_PAGE_SIZE = 24
+# Seconds between checks for catalog changes in the typeahead index
+SUGGEST_REFRESH_INTERVAL = 30
+# Changed items kept in the small typeahead delta before the main index is rebuilt
+SUGGEST_MERGE_THRESHOLD = 10000
+
+# JSON API (product/api.py): rows per page by default, and the most a client may ask for with ?limit=
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 500
+# Encoder for API responses (main/fastjson.py): 'orjson' or 'json', orjson if it is installed
+API_JSON_ENCODER = os.environ.get('API_JSON_ENCODER') or ('orjson' if importlib.util.find_spec('orjson') else 'json')
+# Rows fetched from the database at a time by the streaming collection export (product/export.py)
+EXPORT_CHUNK_SIZE = 2000
+
+# Product image thumbnails (product/images.py), written under MEDIA_ROOT/thumbs
+# Widths generated for every source image, each as WebP and JPEG
+IMAGE_THUMBNAIL_WIDTHS = (80, 160, 320, 640)
+IMAGE_THUMBNAIL_QUALITY = 80
+# Hosts the image proxy fetches from; images elsewhere are linked directly
+IMAGE_PROXY_ALLOWED_HOSTS = os.environ.get('IMAGE_PROXY_ALLOWED_HOSTS', 'fakestoreapi.com').split(',')
+# Seconds to wait for a source image, and the largest one downloaded (bytes)
+IMAGE_PROXY_FETCH_TIMEOUT = float(os.environ.get('IMAGE_PROXY_FETCH_TIMEOUT', 10))
+IMAGE_PROXY_MAX_BYTES = 10 * 1024 * 1024
+
+# Per-request query, SQL, template and upstream timings (main/timing.py); off unless asked for
+REQUEST_TIMING_ENABLED = os.environ.get('REQUEST_TIMING_ENABLED', '0') == '1'
+# Fraction of requests timed
+REQUEST_TIMING_SAMPLE_RATE = float(os.environ.get('REQUEST_TIMING_SAMPLE_RATE', 1))
+# Send the timings to the browser as a Server-Timing header
+REQUEST_TIMING_HEADER = os.environ.get('REQUEST_TIMING_HEADER', '1' if DEBUG else '0') == '1'
+# Log timed requests slower than this many milliseconds or running this many queries
+REQUEST_TIMING_SLOW_MS = float(os.environ.get('REQUEST_TIMING_SLOW_MS', 500))
+REQUEST_TIMING_SLOW_QUERIES = int(os.environ.get('REQUEST_TIMING_SLOW_QUERIES', 20))
+
+# Prometheus metrics at /metrics (main/metrics.py)
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+# Directory shared by all worker processes, to report their combined totals (unset: this process only)
+METRICS_DIR = os.environ.get('METRICS_DIR') or None
+# Seconds between each process writing its totals to METRICS_DIR
+METRICS_FLUSH_INTERVAL = 5
+# Scrapes must send "Authorization: Bearer <token>"; while unset, /metrics refuses every request
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Threads that hash passwords for signups; 0 uses the shared async worker threads
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 0))
+
+# Login/register rate limits, checked before any password hashing
+RATELIMIT_ENABLED = os.environ.get('RATELIMIT_ENABLED', '1') == '1'
+RATELIMIT_CACHE = 'ratelimit'
+# Token buckets per form and key: (burst, tokens refilled per minute)
+RATELIMITS = {
+    'login': {'ip': (20, 10), 'account': (5, 2)},
+    'register': {'ip': (5, 1)},
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -0,0 +1,187 @@
+"""Fingerprinted, precompressed static files.
+
+With STATIC_MANIFEST on, ``collectstatic`` writes content-hashed copies of
+static/ to STATIC_ROOT (``css/card.3f2a….css``) plus ``.gz`` and, if the
+brotli package is installed, ``.br`` variants of every text asset.
+StaticFilesMiddleware then serves STATIC_ROOT itself: the smallest variant
+the browser accepts, hashed names with ``Cache-Control: immutable`` (their
+content can never change) and unhashed names with revalidation.
+"""
+import gzip
+import mimetypes
+import os
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import FileResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Assets worth compressing; images and fonts are compressed already
+COMPRESSIBLE = ('.css', '.js', '.map', '.json', '.svg', '.txt', '.html', '.xml')
+# Smaller files gain less than the Content-Encoding header costs
+MIN_COMPRESS_SIZE = 256
+# Content-Encoding -> file suffix, in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _compressors():
+    yield '.gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0)
+    if brotli is not None:
+        yield '.br', lambda data: brotli.compress(data, quality=11)
+
+
+def compress_file(path):
+    """Write compressed variants of `path` next to it, skipping any that would not be smaller."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    written = []
+    for suffix, compress in _compressors():
+        compressed = compress(data)
+        if len(compressed) < len(data) * 0.95:
+            with open(path + suffix, 'wb') as f:
+                f.write(compressed)
+            written.append(path + suffix)
+        elif os.path.exists(path + suffix):
+            os.unlink(path + suffix)
+    return written
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """ManifestStaticFilesStorage that also gzips (and brotlis) text assets during collectstatic."""
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if dry_run:
+            return
+        names = set(paths) | set(self.hashed_files.values())
+        for name in sorted(names):
+            if name.endswith(COMPRESSIBLE) and self.exists(name) and self.size(name) >= MIN_COMPRESS_SIZE:
+                for path in compress_file(self.path(name)):
+                    yield name, os.path.relpath(path, self.location), True
+
+
+def accepted_encodings(request):
+    """Content codings the client accepts, ignoring any it refuses with q=0."""
+    accepted = set()
+    for part in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        coding, _, params = part.partition(';')
+        params = params.replace(' ', '')
+        try:
+            weight = float(params[2:]) if params.startswith('q=') else 1
+        except ValueError:
+            weight = 1
+        if weight > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+class StaticFilesMiddleware:
+    """Serve STATIC_ROOT (as written by collectstatic) before any other middleware runs.
+
+    The directory is indexed once at startup, so a request for a static file
+    costs a dict lookup and an open(); restart after running collectstatic.
+    Not used at all unless STATIC_MANIFEST is on. Runs natively under both
+    WSGI and ASGI, so async views are not pushed onto a worker thread.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.STATIC_MANIFEST:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        self.prefix = settings.STATIC_URL if settings.STATIC_URL.startswith('/') else None
+        self.immutable = set(staticfiles_storage.hashed_files.values())
+        self.files = self._index(settings.STATIC_ROOT)
+
+    @staticmethod
+    def _index(root):
+        """Map each collected name to its {content coding: (path, size)} variants."""
+        files = {}
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                name = os.path.relpath(path, root).replace(os.sep, '/')
+                coding = next((c for c, suffix in ENCODINGS if name.endswith(suffix)), None)
+                if coding:
+                    name = name[:-len(dict(ENCODINGS)[coding])]
+                files.setdefault(name, {})[coding or 'identity'] = (path, os.path.getsize(path))
+        # Drop variants whose original was not collected (e.g. a stray .gz in static/)
+        return {name: variants for name, variants in files.items() if 'identity' in variants}
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        variants = self.lookup(request)
+        if variants:
+            return self.serve(request, request.path[len(self.prefix):], variants)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        variants = self.lookup(request)
+        if not variants:
+            return await self.get_response(request)
+        # A stat() and an open() of a local file: not worth a thread hop
+        response = self.serve(request, request.path[len(self.prefix):], variants)
+        if response.streaming:
+            # As Django's own ASGIStaticFilesHandler does: collected assets are small,
+            # so read the file in one worker call instead of one per chunk
+            chunks = response.streaming_content
+
+            async def read_file():
+                for chunk in await sync_to_async(list)(chunks):
+                    yield chunk
+
+            response.streaming_content = read_file()
+        return response
+
+    def lookup(self, request):
+        """The collected variants of the requested static file, or None if it is not one."""
+        if self.prefix and request.path.startswith(self.prefix) and request.method in ('GET', 'HEAD'):
+            return self.files.get(request.path[len(self.prefix):])
+        return None
+
+    def serve(self, request, name, variants):
+        accepted = accepted_encodings(request)
+        coding = next((c for c, _ in ENCODINGS if c in accepted and c in variants), 'identity')
+        path, size = variants[coding]
+
+        etag = mtime = None
+        if name not in self.immutable:
+            # Unhashed names can change on the next deploy: revalidate them
+            mtime = os.stat(path).st_mtime
+            etag = f'"{int(mtime):x}-{size:x}-{coding}"'
+            response = get_conditional_response(request, etag=etag)
+            if response is not None:
+                return self._cache_headers(response, variants, etag)
+
+        content_type, _ = mimetypes.guess_type(name)
+        response = FileResponse(open(path, 'rb'), content_type=content_type or 'application/octet-stream')
+        response.headers.pop('Content-Disposition', None)
+        if coding != 'identity':
+            response['Content-Encoding'] = coding
+        if mtime is not None:
+            response['Last-Modified'] = http_date(mtime)
+        return self._cache_headers(response, variants, etag)
+
+    def _cache_headers(self, response, variants, etag):
+        if len(variants) > 1:
+            patch_vary_headers(response, ['Accept-Encoding'])
+        if etag is None:
+            patch_cache_control(response, public=True, max_age=365 * 24 * 3600, immutable=True)
+        else:
+            response['ETag'] = etag
+            patch_cache_control(response, public=True, no_cache=True)
+        return response
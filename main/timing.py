@@ -0,0 +1,184 @@
+"""Per-request cost breakdown: queries, SQL time, template time and upstream time.
+
+RequestTimingMiddleware times a sample of requests (REQUEST_TIMING_SAMPLE_RATE).
+While a request is timed, its RequestTimings sit in a context variable, which
+follows the request into sync_to_async threads; the database wrapper, the
+template backend and product.upstream add to it. Requests that are not timed
+pay one context variable lookup per query, template and upstream call, and
+with REQUEST_TIMING_ENABLED off the middleware is not installed at all.
+(main.metrics times every request the same way, to count its queries.)
+
+The totals go out as a Server-Timing header (shown in the browser's network
+panel) when REQUEST_TIMING_HEADER is on, and requests over the
+REQUEST_TIMING_SLOW_* thresholds are logged with their slowest query.
+"""
+import contextlib
+import contextvars
+import logging
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar('request_timings', default=None)
+
+# Longest SQL kept for the slow-request log
+MAX_SQL_LENGTH = 1000
+
+
+class RequestTimings:
+    """What one request spent, in seconds."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql = 0.0
+        self.slowest_sql = (0.0, '')
+        self.template = 0.0
+        self.upstream_calls = 0
+        self.upstream = 0.0
+
+    def add_query(self, sql, elapsed):
+        self.queries += 1
+        self.sql += elapsed
+        if elapsed > self.slowest_sql[0]:
+            self.slowest_sql = (elapsed, sql)
+
+    def add_upstream(self, elapsed):
+        self.upstream_calls += 1
+        self.upstream += elapsed
+
+    def server_timing(self, total):
+        return ', '.join([
+            f'db;dur={self.sql * 1000:.1f};desc="{self.queries} queries"',
+            f'tpl;dur={self.template * 1000:.1f}',
+            f'upstream;dur={self.upstream * 1000:.1f};desc="{self.upstream_calls} calls"',
+            f'total;dur={total * 1000:.1f}',
+        ])
+
+
+def current():
+    """The RequestTimings of the request being handled, or None if it is not timed."""
+    return _current.get()
+
+
+@contextlib.contextmanager
+def timed():
+    """Time the request being handled, or join the RequestTimings already taken for it."""
+    timings = _current.get()
+    if timings is not None:
+        yield timings
+        return
+    timings = RequestTimings()
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+def record_upstream(elapsed):
+    timings = _current.get()
+    if timings is not None:
+        timings.add_upstream(elapsed)
+
+
+def _execute_wrapper(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.add_query(sql, time.perf_counter() - started)
+
+
+def _install_wrapper(connection, **kwargs):
+    if _execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute_wrapper)
+
+
+def install():
+    """Count queries on every database connection, open or opened later."""
+    connection_created.connect(_install_wrapper)
+    for connection in connections.all(initialized_only=True):
+        _install_wrapper(connection)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        timings = _current.get()
+        if timings is None:
+            return super().render(context, request)
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            timings.template += time.perf_counter() - started
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, timing top-level renders (includes count towards their parent)."""
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+
+class RequestTimingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_TIMING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        install()
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if random.random() >= settings.REQUEST_TIMING_SAMPLE_RATE:
+            return self.get_response(request)
+        with timed() as timings:
+            response = self.get_response(request)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        if random.random() >= settings.REQUEST_TIMING_SAMPLE_RATE:
+            return await self.get_response(request)
+        with timed() as timings:
+            response = await self.get_response(request)
+        return self.finish(request, response, timings)
+
+    def finish(self, request, response, timings):
+        total = time.perf_counter() - timings.started
+        if settings.REQUEST_TIMING_HEADER:
+            response['Server-Timing'] = timings.server_timing(total)
+        if total * 1000 >= settings.REQUEST_TIMING_SLOW_MS or timings.queries >= settings.REQUEST_TIMING_SLOW_QUERIES:
+            slowest, sql = timings.slowest_sql
+            logger.warning(
+                'Slow request %s %s (%s): %.1fms, %d queries in %.1fms, templates %.1fms, '
+                '%d upstream calls in %.1fms; slowest query %.1fms: %s',
+                request.method, request.path, response.status_code, total * 1000,
+                timings.queries, timings.sql * 1000, timings.template * 1000,
+                timings.upstream_calls, timings.upstream * 1000, slowest * 1000, sql[:MAX_SQL_LENGTH],
+            )
+        return response
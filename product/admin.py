@@ -1,11 +1,14 @@
 from django.contrib import admin
-from .models import Product
+from .models import Product, CatalogItem
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('id', 'title', 'category', 'price', 'rate', 'count', 'get_username', 'created_at')
-    list_filter = ('category', 'rate', 'created_at')
-    search_fields = ('title', 'category', 'description', 'user__username')
+    list_display = ('id', 'item__title', 'item__category', 'item__price', 'quantity', 'get_username', 'created_at')
+    list_filter = ('item__category', 'created_at')
+    # Item details live on the shared CatalogItem; join it (and the user) in the list query
+    list_select_related = ('user', 'item')
+    search_fields = ('item__title', 'item__category', 'user__username')
+    raw_id_fields = ('user', 'item')
     ordering = ('-created_at',)
     readonly_fields = ('created_at', 'updated_at')
 
@@ -15,5 +18,10 @@ class ProductAdmin(admin.ModelAdmin):
     get_username.admin_order_field = 'user__username'  # Allow ordering by username
 
 
-
-
+@admin.register(CatalogItem)
+class CatalogItemAdmin(admin.ModelAdmin):
+    list_display = ('external_id', 'title', 'category', 'price', 'rate', 'count', 'updated_at')
+    list_filter = ('category',)
+    search_fields = ('title', 'category')
+    ordering = ('external_id',)
+    readonly_fields = ('content_hash', 'created_at', 'updated_at')
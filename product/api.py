@@ -0,0 +1,167 @@
+"""Read-only JSON API over the catalog and the signed-in user's collection.
+
+Both endpoints take
+  ``fields``  comma-separated names from CATALOG_FIELDS / COLLECTION_FIELDS (default: all),
+  ``limit``   rows per page (API_PAGE_SIZE, at most API_MAX_PAGE_SIZE),
+  ``cursor``  the ``next_cursor`` of the previous page,
+and answer ``{"status": "success", "results": [...], "next_cursor": ...}``
+(`next_cursor` is null on the last page). Only the selected columns are
+read, with values_list(), and the rows go straight to main.fastjson;
+responses are gzipped for clients that accept it.
+"""
+import heapq
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.db.models import Q
+from django.views.decorators.gzip import gzip_page
+
+from main.fastjson import json_response
+from user.views import make_cursor, parse_cursor
+
+from .catalog import CatalogError, aget_catalog_versioned
+from .models import CatalogItem
+
+# API field -> CatalogItem column. Names follow the upstream feed, with its rating flattened.
+CATALOG_FIELDS = {
+    'id': 'external_id',
+    'title': 'title',
+    'price': 'price',
+    'description': 'description',
+    'category': 'category',
+    'image': 'image_url',
+    'rate': 'rate',
+    'count': 'count',
+}
+
+# API field -> Product column; `id` is the collection entry (see update_quantity), `catalog_id` the item's
+COLLECTION_FIELDS = {
+    'id': 'id',
+    'catalog_id': 'item__external_id',
+    'title': 'item__title',
+    'price': 'item__price',
+    'description': 'item__description',
+    'category': 'item__category',
+    'image': 'item__image_url',
+    'rate': 'item__rate',
+    'count': 'item__count',
+    'quantity': 'quantity',
+    'created_at': 'created_at',
+    'updated_at': 'updated_at',
+}
+
+
+class ApiError(ValueError):
+    pass
+
+
+def selected_fields(request, available):
+    """The fields asked for with ?fields=, in the order given, or all of `available`."""
+    value = request.GET.get('fields')
+    if not value:
+        return list(available)
+    fields = list(dict.fromkeys(name.strip() for name in value.split(',') if name.strip()))
+    unknown = [name for name in fields if name not in available]
+    if unknown or not fields:
+        raise ApiError(f'Unknown fields: {", ".join(unknown)}; choose from {", ".join(available)}')
+    return fields
+
+
+def page_size(request):
+    try:
+        limit = int(request.GET.get('limit') or settings.API_PAGE_SIZE)
+    except ValueError:
+        raise ApiError('Invalid limit')
+    if limit < 1:
+        raise ApiError('Invalid limit')
+    return min(limit, settings.API_MAX_PAGE_SIZE)
+
+
+def id_cursor(request):
+    try:
+        return int(request.GET.get('cursor') or 0)
+    except ValueError:
+        raise ApiError('Invalid cursor')
+
+
+def error(message, status=400):
+    return json_response({'status': 'error', 'message': str(message)}, status=status)
+
+
+def page(results, next_cursor):
+    return json_response({'status': 'success', 'results': results, 'next_cursor': next_cursor})
+
+
+def catalog_rows(fields, cursor, limit):
+    """One page of the synced catalog table, keyset-paginated on its primary key."""
+    columns = [CATALOG_FIELDS[name] for name in fields] + ['id']
+    rows = list(
+        CatalogItem.objects.filter(id__gt=cursor).exclude(external_id=None).order_by('id')
+        .values_list(*columns)[:limit + 1]
+    )
+    next_cursor = rows[limit - 1][-1] if len(rows) > limit else None
+    # zip() stops at the requested fields, leaving out the cursor column
+    return [dict(zip(fields, row)) for row in rows[:limit]], next_cursor
+
+
+def feed_rows(products, fields, cursor, limit):
+    """One page of the upstream feed, in id order after `cursor`."""
+    after = heapq.nsmallest(limit + 1, (item for item in products if item['id'] > cursor), key=lambda item: item['id'])
+    next_cursor = after[limit - 1]['id'] if len(after) > limit else None
+    results = []
+    for item in after[:limit]:
+        rating = item.get('rating') or {}
+        results.append({
+            name: rating.get(name) if name in ('rate', 'count') else item.get(name)
+            for name in fields
+        })
+    return results, next_cursor
+
+
+@gzip_page
+@login_required
+async def catalog(request):
+    # Async like allProduct: with CATALOG_SOURCE = 'api' a cold cache waits on upstream
+    try:
+        fields = selected_fields(request, CATALOG_FIELDS)
+        limit = page_size(request)
+        cursor = id_cursor(request)
+    except ApiError as e:
+        return error(e)
+
+    if settings.CATALOG_SOURCE == 'db':
+        return page(*await sync_to_async(catalog_rows)(fields, cursor, limit))
+    try:
+        products, _ = await aget_catalog_versioned()
+    except CatalogError as e:
+        return error(e, status=503)
+    return page(*feed_rows(products, fields, cursor, limit))
+
+
+@gzip_page
+@login_required
+def collection(request):
+    """The user's collection, newest first, keyset-paginated like the profile page."""
+    try:
+        fields = selected_fields(request, COLLECTION_FIELDS)
+        limit = page_size(request)
+        cursor = None
+        if request.GET.get('cursor'):
+            cursor = parse_cursor(request.GET['cursor'])
+            if cursor is None:
+                raise ApiError('Invalid cursor')
+    except ApiError as e:
+        return error(e)
+
+    products = request.user.products.order_by('-created_at', '-id')
+    if cursor:
+        created_at, product_id = cursor
+        products = products.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=product_id))
+    columns = [COLLECTION_FIELDS[name] for name in fields] + ['created_at', 'id']
+    rows = list(products.values_list(*columns)[:limit + 1])
+
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = make_cursor(*rows[limit - 1][-2:])
+    return page([dict(zip(fields, row)) for row in rows[:limit]], next_cursor)
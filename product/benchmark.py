@@ -0,0 +1,237 @@
+"""Mixed-traffic benchmark of the main views, used by `manage.py benchmark`.
+
+The same seed replays the same sequence of requests: catalog page views,
+product adds, profile views and logins, in MIX proportions, spread over a
+number of concurrent workers, each signed in as one of the users created by
+`manage.py seed_scale`. Requests go either through Django's test client
+(in-process: no sockets, handy for profiling) or over real HTTP to a
+runserver or uvicorn process. Queries per request come from
+main.timing, read in-process or from the Server-Timing header.
+"""
+import contextlib
+import json
+import math
+import os
+import queue
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import CommandError
+from django.test import Client
+from django.urls import reverse
+
+from main import timing
+
+# URL name -> share of the requests
+MIX = {
+    'allProduct': 50,
+    'profile': 20,
+    'add_product': 20,
+    'login': 10,
+}
+
+SERVERS = {
+    # The current deployment path: Django's threaded WSGI server
+    'wsgi': ['manage.py', 'runserver', '{port}', '--noreload'],
+    'asgi': ['-m', 'uvicorn', 'main.asgi:application', '--port', '{port}', '--log-level', 'warning'],
+}
+
+_SERVER_TIMING_QUERIES = re.compile(r'\bdb;[^,]*desc="(\d+) queries"')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise CommandError(f'Server on port {port} did not start')
+
+
+@contextlib.contextmanager
+def server(name, env=None):
+    """Run the `name` server from SERVERS on a free port; yields its base URL."""
+    port = free_port()
+    command = [sys.executable] + [arg.format(port=port) for arg in SERVERS[name]]
+    process = subprocess.Popen(
+        command, cwd=settings.BASE_DIR, env=dict(os.environ, **(env or {})),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for(port)
+        yield f'http://127.0.0.1:{port}'
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def login_session(user):
+    """Key of a new database session signed in as `user`, for clients that cannot log in themselves."""
+    session = SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.create()
+    return session.session_key
+
+
+def schedule(total, seed):
+    """The URL names of `total` requests in MIX proportions, the same for the same seed."""
+    rng = random.Random(seed)
+    return rng.choices(list(MIX), weights=list(MIX.values()), k=total)
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of sorted `values`."""
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+class ClientTransport:
+    """In-process requests through django.test.Client; queries counted by main.timing."""
+
+    name = 'client'
+
+    def __init__(self):
+        timing.install()
+
+    def worker(self, user):
+        client = Client()
+        client.force_login(user)
+        return {'client': client, 'login': Client()}
+
+    def send(self, state, method, path, login=False, data=None, content_type=None):
+        client = state['login' if login else 'client']
+        kwargs = {'content_type': content_type} if content_type else {}
+        with timing.timed() as timings:
+            response = getattr(client, method)(path, data, **kwargs)
+        return response.status_code, response.content, timings.queries
+
+
+class HttpTransport:
+    """Requests over HTTP to `base_url`; queries read from the Server-Timing header."""
+
+    def __init__(self, name, base_url):
+        self.name = name
+        self.base_url = base_url
+
+    def worker(self, user):
+        client = requests.Session()
+        client.cookies.set(settings.SESSION_COOKIE_NAME, login_session(user))
+        # Logins need a CSRF cookie, and run in their own session so the worker stays signed in
+        login = requests.Session()
+        login.get(self.base_url + reverse('login'))
+        client.get(self.base_url + reverse('profile'))  # sets the worker's CSRF cookie
+        return {'client': client, 'login': login}
+
+    def send(self, state, method, path, login=False, data=None, content_type=None):
+        session = state['login' if login else 'client']
+        headers = {'X-CSRFToken': session.cookies.get(settings.CSRF_COOKIE_NAME, '')}
+        if content_type:
+            headers['Content-Type'] = content_type
+        response = session.request(
+            method.upper(), self.base_url + path, data=data, headers=headers, allow_redirects=False, timeout=60,
+        )
+        match = _SERVER_TIMING_QUERIES.search(response.headers.get('Server-Timing', ''))
+        return response.status_code, response.content, int(match.group(1)) if match else None
+
+
+def request(transport, state, view, rng, products, password):
+    """Make one `view` request; returns ``(ok, queries)``."""
+    if view == 'allProduct':
+        status, body, queries = transport.send(state, 'get', reverse('allProduct'))
+        return status == 200 and b'productsGrid' in body, queries
+    if view == 'profile':
+        status, body, queries = transport.send(state, 'get', reverse('profile'))
+        return status == 200, queries
+    if view == 'add_product':
+        product = dict(rng.choice(products), bump_quantity=True)
+        status, body, queries = transport.send(
+            state, 'post', reverse('add_product'), data=json.dumps(product), content_type='application/json',
+        )
+        return status == 200 and b'"success"' in body, queries
+    if view == 'login':
+        username = state['username']
+        status, body, queries = transport.send(
+            state, 'post', reverse('login'), login=True, data={'username': username, 'password': password},
+        )
+        return status == 302, queries
+    raise ValueError(view)
+
+
+def run(transport, users, products, password, total, concurrency, seed):
+    """Replay `total` scheduled requests with `concurrency` workers; returns the summary."""
+    jobs = queue.SimpleQueue()
+    for view in schedule(total, seed):
+        jobs.put(view)
+    samples = []  # (view, milliseconds, queries, ok); list.append is thread-safe
+
+    states = []
+    for i in range(concurrency):
+        user = users[i % len(users)]
+        state = transport.worker(user)
+        state['username'] = user.username
+        states.append(state)
+
+    def worker(i):
+        rng = random.Random(seed * 1000 + i)
+        while True:
+            try:
+                view = jobs.get_nowait()
+            except queue.Empty:
+                return
+            started = time.perf_counter()
+            try:
+                ok, queries = request(transport, states[i], view, rng, products, password)
+            except requests.RequestException:
+                ok, queries = False, None
+            samples.append((view, (time.perf_counter() - started) * 1000, queries, ok))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return summarize(samples, time.perf_counter() - started)
+
+
+def _stats(samples, elapsed):
+    latencies = sorted(ms for _, ms, _, _ in samples)
+    queries = [q for _, _, q, _ in samples if q is not None]
+    return {
+        'requests': len(samples),
+        'errors': sum(not ok for *_, ok in samples),
+        'throughput': round(len(samples) / elapsed, 2),
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+    }
+
+
+def summarize(samples, elapsed):
+    by_view = {}
+    for sample in samples:
+        by_view.setdefault(sample[0], []).append(sample)
+    return {
+        'elapsed_s': round(elapsed, 3),
+        'overall': _stats(samples, elapsed),
+        'views': {view: _stats(by_view[view], elapsed) for view in MIX if view in by_view},
+    }
@@ -0,0 +1,339 @@
+import hashlib
+import json
+import threading
+import time
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Max
+
+from main import metrics
+
+from . import upstream
+
+# How long to wait before retrying a failed background refresh
+RETRY_INTERVAL = 10
+
+
+class CatalogError(Exception):
+    """Raised when the catalog could not be fetched and there is no copy to serve."""
+
+
+def _catalog_from_response(response):
+    if response.status_code != 200:
+        raise CatalogError('Failed to fetch products')
+    try:
+        return response.json()
+    except ValueError:
+        raise CatalogError('Failed to fetch products')
+
+
+def fetch_catalog(url, timeout):
+    """Fetch the catalog feed from upstream, raising CatalogError on failure."""
+    try:
+        response = upstream.get(url, timeout)
+    except upstream.CircuitOpenError:
+        raise CatalogError('Product catalog is temporarily unavailable')
+    except upstream.UpstreamError:
+        raise CatalogError('Network error occurred')
+    return _catalog_from_response(response)
+
+
+async def afetch_catalog(url, timeout):
+    """Async fetch_catalog() through the pooled client in product.upstream."""
+    try:
+        response = await upstream.aget(url, timeout)
+    except upstream.CircuitOpenError:
+        raise CatalogError('Product catalog is temporarily unavailable')
+    except upstream.UpstreamError:
+        raise CatalogError('Network error occurred')
+    return _catalog_from_response(response)
+
+
+def item_hash(item):
+    """Stable content hash of a feed item, used to detect changed rows."""
+    payload = json.dumps(item, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def feed_item_id(item):
+    """Upstream id of a feed item, or None if it has none usable (the add views reject those too)."""
+    external_id = item.get('id') if isinstance(item, dict) else None
+    if isinstance(external_id, int) and not isinstance(external_id, bool) and external_id >= 0:
+        return external_id
+    return None
+
+
+def item_fields(item):
+    """Map a feed item onto CatalogItem field values."""
+    rating = item.get('rating') or {}
+    return {
+        'external_id': item['id'],
+        'title': item.get('title', ''),
+        'price': Decimal(str(item.get('price', 0))),
+        'description': item.get('description', ''),
+        'category': item.get('category', ''),
+        'image_url': item.get('image', ''),
+        'rate': Decimal(str(rating.get('rate', 0))),
+        'count': rating.get('count', 0),
+    }
+
+
+# CatalogItem columns needed to rebuild a feed item, see item_from_row()
+FEED_COLUMNS = ('id', 'external_id', 'title', 'price', 'description', 'category', 'image_url', 'rate', 'count')
+
+
+def item_from_row(row):
+    """Turn a CatalogItem ``values_list(*FEED_COLUMNS)`` row back into the feed shape."""
+    pk, external_id, title, price, description, category, image_url, rate, count = row
+    return {
+        'id': external_id,
+        'title': title,
+        'price': price,
+        'description': description,
+        'category': category,
+        'image': image_url,
+        'rating': {'rate': rate, 'count': count},
+    }
+
+
+def catalog_version(products):
+    """Short content hash of a whole catalog feed."""
+    payload = json.dumps(products, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()[:16]
+
+
+def db_catalog_version():
+    """Version of the synced catalog table: when it last changed (one indexed MAX query).
+
+    sync_catalog only inserts and updates rows, and every write bumps
+    ``updated_at``, so this changes whenever the served catalog does.
+    """
+    from .models import CatalogItem
+
+    latest = CatalogItem.objects.aggregate(latest=Max('updated_at'))['latest']
+    return latest.strftime('%Y%m%d%H%M%S%f') if latest else 'empty'
+
+
+def catalog_from_db():
+    """Read the synced catalog from the database, in the same shape as the feed."""
+    from .models import CatalogItem
+
+    rows = CatalogItem.objects.exclude(external_id=None).order_by('external_id').values_list(*FEED_COLUMNS)
+    return [item_from_row(row) for row in rows]
+
+
+class CatalogCache:
+    """In-process cache of the upstream product catalog.
+
+    A fresh copy is served for ``ttl`` seconds. After that the stale copy keeps
+    being served while a single background thread refreshes it. When there is
+    no copy at all, concurrent callers wait on one in-flight fetch instead of
+    each calling upstream. A ``ttl`` of 0 disables caching.
+
+    When a refresh fails the stale copy stays in service and the refresh is
+    retried every RETRY_INTERVAL seconds; while upstream's circuit breaker is
+    open (see product.upstream) those retries fail fast without a request.
+    """
+
+    def __init__(self, url, ttl=300, timeout=5):
+        self.url = url
+        self.ttl = ttl
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._catalog = None  # (products, version)
+        self._expires_at = 0.0
+        self._inflight = None  # threading.Event while a fetch is running
+        self._error = None
+
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.errors = 0
+
+    def get(self):
+        return self.get_versioned()[0]
+
+    async def aget(self):
+        return (await self.aget_versioned())[0]
+
+    def get_versioned(self):
+        """Return ``(products, version)``; `version` changes whenever the products do.
+
+        The version is None when caching is disabled.
+        """
+        if self.ttl <= 0:
+            with self._lock:
+                self.misses += 1
+            return fetch_catalog(self.url, self.timeout), None
+
+        catalog, event, leader = self._lookup()
+        if catalog is not None:
+            return catalog
+
+        if leader:
+            self._refresh()
+        else:
+            event.wait()
+        return self._result()
+
+    async def aget_versioned(self):
+        """Async get_versioned(): a cold miss awaits the pooled async client instead of blocking a thread."""
+        if self.ttl <= 0:
+            with self._lock:
+                self.misses += 1
+            return await afetch_catalog(self.url, self.timeout), None
+
+        catalog, event, leader = self._lookup()
+        if catalog is not None:
+            return catalog
+
+        if leader:
+            try:
+                products = await afetch_catalog(self.url, self.timeout)
+            except CatalogError as e:
+                self._failed(e)
+            else:
+                self._stored(products)
+            finally:
+                self._finished()
+        else:
+            await sync_to_async(event.wait, thread_sensitive=False)()
+        return self._result()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'refreshes': self.refreshes,
+                'errors': self.errors,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._catalog = None
+            self._expires_at = 0.0
+            self._error = None
+
+    def _lookup(self):
+        """Return ``(catalog, event, leader)``.
+
+        `catalog` is ``(products, version)`` when there is a copy to serve. Otherwise the caller
+        either leads the fetch (`leader`) or waits on `event`.
+        """
+        with self._lock:
+            if self._catalog is not None:
+                self.hits += 1
+                if time.monotonic() >= self._expires_at and self._inflight is None:
+                    # Stale: refresh in the background, keep serving the old copy
+                    self._inflight = threading.Event()
+                    threading.Thread(target=self._refresh, daemon=True).start()
+                return self._catalog, None, False
+
+            self.misses += 1
+            event = self._inflight
+            leader = event is None
+            if leader:
+                event = self._inflight = threading.Event()
+            return None, event, leader
+
+    def _result(self):
+        with self._lock:
+            if self._catalog is None:
+                raise self._error or CatalogError('Failed to fetch products')
+            return self._catalog
+
+    def _refresh(self):
+        try:
+            products = fetch_catalog(self.url, self.timeout)
+        except CatalogError as e:
+            self._failed(e)
+        else:
+            self._stored(products)
+        finally:
+            self._finished()
+
+    def _stored(self, products):
+        version = catalog_version(products)
+        with self._lock:
+            self.refreshes += 1
+            self._error = None
+            self._catalog = (products, version)
+            self._expires_at = time.monotonic() + self.ttl
+
+    def _failed(self, error):
+        with self._lock:
+            self.errors += 1
+            self._error = error
+            self._expires_at = time.monotonic() + min(self.ttl, RETRY_INTERVAL)
+
+    def _finished(self):
+        with self._lock:
+            event, self._inflight = self._inflight, None
+        event.set()
+
+
+_catalog_cache = None
+_catalog_cache_lock = threading.Lock()
+
+
+def get_catalog_cache():
+    """Return the process-wide catalog cache, built from settings on first use."""
+    global _catalog_cache
+    if _catalog_cache is None:
+        with _catalog_cache_lock:
+            if _catalog_cache is None:
+                _catalog_cache = CatalogCache(
+                    settings.CATALOG_API_URL,
+                    ttl=settings.CATALOG_CACHE_TTL,
+                    timeout=settings.CATALOG_FETCH_TIMEOUT,
+                )
+    return _catalog_cache
+
+
+def _cache_metrics():
+    if _catalog_cache is None:
+        return []
+    return [('snapnshop_catalog_cache_total', (result,), count) for result, count in _catalog_cache.stats().items()]
+
+
+metrics.register_collector(_cache_metrics)
+
+
+def get_catalog():
+    """Return the list of catalog products, raising CatalogError if unavailable.
+
+    With ``CATALOG_SOURCE = 'db'`` the catalog is read from the table filled by
+    `manage.py sync_catalog` instead of the upstream API.
+    """
+    if settings.CATALOG_SOURCE == 'db':
+        return catalog_from_db()
+    return get_catalog_cache().get()
+
+
+def collectable_feed():
+    """Feed items add_product may store that are not in the catalog table yet.
+
+    With ``CATALOG_SOURCE = 'db'`` the synced table is the whole catalog, so
+    there are none; otherwise they are the cached upstream feed.
+    """
+    if settings.CATALOG_SOURCE == 'db':
+        return []
+    try:
+        return get_catalog_cache().get()
+    except CatalogError:
+        return []
+
+
+async def aget_catalog_versioned():
+    """Async get_catalog() for the async views, returning ``(products, version)``.
+
+    `version` changes whenever the catalog does (None when nothing is cached);
+    it keys the cached product cards and the catalog page's ETag.
+    """
+    if settings.CATALOG_SOURCE == 'db':
+        return await sync_to_async(lambda: (catalog_from_db(), db_catalog_version()))()
+    return await get_catalog_cache().aget_versioned()
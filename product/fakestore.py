@@ -0,0 +1,93 @@
+"""Local stand-in for the fake store API, used by the tests and the load-test commands."""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SAMPLE_PRODUCTS = [
+    {
+        'id': 1,
+        'title': 'Backpack',
+        'price': 109.95,
+        'description': 'Your perfect pack for everyday use',
+        'category': "men's clothing",
+        'image': 'https://example.com/1.jpg',
+        'rating': {'rate': 3.9, 'count': 120},
+    },
+]
+
+
+CATEGORIES = ["men's clothing", "women's clothing", 'electronics', 'jewelery']
+
+
+def synthetic_products(count, seed=0):
+    """`count` products shaped like the fake store feed, the same for the same `seed`."""
+    rng = random.Random(seed)
+    return [
+        {
+            'id': i,
+            'title': f'Synthetic product number {i} with a reasonably long title',
+            'price': round(rng.uniform(5, 700), 2),
+            'description': 'A description long enough to be truncated on the front of the card. ' * 3,
+            'category': CATEGORIES[i % len(CATEGORIES)],
+            'image': f'https://example.com/images/{i}.jpg',
+            'rating': {'rate': round(rng.uniform(1, 5), 1), 'count': rng.randrange(1000)},
+        }
+        for i in range(1, count + 1)
+    ]
+
+
+class FakeCatalogServer:
+    """Local stand-in for the fake store API, counting the requests it serves.
+
+    Faults are injected by appending to ``faults``; each request consumes the
+    first one. A fault is an HTTP status to answer with, ``'drop'`` to close
+    the connection without answering, or a number of seconds to stall before
+    answering normally.
+
+    ``files`` maps other paths (e.g. ``'/img/1.png'``) to ``(content_type,
+    body)`` pairs served as is, so the server can stand in for the image host.
+    """
+
+    def __init__(self, products=SAMPLE_PRODUCTS, delay=0, status=200, files=None, port=0):
+        self.products = products
+        self.files = files or {}
+        self.delay = delay
+        self.status = status
+        self.faults = []
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests += 1
+                fault = server.faults.pop(0) if server.faults else None
+                if fault == 'drop':
+                    self.close_connection = True
+                    return
+                status = fault if isinstance(fault, int) else server.status
+                time.sleep(fault if isinstance(fault, float) else server.delay)
+                content_type, body = server.files.get(self.path) or ('application/json', None)
+                if body is None:
+                    body = json.dumps(server.products).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.base_url = 'http://127.0.0.1:%d' % self.httpd.server_port
+        self.url = self.base_url + '/products'
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, args=(0.05,), daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,259 @@
+"""Product image thumbnails, fetched once from the upstream host and kept under MEDIA_ROOT.
+
+The first request for a source URL downloads it and writes every width in
+IMAGE_THUMBNAIL_WIDTHS as WebP and JPEG to ``thumbs/<digest>/``, where
+``<digest>`` is the hash of the source bytes, so one picture behind two URLs
+is stored once. A small index file per URL (``thumbs/src/``) records that
+digest; once it exists the source is never fetched again, by this process or
+any other sharing MEDIA_ROOT.
+
+The proxy view is async: sources are downloaded with product.upstream's
+async client and encoded in worker threads, so under ASGI a slow source or
+a large encode never holds up the event loop.
+
+Pillow is optional: without it ``athumbnail()`` raises ImageError and the
+proxy view sends browsers to the source image instead.
+"""
+import asyncio
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import weakref
+from urllib.parse import urlsplit
+
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.utils.crypto import constant_time_compare
+
+from . import upstream
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = ImageOps = None
+
+# format -> (Pillow encoder, file extension, content type)
+FORMATS = {
+    'webp': ('WEBP', 'webp', 'image/webp'),
+    'jpeg': ('JPEG', 'jpg', 'image/jpeg'),
+}
+
+# Sources are downloaded in pieces of this many bytes, see _download()
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+
+# Concurrent first requests for the same URL wait for one download instead of
+# each fetching it; URLs share a fixed set of locks so the set never grows.
+# asyncio locks work within one event loop, so each loop has its own set (see
+# _lock()), and thread locks keep requests on different loops from encoding
+# the same source twice (see _store()).
+_locks = weakref.WeakKeyDictionary()
+_thread_locks = [threading.Lock() for _ in range(64)]
+
+
+class ImageError(Exception):
+    pass
+
+
+def allowed(url):
+    """Whether the proxy may fetch `url` (http(s) on one of IMAGE_PROXY_ALLOWED_HOSTS)."""
+    parts = urlsplit(url or '')
+    return parts.scheme in ('http', 'https') and parts.hostname in settings.IMAGE_PROXY_ALLOWED_HOSTS
+
+
+def signature(url):
+    """Signature the proxy requires along with `url`, so it only fetches sources this site links to."""
+    return signing.Signer(salt='product.images').signature(url)
+
+
+def signed(url, value):
+    """Whether `value` is the signature of `url`."""
+    return constant_time_compare(signature(url), value or '')
+
+
+def thumbnail_width(value):
+    """The smallest configured width of at least `value` (the largest if none is, or `value` is invalid)."""
+    widths = sorted(settings.IMAGE_THUMBNAIL_WIDTHS)
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return widths[-1]
+    return next((w for w in widths if w >= value), widths[-1])
+
+
+def _root():
+    return os.path.join(settings.MEDIA_ROOT, 'thumbs')
+
+
+def _index_path(url):
+    key = hashlib.sha256(url.encode()).hexdigest()
+    return os.path.join(_root(), 'src', key[:2], key)
+
+
+def _thumb_path(digest, width, fmt):
+    return os.path.join(_root(), digest[:2], digest, f'{width}.{FORMATS[fmt][1]}')
+
+
+def _write(path, data):
+    """Write `data` to `path` atomically, so readers never see a partial file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _read_index(url):
+    try:
+        with open(_index_path(url)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _encode(image, width, fmt):
+    encoder = FORMATS[fmt][0]
+    if image.width > width:
+        image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+    if encoder == 'JPEG' and image.mode != 'RGB':
+        # JPEG has no alpha channel; flatten transparent product shots onto white
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A') if image.mode == 'RGBA' else None)
+        image = background
+    out = io.BytesIO()
+    image.save(out, encoder, quality=settings.IMAGE_THUMBNAIL_QUALITY, optimize=True)
+    return out.getvalue()
+
+
+def _generate(content):
+    """Write every thumbnail of the source image `content`; return its digest."""
+    digest = hashlib.sha256(content).hexdigest()[:32]
+    if all(os.path.exists(_thumb_path(digest, w, fmt)) for w in settings.IMAGE_THUMBNAIL_WIDTHS for fmt in FORMATS):
+        return digest
+    try:
+        image = Image.open(io.BytesIO(content))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise ImageError(f'Unreadable image: {e}') from e
+    for width in settings.IMAGE_THUMBNAIL_WIDTHS:
+        for fmt in FORMATS:
+            _write(_thumb_path(digest, width, fmt), _encode(image, width, fmt))
+    return digest
+
+
+def _check(url, status_code, headers):
+    if status_code != 200:
+        raise ImageError(f'{url} answered {status_code}')
+    length = headers.get('Content-Length', '')
+    if length.isdigit() and int(length) > settings.IMAGE_PROXY_MAX_BYTES:
+        raise ImageError(f'{url} is larger than IMAGE_PROXY_MAX_BYTES')
+
+
+def _add_chunk(url, content, chunk):
+    content += chunk
+    if len(content) > settings.IMAGE_PROXY_MAX_BYTES:
+        raise ImageError(f'{url} is larger than IMAGE_PROXY_MAX_BYTES')
+
+
+def _download(url):
+    """The body of the image at `url`, abandoned as soon as it passes IMAGE_PROXY_MAX_BYTES.
+
+    Used in a worker thread when httpx is not installed, see _adownload().
+    """
+    try:
+        response = upstream.get(url, timeout=settings.IMAGE_PROXY_FETCH_TIMEOUT,
+                                endpoint=f'{urlsplit(url).netloc} (images)', stream=True)
+    except upstream.UpstreamError as e:
+        raise ImageError(f'Could not fetch {url}: {e}') from e
+    with response:
+        _check(url, response.status_code, response.headers)
+        content = bytearray()
+        try:
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_BYTES):
+                _add_chunk(url, content, chunk)
+        except requests.RequestException as e:
+            raise ImageError(f'Could not fetch {url}: {e}') from e
+    return bytes(content)
+
+
+async def _adownload(url):
+    """_download() without blocking the event loop."""
+    if upstream.httpx is None:
+        return await sync_to_async(_download, thread_sensitive=False)(url)
+    try:
+        response = await upstream.aget(url, timeout=settings.IMAGE_PROXY_FETCH_TIMEOUT,
+                                       endpoint=f'{urlsplit(url).netloc} (images)', stream=True)
+    except upstream.UpstreamError as e:
+        raise ImageError(f'Could not fetch {url}: {e}') from e
+    try:
+        _check(url, response.status_code, response.headers)
+        content = bytearray()
+        try:
+            async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_BYTES):
+                _add_chunk(url, content, chunk)
+        except upstream.httpx.HTTPError as e:
+            raise ImageError(f'Could not fetch {url}: {e}') from e
+    finally:
+        await response.aclose()
+    return bytes(content)
+
+
+def _cached_digest(url, width, fmt):
+    """Digest of the image at `url` if its `fmt` thumbnail at `width` is on disk, else None.
+
+    None also when IMAGE_THUMBNAIL_WIDTHS changed since the source was fetched,
+    so that it is fetched again.
+    """
+    digest = _read_index(url)
+    if digest and os.path.exists(_thumb_path(digest, width, fmt)):
+        return digest
+    return None
+
+
+def _store(url, width, fmt, content):
+    """Write the thumbnails of `content`, downloaded from `url`; return its digest."""
+    with _thread_locks[hash(url) % len(_thread_locks)]:
+        # Another event loop (under WSGI, another request) may have stored it meanwhile
+        digest = _cached_digest(url, width, fmt)
+        if digest:
+            return digest
+        digest = _generate(content)
+        # Written last: an index entry means every thumbnail is already on disk
+        _write(_index_path(url), digest.encode())
+        return digest
+
+
+def _lock(url):
+    loop = asyncio.get_running_loop()
+    locks = _locks.get(loop)
+    if locks is None:
+        locks = _locks[loop] = [asyncio.Lock() for _ in range(len(_thread_locks))]
+    return locks[hash(url) % len(locks)]
+
+
+async def athumbnail(url, width, fmt):
+    """Path of the `fmt` thumbnail of `url` at `width` (a configured width), creating it if needed.
+
+    The download is async and the disk and Pillow work runs in worker
+    threads, so the event loop is never blocked. Raises ImageError if the
+    source cannot be fetched or decoded.
+    """
+    cached_digest = sync_to_async(_cached_digest, thread_sensitive=False)
+    digest = await cached_digest(url, width, fmt)
+    if digest is None:
+        if Image is None:
+            raise ImageError('Pillow is not installed')
+        async with _lock(url):
+            digest = await cached_digest(url, width, fmt)
+            if digest is None:
+                content = await _adownload(url)
+                digest = await sync_to_async(_store, thread_sensitive=False)(url, width, fmt, content)
+    return _thumb_path(digest, width, fmt)
@@ -0,0 +1,55 @@
+import statistics
+import time
+
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+from django.test import RequestFactory
+
+from product.catalog import catalog_version
+from product.fakestore import synthetic_products
+from user.models import User
+
+
+class Command(BaseCommand):
+    help = 'Time rendering the catalog page with and without the cached product cards (no database needed).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10000, help='Number of synthetic products on the page.')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed renders per case.')
+
+    def handle(self, *args, **options):
+        products = synthetic_products(options['products'])
+        version = catalog_version(products)
+        request = RequestFactory().get('/product/')
+        request.user = User(username='bench')
+        cache = caches['template_fragments']
+
+        def render(context):
+            started = time.perf_counter()
+            render_to_string('product/allproduct.html', context, request=request)
+            return (time.perf_counter() - started) * 1000
+
+        def report(label, timings):
+            self.stdout.write(f'{label:>24}: median {statistics.median(timings):8.1f}ms')
+
+        report('uncached', [render({'products': products}) for _ in range(options['repeat'])])
+
+        cold = []
+        for _ in range(options['repeat']):
+            cache.clear()
+            cold.append(render({'products': products, 'catalog_version': version}))
+        report('cold cache', cold)
+
+        # Cards cached, grid not: the same products in an order not rendered before
+        render({'products': products, 'catalog_version': version})
+        warm_cards = []
+        for i in range(1, options['repeat'] + 1):
+            rotated = products[i:] + products[:i]
+            warm_cards.append(render({'products': rotated, 'catalog_version': version}))
+        report('cards cached', warm_cards)
+
+        report('cards and grid cached', [
+            render({'products': products, 'catalog_version': version}) for _ in range(options['repeat'])
+        ])
+        cache.clear()
@@ -0,0 +1,126 @@
+import os
+import random
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections, transaction
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from product.fakestore import synthetic_products
+from product.models import CatalogItem, Product
+
+# Profile name -> DATABASES entry overrides, see SQLITE_PRODUCTION in main/settings.py
+PROFILES = {
+    'default': {},
+    'production': {
+        'OPTIONS': settings.SQLITE_PRODUCTION_OPTIONS,
+        'CONN_MAX_AGE': settings.SQLITE_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+    },
+}
+# Share of the writes that are logins (user read, last_login update and a new session, in one transaction)
+LOGIN_SHARE = 0.2
+
+
+class Command(BaseCommand):
+    help = (
+        'Hammer a fresh SQLite file with add-product and login writes from many threads, with the default '
+        'settings and with the production profile, and report writes per second and "database is locked" errors.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profile', action='append', choices=list(PROFILES),
+                            help='Settings to test (repeatable; default: both).')
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--writes', type=int, default=200, help='Writes per thread.')
+        parser.add_argument('--catalog', type=int, default=200, help='Catalog items the products are drawn from.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        for name in options['profile'] or list(PROFILES):
+            with tempfile.TemporaryDirectory() as directory:
+                alias = f'bench_sqlite_{name}'
+                connections.settings[alias] = dict(
+                    connections.settings['default'], NAME=os.path.join(directory, 'db.sqlite3'), **PROFILES[name],
+                )
+                try:
+                    call_command('migrate', database=alias, verbosity=0)
+                    result = self.run(alias, options)
+                    with connections[alias].cursor() as cursor:
+                        cursor.execute('PRAGMA journal_mode')
+                        journal_mode = cursor.fetchone()[0]
+                finally:
+                    connections[alias].close()
+                    del connections[alias]
+                    del connections.settings[alias]
+            self.stdout.write(self.style.SUCCESS(
+                f'{name} (journal_mode={journal_mode}): {result["writes"]} writes in {result["elapsed"]:.2f}s, '
+                f'{result["writes"] / result["elapsed"]:.0f} writes/s, {result["locked"]} lock errors, '
+                f'{result["connections"]} connections opened'
+            ))
+
+    def run(self, alias, options):
+        User = get_user_model()
+        users = User.objects.using(alias).bulk_create(
+            [User(username=f'writer{i}', email=f'writer{i}@example.com', name=f'Writer {i}')
+             for i in range(options['threads'])]
+        )
+        feed = synthetic_products(options['catalog'], seed=options['seed'])
+        counts = {'writes': 0, 'locked': 0, 'connections': 0}
+        lock = threading.Lock()
+
+        def worker(i):
+            rng = random.Random(options['seed'] * 1000 + i)
+            connection = connections[alias]
+            writes = locked = opened = 0
+            for _ in range(options['writes']):
+                # Each write stands for one request: connections go back at its end
+                # unless CONN_MAX_AGE keeps them, as in Django's request cycle
+                if connection.connection is None:
+                    opened += 1
+                try:
+                    if rng.random() < LOGIN_SHARE:
+                        self.login(alias, users[i])
+                    else:
+                        self.add_product(alias, users[i], rng.choice(feed)['id'], feed)
+                    writes += 1
+                except OperationalError as e:
+                    if 'locked' not in str(e):
+                        raise
+                    locked += 1
+                connection.close_if_unusable_or_obsolete()
+            connection.close()
+            with lock:
+                counts['writes'] += writes
+                counts['locked'] += locked
+                counts['connections'] += opened
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(options['threads'])]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return dict(counts, elapsed=time.perf_counter() - started)
+
+    def add_product(self, alias, user, external_id, feed):
+        # What add_product does: resolve the shared item (stored from the feed on first use), then upsert the user's row
+        item_ids = CatalogItem.objects.db_manager(alias).resolve([external_id], feed=lambda: feed)
+        product = Product(user=user, item_id=item_ids[external_id])
+        Product.objects.db_manager(alias).add_to_collection(product, bump=True)
+
+    def login(self, alias, user):
+        # What a login writes: the account is read, then last_login and a new session written
+        with transaction.atomic(using=alias):
+            get_user_model().objects.using(alias).filter(pk=user.pk).values_list('password', flat=True).get()
+            get_user_model().objects.using(alias).filter(pk=user.pk).update(last_login=timezone.now())
+            Session.objects.using(alias).create(
+                session_key=get_random_string(32), session_data='', expire_date=timezone.now(),
+            )
@@ -0,0 +1,93 @@
+import re
+import tempfile
+
+from django.conf import settings
+from django.contrib.staticfiles import views as staticfiles_views
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.http import HttpResponseNotFound
+from django.template.loader import render_to_string
+from django.test import RequestFactory
+from django.test.utils import override_settings
+
+from main.staticfiles import StaticFilesMiddleware
+from user.models import User
+
+PAGES = {
+    'user/login.html': {},
+    'user/register.html': {},
+    'product/allproduct.html': {'products': []},
+}
+ACCEPT_ENCODING = 'gzip, deflate, br'
+
+
+def transfer_size(response):
+    """Bytes on the wire for `response`: status line, headers and body."""
+    body = b''.join(response.streaming_content) if response.streaming else response.content
+    headers = sum(len(key) + len(value) + 4 for key, value in response.items())
+    return 17 + headers + len(body)
+
+
+class Command(BaseCommand):
+    help = 'Measure the static bytes a first and a repeat visit transfer, with plain and hashed, precompressed static files.'
+
+    def handle(self, *args, **options):
+        self.factory = RequestFactory()
+        manifest_storages = dict(settings.STORAGES, staticfiles={
+            'BACKEND': 'main.staticfiles.CompressedManifestStaticFilesStorage',
+        })
+        plain_storages = dict(settings.STORAGES, staticfiles={
+            'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+        })
+
+        with override_settings(STATIC_MANIFEST=False, STORAGES=plain_storages):
+            self.report('unversioned (runserver)', self.visit(self.serve_unversioned))
+
+        # Hashed names are only used in templates with DEBUG off
+        with tempfile.TemporaryDirectory() as root, \
+                override_settings(DEBUG=False, STATIC_MANIFEST=True, STATIC_ROOT=root, STORAGES=manifest_storages):
+            call_command('collectstatic', interactive=False, verbosity=0)
+            middleware = StaticFilesMiddleware(lambda request: HttpResponseNotFound())
+            self.report('hashed + compressed', self.visit(middleware))
+
+    def serve_unversioned(self, request):
+        return staticfiles_views.serve(request, request.path[len(settings.STATIC_URL):], insecure=True)
+
+    def assets(self):
+        """Static URLs linked from the benchmarked pages, in page order."""
+        request = self.factory.get('/')
+        request.user = User(username='bench')
+        pattern = re.compile(r'(?:href|src)="(%s[^"]+)"' % re.escape(settings.STATIC_URL))
+        urls = []
+        for template, context in PAGES.items():
+            for url in pattern.findall(render_to_string(template, context, request=request)):
+                if url not in urls:
+                    urls.append(url)
+        return urls
+
+    def visit(self, serve):
+        """Fetch every asset once, then again as a browser with a warm cache would."""
+        first = {}
+        for url in self.assets():
+            response = serve(self.factory.get(url, HTTP_ACCEPT_ENCODING=ACCEPT_ENCODING))
+            first[url] = (response, transfer_size(response))
+
+        repeat_bytes = repeat_requests = 0
+        for url, (response, _) in first.items():
+            if 'immutable' in response.get('Cache-Control', ''):
+                continue
+            headers = {'HTTP_ACCEPT_ENCODING': ACCEPT_ENCODING}
+            if response.has_header('ETag'):
+                headers['HTTP_IF_NONE_MATCH'] = response['ETag']
+            if response.has_header('Last-Modified'):
+                headers['HTTP_IF_MODIFIED_SINCE'] = response['Last-Modified']
+            repeat_bytes += transfer_size(serve(self.factory.get(url, **headers)))
+            repeat_requests += 1
+        return len(first), sum(size for _, size in first.values()), repeat_requests, repeat_bytes
+
+    def report(self, label, result):
+        assets, first_bytes, repeat_requests, repeat_bytes = result
+        self.stdout.write(
+            f'{label:>24}: first visit {assets} requests, {first_bytes / 1024:7.1f} KiB; '
+            f'repeat visit {repeat_requests} requests, {repeat_bytes / 1024:7.1f} KiB'
+        )
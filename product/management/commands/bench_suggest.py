@@ -0,0 +1,63 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from product.suggest import SuggestIndex
+
+WORDS = (
+    'red blue green black white leather cotton denim slim fit casual jacket shirt '
+    'dress ring gold silver bracelet laptop monitor drive backpack watch phone case'
+).split()
+CATEGORIES = ["men's clothing", "women's clothing", 'electronics', 'jewelery']
+
+
+class Command(BaseCommand):
+    help = 'Microbenchmark the typeahead prefix index on synthetic titles (no database needed).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=1000000, help='Number of synthetic titles to index.')
+        parser.add_argument('--lookups', type=int, default=10000, help='Number of timed lookups.')
+        parser.add_argument('--updates', type=int, default=1000, help='Changed items applied incrementally after the build.')
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        n = options['items']
+
+        items = [
+            (i, ' '.join(rng.sample(WORDS, 4)) + f' {i}', rng.choice(CATEGORIES), rng.randint(0, 50) / 10, rng.randint(0, 999))
+            for i in range(1, n + 1)
+        ]
+
+        index = SuggestIndex(merge_threshold=0)
+        started = time.perf_counter()
+        index.update(items)
+        self.stdout.write(f'Built index of {len(index)} titles in {time.perf_counter() - started:.2f}s')
+
+        index.merge_threshold = 10000
+        changed = [(i, f'renamed {title}', category, rate, count) for i, title, category, rate, count in rng.sample(items, options['updates'])]
+        started = time.perf_counter()
+        index.update(changed)
+        self.stdout.write(f'Applied {len(changed)} changed items in {(time.perf_counter() - started) * 1000:.1f}ms')
+
+        # Prefixes of 1 character up to a full word, the way a user types them
+        prefixes = []
+        for _ in range(options['lookups']):
+            word = rng.choice(WORDS + ['renamed'])
+            prefixes.append(word[:rng.randint(1, len(word))])
+
+        timings = []
+        for prefix in prefixes:
+            started = time.perf_counter()
+            index.suggest(prefix, 8)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+
+        def pct(p):
+            return timings[min(len(timings) - 1, int(len(timings) * p))]
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(timings)} lookups: mean {statistics.mean(timings):.3f}ms, '
+            f'p50 {pct(0.50):.3f}ms, p99 {pct(0.99):.3f}ms, max {timings[-1]:.3f}ms'
+        ))
@@ -0,0 +1,118 @@
+import json
+import subprocess
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from product import benchmark, catalog
+from product.fakestore import FakeCatalogServer, synthetic_products
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay a fixed mix of catalog, profile, add-product and login requests as the users from '
+        '`manage.py seed_scale`, over the test client and/or real HTTP, and report throughput, '
+        'p50/p95/p99 latency and queries per request for each view.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--transport', action='append', choices=['client', 'wsgi', 'asgi'],
+                            help='Where to send requests (repeatable; default: client and wsgi).')
+        parser.add_argument('--requests', type=int, default=500, help='Requests per transport.')
+        parser.add_argument('--concurrency', type=int, default=8, help='Workers sending requests at once.')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for the request mix.')
+        parser.add_argument('--prefix', default='scale', help='Username prefix of the seeded users.')
+        parser.add_argument('--password', default='scale-password', help='Password of the seeded users.')
+        parser.add_argument('--catalog-size', type=int, default=1000, help='Products served by the stand-in catalog API.')
+        parser.add_argument('--upstream-delay', type=float, default=0, help='Seconds the stand-in API takes to answer.')
+        parser.add_argument('--json', dest='json_path', help='Write the results to this file.')
+        parser.add_argument('--compare', help='Results file from an earlier run to compare against.')
+
+    def handle(self, *args, **options):
+        transports = options['transport'] or ['client', 'wsgi']
+        users = list(
+            get_user_model().objects.filter(username__startswith=options['prefix']).order_by('username')[:options['concurrency']]
+        )
+        if not users:
+            raise CommandError(f'No users named {options["prefix"]}*; run `manage.py seed_scale` first.')
+        products = synthetic_products(options['catalog_size'], seed=options['seed'])
+        run_args = (users, products, options['password'], options['requests'], options['concurrency'], options['seed'])
+
+        results = {}
+        with FakeCatalogServer(products, delay=options['upstream_delay']) as upstream:
+            for name in transports:
+                if name == 'client':
+                    # Every login takes longer than the slow-request threshold; don't log them here
+                    with override_settings(CATALOG_API_URL=upstream.url, RATELIMIT_ENABLED=False, ALLOWED_HOSTS=['testserver'],
+                                           REQUEST_TIMING_SLOW_MS=float('inf')):
+                        catalog._catalog_cache = None
+                        results[name] = benchmark.run(benchmark.ClientTransport(), *run_args)
+                        catalog._catalog_cache = None
+                    continue
+                env = {
+                    'CATALOG_API_URL': upstream.url,
+                    'RATELIMIT_ENABLED': '0',
+                    'REQUEST_TIMING_ENABLED': '1',
+                    'REQUEST_TIMING_HEADER': '1',
+                    'REQUEST_TIMING_SAMPLE_RATE': '1',
+                }
+                with benchmark.server(name, env) as base_url:
+                    results[name] = benchmark.run(benchmark.HttpTransport(name, base_url), *run_args)
+
+        report = {
+            'commit': self.git_commit(),
+            'database': settings.DATABASES['default']['ENGINE'].rsplit('.', 1)[-1],
+            'options': {key: options[key] for key in ('requests', 'concurrency', 'seed', 'catalog_size', 'upstream_delay')},
+            'mix': benchmark.MIX,
+            'results': results,
+        }
+        baseline = self.load(options['compare']) if options['compare'] else None
+        for name, result in results.items():
+            self.print_result(name, result, (baseline or {}).get('results', {}).get(name))
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+            self.stdout.write(f'Results written to {options["json_path"]}')
+
+    def git_commit(self):
+        try:
+            commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                                    capture_output=True, text=True, check=True).stdout.strip()
+            dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=settings.BASE_DIR,
+                                   capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+        return commit + ('-dirty' if dirty else '')
+
+    def load(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Could not read {path}: {e}')
+
+    def print_result(self, name, result, baseline):
+        overall = result['overall']
+        self.stdout.write(self.style.SUCCESS(
+            f'{name}: {overall["throughput"]:.1f} req/s over {overall["requests"]} requests, {overall["errors"]} errors'
+        ))
+        self.stdout.write(f'  {"view":<12} {"req/s":>8} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"queries":>8} {"errors":>7}')
+        for view, stats in result['views'].items():
+            queries = stats['queries_per_request']
+            self.stdout.write(
+                f'  {view:<12} {stats["throughput"]:>8.1f} {stats["p50_ms"]:>9.1f} {stats["p95_ms"]:>9.1f} '
+                f'{stats["p99_ms"]:>9.1f} {"-" if queries is None else f"{queries:.1f}":>8} {stats["errors"]:>7}'
+            )
+            before = (baseline or {}).get('views', {}).get(view)
+            if before:
+                self.stdout.write(
+                    f'  {"  vs before":<12} {self.change(before["throughput"], stats["throughput"]):>8} '
+                    f'{self.change(before["p50_ms"], stats["p50_ms"]):>9} {self.change(before["p95_ms"], stats["p95_ms"]):>9} '
+                    f'{self.change(before["p99_ms"], stats["p99_ms"]):>9}'
+                )
+
+    @staticmethod
+    def change(before, after):
+        return f'{(after - before) / before * 100:+.0f}%' if before else '-'
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from product.fakestore import FakeCatalogServer, synthetic_products
+
+
+class Command(BaseCommand):
+    help = 'Run a local stand-in for the fake store API (point CATALOG_API_URL at the URL it prints).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8001)
+        parser.add_argument('--products', type=int, default=20, help='Synthetic products in the feed.')
+        parser.add_argument('--delay', type=float, default=0, help='Seconds to wait before answering.')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for the synthetic products.')
+
+    def handle(self, *args, **options):
+        products = synthetic_products(options['products'], seed=options['seed'])
+        with FakeCatalogServer(products, delay=options['delay'], port=options['port']) as server:
+            self.stdout.write(self.style.SUCCESS(f'Serving {len(products)} products at {server.url} (Ctrl-C to stop)'))
+            try:
+                while True:
+                    time.sleep(3600)
+            except KeyboardInterrupt:
+                pass
@@ -0,0 +1,104 @@
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from product.benchmark import SERVERS, free_port, login_session, wait_for
+from product.fakestore import FakeCatalogServer
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+class Command(BaseCommand):
+    help = (
+        'Load-test /product/ under WSGI (runserver) and ASGI (uvicorn) against a local, slow stand-in '
+        'for the catalog API, with caching off so every request goes upstream.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--server', choices=['wsgi', 'asgi', 'both'], default='both')
+        parser.add_argument('--requests', type=int, default=1000, help='Total requests per server.')
+        parser.add_argument('--concurrency', type=int, default=100, help='Requests in flight at once.')
+        parser.add_argument('--upstream-delay', type=float, default=0.2, help='Seconds the stand-in API takes to answer.')
+
+    def handle(self, *args, **options):
+        if httpx is None:
+            raise CommandError('The load test needs httpx (pip install httpx uvicorn).')
+
+        session_key = self.login_session()
+        servers = ['wsgi', 'asgi'] if options['server'] == 'both' else [options['server']]
+
+        with FakeCatalogServer(delay=options['upstream_delay']) as upstream:
+            for name in servers:
+                result = self.run_server(name, upstream.url, session_key, options)
+                self.stdout.write(self.style.SUCCESS(
+                    f"{name}: {result['throughput']:.1f} req/s, p50 {result['p50']:.0f}ms, "
+                    f"p99 {result['p99']:.0f}ms, {result['errors']} errors "
+                    f"({options['requests']} requests, concurrency {options['concurrency']})"
+                ))
+
+    def login_session(self):
+        # A session for a throwaway user, so requests get past @login_required
+        User = get_user_model()
+        user, created = User.objects.get_or_create(
+            username='loadtest', defaults={'email': 'loadtest@example.com', 'name': 'Load Test'}
+        )
+        if created:
+            user.set_unusable_password()
+            user.save()
+        return login_session(user)
+
+    def run_server(self, name, upstream_url, session_key, options):
+        port = free_port()
+        command = [sys.executable] + [arg.format(port=port) for arg in SERVERS[name]]
+        env = dict(os.environ, CATALOG_API_URL=upstream_url, CATALOG_CACHE_TTL='0')
+        process = subprocess.Popen(command, cwd=settings.BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            url = f'http://127.0.0.1:{port}/product/'
+            wait_for(port)
+            return asyncio.run(self.load(url, session_key, options['requests'], options['concurrency']))
+        finally:
+            process.terminate()
+            process.wait()
+
+    async def load(self, url, session_key, total, concurrency):
+        latencies = []
+        errors = 0
+        queue = asyncio.Queue()
+        for _ in range(total):
+            queue.put_nowait(None)
+
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(cookies={'sessionid': session_key}, limits=limits, timeout=60) as client:
+            async def worker():
+                nonlocal errors
+                while not queue.empty():
+                    queue.get_nowait()
+                    started = time.perf_counter()
+                    try:
+                        response = await client.get(url)
+                        ok = response.status_code == 200 and b'productsGrid' in response.content
+                    except httpx.HTTPError:
+                        ok = False
+                    latencies.append((time.perf_counter() - started) * 1000)
+                    errors += not ok
+
+            started = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        return {
+            'throughput': total / elapsed,
+            'p50': statistics.median(latencies),
+            'p99': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+            'errors': errors,
+        }
@@ -0,0 +1,91 @@
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from product.catalog import item_fields, item_hash
+from product.fakestore import synthetic_products
+from product.models import CatalogItem, Product
+
+
+class Command(BaseCommand):
+    help = (
+        'Bulk-generate N users with M collection products each (and the catalog they are drawn from) '
+        'for benchmarks. The same options always produce the same data; existing rows are left alone.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--products-per-user', type=int, default=20)
+        parser.add_argument('--catalog', type=int, default=1000, help='Catalog items the products are drawn from.')
+        parser.add_argument('--prefix', default='scale', help='Username prefix of the generated users.')
+        parser.add_argument('--password', default='scale-password', help='Password of every generated user.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per INSERT.')
+        parser.add_argument('--clear', action='store_true', help='First delete the users with this prefix and their products.')
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        prefix, batch_size = options['prefix'], options['batch_size']
+        per_user = min(options['products_per_user'], options['catalog'])
+        rng = random.Random(options['seed'])
+
+        if options['clear']:
+            deleted, _ = User.objects.filter(username__startswith=prefix).delete()
+            self.stdout.write(f'Deleted {deleted} rows')
+
+        started = time.perf_counter()
+        catalog = synthetic_products(options['catalog'], seed=options['seed'])
+        CatalogItem.objects.bulk_create(
+            [CatalogItem(content_hash=item_hash(item), **item_fields(item)) for item in catalog],
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        )
+        # external_id -> id, looked up in batches to stay under SQLite's limit on query parameters
+        external_ids = [item['id'] for item in catalog]
+        item_ids = {}
+        for start in range(0, len(external_ids), batch_size):
+            item_ids.update(
+                CatalogItem.objects.filter(external_id__in=external_ids[start:start + batch_size])
+                .values_list('external_id', 'id')
+            )
+
+        # Hashing is deliberately slow; every generated user shares one hash
+        password = make_password(options['password'])
+        users = [
+            User(username=f'{prefix}{i:07d}', email=f'{prefix}{i:07d}@example.com', name=f'Scale User {i}', password=password)
+            for i in range(options['users'])
+        ]
+        with transaction.atomic():
+            User.objects.bulk_create(users, batch_size=batch_size, ignore_conflicts=True)
+        user_ids = list(
+            User.objects.filter(username__startswith=prefix).order_by('username').values_list('id', flat=True)
+        )[:options['users']]
+        users_done = time.perf_counter()
+
+        # bulk_create(ignore_conflicts=True) doesn't report skipped rows; count the table before and after instead
+        existing = Product.objects.count()
+        batch = []
+        for user_id in user_ids:
+            for item in rng.sample(catalog, per_user):
+                batch.append(Product(user_id=user_id, item_id=item_ids[item['id']], quantity=rng.randint(1, 5)))
+            if len(batch) >= batch_size:
+                self.insert_products(batch)
+                batch = []
+        self.insert_products(batch)
+        products = Product.objects.count() - existing
+        finished = time.perf_counter()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(user_ids)} users ({users_done - started:.1f}s) and {products} products, existing ones skipped '
+            f'({finished - users_done:.1f}s, {products / max(finished - users_done, 1e-9):.0f} rows/s); '
+            f'log in as {prefix}0000000 / {options["password"]}'
+        ))
+
+    def insert_products(self, batch):
+        # Items a user already has are skipped, so re-running tops up rather than duplicates
+        with transaction.atomic():
+            Product.objects.bulk_create(batch, ignore_conflicts=True)
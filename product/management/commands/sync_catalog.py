@@ -0,0 +1,85 @@
+import json
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from product.catalog import CatalogError, feed_item_id, fetch_catalog, item_fields, item_hash
+from product.models import CatalogItem
+
+UPDATE_FIELDS = ['title', 'price', 'description', 'category', 'image_url', 'rate', 'count', 'content_hash', 'updated_at']
+
+
+class Command(BaseCommand):
+    help = 'Pull the upstream catalog feed and upsert only the items that changed into the local catalog table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default=settings.CATALOG_API_URL, help='Catalog feed URL (default: CATALOG_API_URL).')
+        parser.add_argument('--file', help='Read the feed from a local JSON file instead of the URL.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per insert/update transaction.')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        batch_size = options['batch_size']
+
+        feed = self.load_feed(options)
+
+        # One query for the current state: external_id -> content_hash
+        existing = dict(CatalogItem.objects.values_list('external_id', 'content_hash').iterator())
+
+        changed = []
+        created = 0
+        skipped = 0
+        # Items without a usable id, or with fields that don't convert, are left out rather than failing the sync
+        malformed = 0
+        for item in feed:
+            external_id = feed_item_id(item)
+            if external_id is None:
+                malformed += 1
+                continue
+            digest = item_hash(item)
+            current = existing.get(external_id)
+            if current == digest:
+                skipped += 1
+                continue
+            try:
+                fields = item_fields(item)
+            except (ArithmeticError, AttributeError, TypeError, ValueError):
+                malformed += 1
+                continue
+            if current is None:
+                created += 1
+            changed.append(CatalogItem(content_hash=digest, **fields))
+
+        # New and changed rows go through the same INSERT ... ON CONFLICT DO UPDATE,
+        # which is far cheaper than bulk_update()'s CASE WHEN per column.
+        for start in range(0, len(changed), batch_size):
+            with transaction.atomic():
+                CatalogItem.objects.bulk_create(
+                    changed[start:start + batch_size],
+                    update_conflicts=True,
+                    unique_fields=['external_id'],
+                    update_fields=UPDATE_FIELDS,
+                )
+
+        # Collections still on legacy items (see migration 0009) move to the feed's item of the same title
+        merged = CatalogItem.objects.merge_legacy_items()
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Scanned {len(feed)} items: {created} created, {len(changed) - created} updated, '
+            f'{skipped} unchanged, {malformed} malformed skipped, {merged} legacy items merged in {elapsed:.2f}s'
+        ))
+
+    def load_feed(self, options):
+        if options['file']:
+            try:
+                with open(options['file'], encoding='utf-8') as f:
+                    return json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f'Could not read feed file: {e}')
+        try:
+            return fetch_catalog(options['url'], settings.CATALOG_FETCH_TIMEOUT)
+        except CatalogError as e:
+            raise CommandError(str(e))
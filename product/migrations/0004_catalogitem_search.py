@@ -0,0 +1,75 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:19
+
+from django.db import migrations, models
+
+
+# External-content FTS5 index over product_catalogitem, kept in sync by triggers.
+# The 2/3-character prefix indexes keep the first keystrokes of a search cheap.
+# Only created on SQLite; product.search falls back to icontains elsewhere.
+CREATE_FTS = [
+    """
+    CREATE VIRTUAL TABLE product_catalogitem_fts USING fts5(
+        title, description, category,
+        content='product_catalogitem', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER product_catalogitem_fts_ai AFTER INSERT ON product_catalogitem BEGIN
+        INSERT INTO product_catalogitem_fts(rowid, title, description, category)
+        VALUES (new.id, new.title, new.description, new.category);
+    END
+    """,
+    """
+    CREATE TRIGGER product_catalogitem_fts_ad AFTER DELETE ON product_catalogitem BEGIN
+        INSERT INTO product_catalogitem_fts(product_catalogitem_fts, rowid, title, description, category)
+        VALUES ('delete', old.id, old.title, old.description, old.category);
+    END
+    """,
+    """
+    CREATE TRIGGER product_catalogitem_fts_au AFTER UPDATE OF title, description, category ON product_catalogitem BEGIN
+        INSERT INTO product_catalogitem_fts(product_catalogitem_fts, rowid, title, description, category)
+        VALUES ('delete', old.id, old.title, old.description, old.category);
+        INSERT INTO product_catalogitem_fts(rowid, title, description, category)
+        VALUES (new.id, new.title, new.description, new.category);
+    END
+    """,
+    "INSERT INTO product_catalogitem_fts(product_catalogitem_fts) VALUES ('rebuild')",
+]
+
+DROP_FTS = [
+    "DROP TRIGGER IF EXISTS product_catalogitem_fts_ai",
+    "DROP TRIGGER IF EXISTS product_catalogitem_fts_ad",
+    "DROP TRIGGER IF EXISTS product_catalogitem_fts_au",
+    "DROP TABLE IF EXISTS product_catalogitem_fts",
+]
+
+
+def create_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in CREATE_FTS:
+        schema_editor.execute(sql)
+
+
+def drop_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in DROP_FTS:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0003_catalogitem'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='catalogitem',
+            index=models.Index(fields=['category', 'id'], name='catalogitem_category_id_idx'),
+        ),
+        migrations.RunPython(create_fts, drop_fts),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:27
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicates(apps, schema_editor):
+    # Keep the oldest row of each (user, title) pair, give it the combined
+    # quantity and delete the rest, so the unique constraint can be added.
+    Product = apps.get_model('product', 'Product')
+    db = schema_editor.connection.alias
+    duplicates = (
+        Product.objects.using(db).values('user_id', 'title')
+        .annotate(rows=Count('id'), keep_id=Min('id'), total=Sum('quantity'))
+        .filter(rows__gt=1)
+    )
+    for group in duplicates:
+        Product.objects.using(db).filter(id=group['keep_id']).update(quantity=group['total'])
+        Product.objects.using(db).filter(user_id=group['user_id'], title=group['title']).exclude(id=group['keep_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0006_product_user_created_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='product',
+            constraint=models.UniqueConstraint(fields=('user', 'title'), name='product_unique_user_title'),
+        ),
+    ]
@@ -0,0 +1,125 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:05
+
+import importlib
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+# Columns that move from every collection row to the shared catalog item
+ITEM_FIELDS = ('title', 'price', 'description', 'category', 'image_url', 'rate', 'count')
+
+# Those columns as they were on Product, with a placeholder default so that
+# unapplying the RemoveFields can add them back to a table that has rows;
+# copy_item_fields then fills in the real values
+ITEM_COLUMNS = {
+    'title': models.CharField(max_length=255, default=''),
+    'price': models.DecimalField(decimal_places=2, max_digits=10, default=0),
+    'description': models.TextField(default=''),
+    'category': models.CharField(max_length=100, default=''),
+    'image_url': models.URLField(max_length=500, default=''),
+    'rate': models.DecimalField(decimal_places=1, max_digits=3, default=0),
+    'count': models.PositiveIntegerField(default=0),
+}
+
+
+def recreate_fts_triggers(apps, schema_editor):
+    # Altering external_id rebuilds product_catalogitem on SQLite, which drops
+    # the triggers that keep the full-text index of migration 0004 in sync.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    search = importlib.import_module('product.migrations.0004_catalogitem_search')
+    for sql in search.CREATE_FTS:
+        if 'CREATE TRIGGER' in sql:
+            schema_editor.execute(sql)
+
+
+def link_catalog_items(apps, schema_editor):
+    # Every collection row held its own copy of the item; point it at the
+    # catalog item with the same title instead. Titles the catalog does not
+    # have get one new item, built from the most recently updated copy.
+    # Titles were unique per user, so no user ends up with the same item twice.
+    Product = apps.get_model('product', 'Product')
+    CatalogItem = apps.get_model('product', 'CatalogItem')
+    db = schema_editor.connection.alias
+
+    known = set(CatalogItem.objects.using(db).values_list('title', flat=True))
+    missing = {}
+    for row in Product.objects.using(db).order_by('-updated_at').values(*ITEM_FIELDS).iterator(chunk_size=2000):
+        if row['title'] not in known and row['title'] not in missing:
+            missing[row['title']] = row
+    CatalogItem.objects.using(db).bulk_create(
+        [CatalogItem(external_id=None, content_hash='', **row) for row in missing.values()],
+        batch_size=500,
+    )
+
+    first_with_title = CatalogItem.objects.using(db).filter(title=OuterRef('title')).order_by('id').values('id')[:1]
+    Product.objects.using(db).update(item=Subquery(first_with_title))
+
+
+def unlink_catalog_items(apps, schema_editor):
+    # Reverse of link_catalog_items: the rows have their own copies back by
+    # now, so drop the items that only existed for them, letting external_id
+    # be made NOT NULL again.
+    Product = apps.get_model('product', 'Product')
+    CatalogItem = apps.get_model('product', 'CatalogItem')
+    db = schema_editor.connection.alias
+    Product.objects.using(db).update(item=None)
+    CatalogItem.objects.using(db).filter(external_id=None).delete()
+
+
+def copy_item_fields(apps, schema_editor):
+    # Reverse of dropping the copied columns: fill them in from each row's
+    # item, then merge rows of one user that now share a title (two feed items
+    # can have the same title), so product_unique_user_title can come back.
+    Product = apps.get_model('product', 'Product')
+    CatalogItem = apps.get_model('product', 'CatalogItem')
+    db = schema_editor.connection.alias
+    item = CatalogItem.objects.using(db).filter(pk=OuterRef('item_id'))
+    Product.objects.using(db).update(**{name: Subquery(item.values(name)[:1]) for name in ITEM_FIELDS})
+    unique_titles = importlib.import_module('product.migrations.0007_product_unique_user_title')
+    unique_titles.merge_duplicates(apps, schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0008_product_user_updated_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # Unapplying the AlterField below rebuilds the table again
+        migrations.RunPython(migrations.RunPython.noop, recreate_fts_triggers),
+        migrations.AlterField(
+            model_name='catalogitem',
+            name='external_id',
+            field=models.PositiveIntegerField(blank=True, null=True, unique=True),
+        ),
+        migrations.RunPython(recreate_fts_triggers, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='product',
+            name='item',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='collected', to='product.catalogitem'),
+        ),
+        migrations.RunPython(link_catalog_items, unlink_catalog_items),
+        migrations.RemoveConstraint(
+            model_name='product',
+            name='product_unique_user_title',
+        ),
+        migrations.RunPython(migrations.RunPython.noop, copy_item_fields),
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.AlterField(model_name='product', name=name, field=field) for name, field in ITEM_COLUMNS.items()
+        ]),
+        *[migrations.RemoveField(model_name='product', name=name) for name in ITEM_FIELDS],
+        migrations.AlterField(
+            model_name='product',
+            name='item',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='collected', to='product.catalogitem'),
+        ),
+        migrations.AddConstraint(
+            model_name='product',
+            constraint=models.UniqueConstraint(fields=('user', 'item'), name='product_unique_user_item'),
+        ),
+    ]
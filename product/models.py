@@ -1,31 +1,194 @@
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models import Count, Min, Sum
 from django.conf import settings
+from django.utils import timezone
+
+
+class ProductManager(models.Manager):
+    def add_to_collection(self, product, bump=False):
+        """Insert an unsaved `product` with a single INSERT ... ON CONFLICT (user, item).
+
+        Returns ``(product_id, created)``. If the user already has the item the
+        row is left alone, unless `bump` is set, in which case its quantity is
+        raised by ``product.quantity`` in the same statement. Needs RETURNING
+        support (SQLite 3.35+ or PostgreSQL).
+        """
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        meta = self.model._meta
+        fields = [f for f in meta.concrete_fields if not f.primary_key]
+
+        table = quote(meta.db_table)
+        columns = ', '.join(quote(f.column) for f in fields)
+        placeholders = ', '.join(['%s'] * len(fields))
+        values = [f.get_db_prep_save(f.pre_save(product, add=True), connection) for f in fields]
+
+        if bump:
+            quantity, updated_at = quote('quantity'), quote('updated_at')
+            on_conflict = (
+                f'DO UPDATE SET {quantity} = {table}.{quantity} + excluded.{quantity}, '
+                f'{updated_at} = excluded.{updated_at}'
+            )
+        else:
+            on_conflict = 'DO NOTHING'
+
+        sql = (
+            f'INSERT INTO {table} ({columns}) VALUES ({placeholders}) '
+            f'ON CONFLICT ({quote("user_id")}, {quote("item_id")}) {on_conflict} '
+            f'RETURNING {quote("id")}, {quote("quantity")}'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, values)
+            row = cursor.fetchone()
+
+        if row is None:
+            # DO NOTHING: the item was already in the collection
+            return None, False
+        product_id, quantity = row
+        # Stored quantities are at least 1, so a bumped row always ends up above the inserted amount
+        return product_id, quantity == product.quantity
 
 
 class Product(models.Model):
+    """An item in a user's collection: the catalog item is shared, only the quantity is per user."""
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,  
         on_delete=models.CASCADE,
         related_name='products'
     )
+    item = models.ForeignKey('CatalogItem', on_delete=models.PROTECT, related_name='collected')
+
+    quantity = models.PositiveIntegerField(default=1)  # Quantity added by user
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ProductManager()
+
+    def __str__(self):
+        return f"{self.item.title} (by {self.user.username})"
+
+    class Meta:
+        verbose_name_plural = "Products"
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'item'], name='product_unique_user_item'),
+        ]
+        indexes = [
+            # Keyset pagination of a user's products on the profile page
+            models.Index(fields=['user', 'created_at', 'id'], name='product_user_created_idx'),
+            # Covers the profile page's ETag query (latest change and row count per user)
+            models.Index(fields=['user', 'updated_at'], name='product_user_updated_idx'),
+        ]
+
+
+class CatalogItemManager(models.Manager):
+    def resolve(self, external_ids, feed=None):
+        """Return ``{external_id: id}`` for the catalog items with these upstream ids.
+
+        Only items the catalog already knows are linked: rows synced by
+        `sync_catalog`, or, through `feed` (a callable returning the cached
+        upstream feed, only called when some ids are not stored yet), feed
+        items that are inserted from the feed's own data. Ids found in neither
+        are left out, so clients cannot put items of their own into the shared
+        catalog.
+        """
+        from .catalog import item_fields, item_hash
+
+        external_ids = set(external_ids)
+        ids = dict(self.filter(external_id__in=external_ids).values_list('external_id', 'id'))
+        missing = external_ids - ids.keys()
+        if missing and feed is not None:
+            new = {item['id']: item for item in feed() if item.get('id') in missing}
+            if new:
+                # ignore_conflicts: another request may insert the same item meanwhile
+                self.bulk_create(
+                    [self.model(content_hash=item_hash(item), **item_fields(item)) for item in new.values()],
+                    ignore_conflicts=True,
+                )
+                ids.update(self.filter(external_id__in=new.keys()).values_list('external_id', 'id'))
+                self.merge_legacy_items(titles={item.get('title', '') for item in new.values()})
+        return ids
+
+    def merge_legacy_items(self, titles=None):
+        """Move collections off legacy items (no external_id) onto the synced item with the same title.
+
+        Migration 0009 kept an item without an external_id for each collected
+        title the catalog did not have. Once the feed has that title, users'
+        rows are moved onto the feed's item and the legacy item is deleted; a
+        user who had both keeps one row, merged as in migration 0007 (the
+        oldest row, with the quantities summed). Returns the number of legacy
+        items merged.
+        """
+        legacy = self.filter(external_id=None)
+        if titles is not None:
+            legacy = legacy.filter(title__in=titles)
+        legacy = dict(legacy.values_list('id', 'title'))
+        if not legacy:
+            return 0
+        synced = {}
+        # Lowest id first wins, like the title match in migration 0009
+        for item_id, title in (
+            self.exclude(external_id=None).filter(title__in=set(legacy.values()))
+            .order_by('-id').values_list('id', 'title')
+        ):
+            synced[title] = item_id
 
-    title = models.CharField(max_length=255)  
+        merged = 0
+        products = Product.objects.using(self.db)
+        with transaction.atomic(using=self.db):
+            for legacy_id, title in legacy.items():
+                item_id = synced.get(title)
+                if item_id is None:
+                    continue
+                now = timezone.now()
+                rows = products.filter(item_id__in=[legacy_id, item_id])
+                duplicates = list(
+                    rows.values('user_id')
+                    .annotate(rows=Count('id'), keep_id=Min('id'), total=Sum('quantity'))
+                    .filter(rows__gt=1)
+                )
+                for group in duplicates:
+                    rows.filter(user_id=group['user_id']).exclude(pk=group['keep_id']).delete()
+                    rows.filter(pk=group['keep_id']).update(quantity=group['total'], updated_at=now)
+                rows.filter(item_id=legacy_id).update(item_id=item_id, updated_at=now)
+                self.filter(pk=legacy_id).delete()
+                merged += 1
+        return merged
+
+
+class CatalogItem(models.Model):
+    """Local copy of an item from the upstream catalog feed, kept up to date by `sync_catalog`.
+
+    Users' collections (Product) point here, so each item is stored once
+    however many users add it.
+    """
+    # `id` in the upstream feed; None for items only known from collections made before the feed was synced
+    external_id = models.PositiveIntegerField(unique=True, null=True, blank=True)
+
+    title = models.CharField(max_length=255)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     description = models.TextField()
     category = models.CharField(max_length=100)
-    image_url = models.URLField(max_length=500) 
+    image_url = models.URLField(max_length=500)
 
+    rate = models.DecimalField(max_digits=3, decimal_places=1)
+    count = models.PositiveIntegerField()
 
-    rate = models.DecimalField(max_digits=3, decimal_places=1) 
-    count = models.PositiveIntegerField()  
-    quantity = models.PositiveIntegerField(default=1)  # Quantity added by user
+    content_hash = models.CharField(max_length=40)  # SHA-1 of the feed item, used to skip unchanged rows
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = CatalogItemManager()
+
     def __str__(self):
-        return f"{self.title} (by {self.user.username})"
+        return self.title
 
     class Meta:
-        verbose_name_plural = "Products"
-
+        verbose_name_plural = "Catalog items"
+        indexes = [
+            # Category facet walked in id order by product.search
+            models.Index(fields=['category', 'id'], name='catalogitem_category_id_idx'),
+            # Polled by product.suggest to pick up changed rows
+            models.Index(fields=['updated_at'], name='catalogitem_updated_at_idx'),
+        ]
@@ -0,0 +1,68 @@
+import re
+
+from django.db import connection
+
+from .catalog import FEED_COLUMNS, item_from_row
+from .models import CatalogItem
+
+# Full-text index over CatalogItem (title, description, category), created by
+# migration 0004 and kept in sync by triggers. SQLite only.
+FTS_TABLE = 'product_catalogitem_fts'
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def fts_query(text):
+    """Build a safe FTS5 MATCH expression from free text.
+
+    Every word must match; the last one is treated as a prefix so results
+    narrow as the user types.
+    """
+    words = WORD_RE.findall(text.lower())
+    if not words:
+        return None
+    terms = ['"%s"' % word for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def _matching_ids(query, category, cursor, limit):
+    # Walk the FTS index in rowid order so the cursor is a plain rowid range
+    # and SQLite can stop after `limit` rows instead of ranking every match.
+    sql = (
+        f'SELECT f.rowid FROM {FTS_TABLE} f '
+        f'JOIN product_catalogitem c ON c.id = f.rowid '
+        f'WHERE {FTS_TABLE} MATCH %s AND f.rowid > %s AND c.external_id IS NOT NULL'
+    )
+    params = [query, cursor]
+    if category:
+        sql += ' AND c.category = %s'
+        params.append(category)
+    sql += ' ORDER BY f.rowid LIMIT %s'
+    params.append(limit)
+    with connection.cursor() as cursor_:
+        cursor_.execute(sql, params)
+        return [row[0] for row in cursor_.fetchall()]
+
+
+def search_catalog(text='', category='', cursor=0, limit=20):
+    """Return one page of catalog items matching `text` and `category`.
+
+    Returns ``(items, next_cursor)``; `next_cursor` is None on the last page.
+    Items are in the same shape as the upstream feed.
+    """
+    query = fts_query(text) if text else None
+    if query and connection.vendor == 'sqlite':
+        ids = _matching_ids(query, category, cursor, limit + 1)
+        rows = CatalogItem.objects.filter(id__in=ids).order_by('id')
+    else:
+        # Items known only from users' collections (no external_id) are not in the feed
+        rows = CatalogItem.objects.filter(id__gt=cursor).exclude(external_id=None).order_by('id')
+        if category:
+            rows = rows.filter(category=category)
+        if text:
+            rows = rows.filter(title__icontains=text)
+
+    rows = list(rows.values_list(*FEED_COLUMNS)[:limit + 1])
+    next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+    return [item_from_row(row) for row in rows[:limit]], next_cursor
@@ -0,0 +1,227 @@
+import bisect
+import heapq
+import threading
+import time
+import unicodedata
+from array import array
+
+from django.conf import settings
+
+
+def normalize(text):
+    """Lowercase, strip accents and collapse whitespace so lookups match the index keys."""
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(text.lower().split())
+
+
+def score(rate, count):
+    """Rank by rating first, then by number of reviews."""
+    return int(float(rate) * 10) * 1000000 + min(int(count), 999999)
+
+
+class PrefixIndex:
+    """Immutable prefix index: keys in a sorted array, plus a max-segment-tree over scores.
+
+    A prefix maps to a contiguous range of the sorted keys (found with bisect).
+    The segment tree returns the best-scoring position in any range in
+    O(log n), so the top-k of a range costs O(k log n) however many keys
+    share the prefix.
+    """
+
+    def __init__(self, entries=()):
+        # entries: (key, score, item_id, title, category)
+        entries = sorted(entries)
+        self.keys = [e[0] for e in entries]
+        self.scores = array('q', [e[1] for e in entries])
+        self.ids = array('q', [e[2] for e in entries])
+        self.titles = [e[3] for e in entries]
+        self.categories = [e[4] for e in entries]
+        self._build_tree()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def entries(self):
+        return zip(self.keys, self.scores, self.ids, self.titles, self.categories)
+
+    def _build_tree(self):
+        n = len(self.keys)
+        size = 1
+        while size < n:
+            size *= 2
+        tree = array('q', [-1]) * (2 * size)
+        tree[size:size + n] = array('q', range(n))
+        scores = self.scores
+        for i in range(size - 1, 0, -1):
+            a = tree[2 * i]
+            b = tree[2 * i + 1]
+            tree[i] = a if b < 0 or scores[a] >= scores[b] else b
+        self._size = size
+        self._tree = tree
+
+    def _argmax(self, lo, hi):
+        tree, scores = self._tree, self.scores
+        best = -1
+        lo += self._size
+        hi += self._size
+        while lo < hi:
+            if lo & 1:
+                i = tree[lo]
+                if best < 0 or scores[i] > scores[best]:
+                    best = i
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                i = tree[hi]
+                if best < 0 or scores[i] > scores[best]:
+                    best = i
+            lo >>= 1
+            hi >>= 1
+        return best
+
+    def iter_best(self, prefix):
+        """Yield positions of keys starting with `prefix`, best score first."""
+        lo = bisect.bisect_left(self.keys, prefix)
+        hi = bisect.bisect_left(self.keys, prefix + '\uffff', lo)
+        heap = []
+
+        def push(a, b):
+            if a < b:
+                i = self._argmax(a, b)
+                heapq.heappush(heap, (-self.scores[i], i, a, b))
+
+        push(lo, hi)
+        while heap:
+            _, i, a, b = heapq.heappop(heap)
+            yield i
+            push(a, i)
+            push(i + 1, b)
+
+
+class SuggestIndex:
+    """Title typeahead over the catalog, updated incrementally.
+
+    Changed items go into a small `delta` index that is rebuilt on every
+    change; the large `main` index is only rebuilt once the delta outgrows
+    `merge_threshold`. Main entries replaced by the delta are masked by id.
+    Each update swaps in new immutable objects, so lookups need no lock.
+    """
+
+    def __init__(self, merge_threshold=10000):
+        self.merge_threshold = merge_threshold
+        # (main, delta, delta entries by id, categories), replaced as a whole on update
+        self._state = (PrefixIndex(), PrefixIndex(), {}, {})
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        main, delta, _, _ = self._state
+        return len(main) + len(delta)
+
+    def update(self, items):
+        """Add or replace items given as (item_id, title, category, rate, count)."""
+        entries = {
+            item_id: (normalize(title), score(rate, count), item_id, title, category)
+            for item_id, title, category, rate, count in items
+        }
+        if not entries:
+            return
+        with self._lock:
+            main, _, delta_entries, categories = self._state
+            categories = dict(categories)
+            for entry in entries.values():
+                categories.setdefault(normalize(entry[4]), entry[4])
+
+            delta_entries = {**delta_entries, **entries}
+            if len(delta_entries) > self.merge_threshold:
+                merged = [e for e in main.entries() if e[2] not in delta_entries]
+                merged.extend(delta_entries.values())
+                main = PrefixIndex(merged)
+                delta_entries = {}
+            self._state = (main, PrefixIndex(delta_entries.values()), delta_entries, categories)
+
+    def suggest(self, text, limit=8):
+        """Return the best `limit` titles and the categories starting with `text`."""
+        prefix = normalize(text)
+        if not prefix:
+            return {'titles': [], 'categories': []}
+
+        main, delta, masked, categories = self._state
+
+        found = []
+        for i in delta.iter_best(prefix):
+            if len(found) == limit:
+                break
+            found.append((delta.scores[i], delta.titles[i], delta.categories[i]))
+        taken = 0
+        for i in main.iter_best(prefix):
+            if taken == limit:
+                break
+            if main.ids[i] in masked:
+                continue
+            found.append((main.scores[i], main.titles[i], main.categories[i]))
+            taken += 1
+        found.sort(key=lambda f: -f[0])
+
+        categories = sorted(
+            display for key, display in categories.items() if key.startswith(prefix)
+        )
+        return {
+            'titles': [{'title': title, 'category': category} for _, title, category in found[:limit]],
+            'categories': categories[:limit],
+        }
+
+
+_suggest_index = None
+_suggest_lock = threading.Lock()
+_suggest_watermark = None
+_suggest_checked_at = 0.0
+
+
+def _load_changes(index, since):
+    """Feed CatalogItem rows changed at or after `since` into the index; return the new watermark."""
+    from .models import CatalogItem
+
+    rows = CatalogItem.objects.exclude(external_id=None).order_by()
+    if since is not None:
+        rows = rows.filter(updated_at__gte=since)
+    watermark = since
+    batch = []
+    for item_id, title, category, rate, count, updated_at in rows.values_list(
+        'id', 'title', 'category', 'rate', 'count', 'updated_at'
+    ).iterator(chunk_size=5000):
+        batch.append((item_id, title, category, rate, count))
+        if watermark is None or updated_at > watermark:
+            watermark = updated_at
+    index.update(batch)
+    return watermark
+
+
+def get_suggest_index():
+    """Return the process-wide suggest index, picking up catalog changes at most every SUGGEST_REFRESH_INTERVAL seconds."""
+    global _suggest_index, _suggest_watermark, _suggest_checked_at
+
+    now = time.monotonic()
+    if _suggest_index is not None and now - _suggest_checked_at < settings.SUGGEST_REFRESH_INTERVAL:
+        return _suggest_index
+
+    # The first build blocks; later refreshes are done by whichever request
+    # gets the lock while the others keep using the current index.
+    if _suggest_index is None:
+        _suggest_lock.acquire()
+    elif not _suggest_lock.acquire(blocking=False):
+        return _suggest_index
+    try:
+        if _suggest_index is None:
+            # Build the initial copy straight into main rather than via the delta
+            index = SuggestIndex(merge_threshold=0)
+            _suggest_watermark = _load_changes(index, None)
+            index.merge_threshold = settings.SUGGEST_MERGE_THRESHOLD
+            _suggest_index = index
+        elif time.monotonic() - _suggest_checked_at >= settings.SUGGEST_REFRESH_INTERVAL:
+            _suggest_watermark = _load_changes(_suggest_index, _suggest_watermark)
+        _suggest_checked_at = time.monotonic()
+    finally:
+        _suggest_lock.release()
+    return _suggest_index
@@ -0,0 +1,58 @@
+import hashlib
+import re
+
+from django import template
+from django.core.cache import caches
+from django.utils.safestring import mark_safe
+
+register = template.Library()
+
+# Cached HTML is keyed by catalog version, so it never needs invalidating;
+# the timeout only bounds how long old versions linger in the cache.
+CARD_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Indentation between tags is most of a card's size; any run of whitespace
+# there renders the same as a single newline.
+_BETWEEN_TAGS = re.compile(r'>\s+<')
+
+@register.simple_tag(takes_context=True)
+def product_cards(context, products, version=None, grid=False):
+    """Render product/card.html for each product, reusing cached HTML.
+
+    Cards are the same for every signed-in user, so each one is cached under
+    the catalog `version`, the product id and the login state (the only
+    per-user part). With `grid`, the joined HTML of the whole list is cached
+    too. Without a `version` nothing is cached.
+    """
+    card = context.template.engine.get_template('product/card.html')
+    if not version:
+        return mark_safe(''.join(_render(card, context, product) for product in products))
+
+    cache = caches['template_fragments']
+    user = context.get('user')
+    prefix = f"product-card:{version}:{int(bool(user and user.is_authenticated))}:"
+    keys = [prefix + str(product['id']) for product in products]
+
+    grid_key = None
+    if grid:
+        grid_key = prefix + 'grid:' + hashlib.sha1(','.join(keys).encode()).hexdigest()
+        html = cache.get(grid_key)
+        if html is not None:
+            return mark_safe(html)
+
+    cached = cache.get_many(keys)
+    missing = {}
+    for key, product in zip(keys, products):
+        if key not in cached:
+            cached[key] = missing[key] = _render(card, context, product)
+    if missing:
+        cache.set_many(missing, CARD_CACHE_TIMEOUT)
+
+    html = ''.join(cached[key] for key in keys)
+    if grid_key:
+        cache.set(grid_key, html, CARD_CACHE_TIMEOUT)
+    return mark_safe(html)
+
+def _render(card, context, product):
+    with context.push(product=product):
+        return _BETWEEN_TAGS.sub('>\n<', card.render(context))
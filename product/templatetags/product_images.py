@@ -0,0 +1,25 @@
+from urllib.parse import urlencode
+
+from django import template
+from django.conf import settings
+from django.urls import reverse
+
+from product import images
+
+register = template.Library()
+
+
+@register.simple_tag
+def thumbnail_url(src, width):
+    """Signed URL of `src` resized to `width` by the image proxy, or `src` itself if the proxy won't fetch it."""
+    if not images.allowed(src):
+        return src
+    return f"{reverse('product_image')}?{urlencode({'src': src, 'w': width, 'sig': images.signature(src)})}"
+
+
+@register.simple_tag
+def thumbnail_srcset(src):
+    """A srcset listing every thumbnail width of `src`, or '' if the proxy won't fetch it."""
+    if not images.allowed(src):
+        return ''
+    return ', '.join(f'{thumbnail_url(src, w)} {w}w' for w in sorted(settings.IMAGE_THUMBNAIL_WIDTHS))
@@ -1,3 +1,1082 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import AnonymousUser
+from django.conf import settings
+from django.core.cache import caches
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.template import Context, Template
+from django.templatetags.static import static
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import urlencode
+
+from main import fastjson, metrics
+from user.models import User
+
+from . import api, benchmark, catalog, images, search, suggest, upstream, views
+from .catalog import CatalogCache, CatalogError
+from .fakestore import SAMPLE_PRODUCTS, FakeCatalogServer, synthetic_products
+from .models import CatalogItem, Product
+from .templatetags import product_cards
+
+
+class CatalogCacheTests(SimpleTestCase):
+    def test_hit_after_miss(self):
+        with FakeCatalogServer() as upstream:
+            cache = CatalogCache(upstream.url, ttl=60)
+            self.assertEqual(cache.get(), SAMPLE_PRODUCTS)
+            self.assertEqual(cache.get(), SAMPLE_PRODUCTS)
+        self.assertEqual(upstream.requests, 1)
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 1, 'refreshes': 1, 'errors': 0})
+
+    def test_concurrent_misses_share_one_fetch(self):
+        with FakeCatalogServer(delay=0.2) as upstream:
+            cache = CatalogCache(upstream.url, ttl=60)
+            results = []
+            threads = [threading.Thread(target=lambda: results.append(cache.get())) for _ in range(10)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertEqual(upstream.requests, 1)
+        self.assertEqual(results, [SAMPLE_PRODUCTS] * 10)
+        self.assertEqual(cache.misses, 10)
+
+    def test_stale_copy_served_while_refreshing(self):
+        with FakeCatalogServer() as upstream:
+            cache = CatalogCache(upstream.url, ttl=0.05)
+            cache.get()
+            time.sleep(0.06)
+            upstream.delay = 0.2
+            upstream.products = []
+            started = time.monotonic()
+            self.assertEqual(cache.get(), SAMPLE_PRODUCTS)
+            self.assertLess(time.monotonic() - started, 0.1)
+            cache._inflight.wait()
+            self.assertEqual(cache.get(), [])
+        self.assertEqual(cache.refreshes, 2)
+
+    def test_upstream_error(self):
+        with FakeCatalogServer(status=500) as upstream:
+            cache = CatalogCache(upstream.url, ttl=60)
+            with self.assertRaisesMessage(CatalogError, 'Failed to fetch products'):
+                cache.get()
+        self.assertEqual(cache.errors, 1)
+
+    def test_stale_copy_served_while_upstream_is_down(self):
+        with FakeCatalogServer() as upstream_server:
+            cache = CatalogCache(upstream_server.url, ttl=0.05)
+            cache.get()
+            time.sleep(0.06)
+            upstream_server.status = 500
+            self.assertEqual(cache.get(), SAMPLE_PRODUCTS)
+            cache._inflight.wait()
+            self.assertEqual(cache.get(), SAMPLE_PRODUCTS)
+        self.assertEqual(cache.errors, 1)
+
+
+@override_settings(UPSTREAM_RETRIES=2, UPSTREAM_RETRY_BACKOFF=0, UPSTREAM_RETRY_BUDGET=0.2, UPSTREAM_RETRY_RESERVE=10,
+                   UPSTREAM_BREAKER_THRESHOLD=5, UPSTREAM_BREAKER_RESET=30)
+class UpstreamClientTests(SimpleTestCase):
+    def setUp(self):
+        upstream.reset()
+
+    def tearDown(self):
+        upstream.reset()
+
+    def endpoint_stats(self, server):
+        (stats,) = upstream.stats().values()
+        return stats
+
+    def test_retries_transient_failures(self):
+        with FakeCatalogServer() as server:
+            server.faults = [503, 'drop']
+            response = upstream.get(server.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(server.requests, 3)
+        stats = self.endpoint_stats(server)
+        self.assertEqual((stats['calls'], stats['retries'], stats['errors']), (1, 2, 0))
+
+    def test_client_errors_are_not_retried(self):
+        with FakeCatalogServer(status=404) as server:
+            self.assertEqual(upstream.get(server.url).status_code, 404)
+        self.assertEqual(server.requests, 1)
+
+    def test_timeout(self):
+        with FakeCatalogServer() as server, self.settings(UPSTREAM_RETRIES=0):
+            server.faults = [0.5]
+            with self.assertRaises(upstream.UpstreamError):
+                upstream.get(server.url, timeout=0.1)
+
+    @override_settings(UPSTREAM_RETRIES=0, UPSTREAM_BREAKER_THRESHOLD=2, UPSTREAM_BREAKER_RESET=0.1)
+    def test_breaker_opens_then_recovers(self):
+        with FakeCatalogServer(status=500) as server:
+            upstream.get(server.url)
+            upstream.get(server.url)
+            with self.assertRaises(upstream.CircuitOpenError):
+                upstream.get(server.url)
+            self.assertEqual(server.requests, 2)
+            self.assertEqual(self.endpoint_stats(server)['breaker'], 'open')
+
+            time.sleep(0.1)
+            server.status = 200
+            self.assertEqual(upstream.get(server.url).status_code, 200)
+        stats = self.endpoint_stats(server)
+        self.assertEqual((stats['calls'], stats['errors'], stats['rejected'], stats['breaker']), (4, 2, 1, 'closed'))
+
+    def assert_interrupted_trial_reopens_breaker(self, interrupt):
+        with FakeCatalogServer(status=500) as server:
+            upstream.get(server.url)
+            time.sleep(0.1)
+            # The half-open trial call ends without an answer or a network error
+            interrupt(server.url)
+            self.assertEqual(self.endpoint_stats(server)['breaker'], 'open')
+
+            time.sleep(0.1)
+            server.status = 200
+            self.assertEqual(upstream.get(server.url).status_code, 200)
+        self.assertEqual(self.endpoint_stats(server)['breaker'], 'closed')
+
+    @override_settings(UPSTREAM_RETRIES=0, UPSTREAM_BREAKER_THRESHOLD=1, UPSTREAM_BREAKER_RESET=0.1)
+    def test_failed_trial_call_reopens_breaker(self):
+        def interrupt(url):
+            with mock.patch.object(upstream.session(), 'get', side_effect=ValueError('Invalid URL')):
+                with self.assertRaises(ValueError):
+                    upstream.get(url)
+        self.assert_interrupted_trial_reopens_breaker(interrupt)
+
+    @skipUnless(upstream.httpx, 'httpx is not installed')
+    @override_settings(UPSTREAM_RETRIES=0, UPSTREAM_BREAKER_THRESHOLD=1, UPSTREAM_BREAKER_RESET=0.1)
+    def test_cancelled_async_trial_call_reopens_breaker(self):
+        def interrupt(url):
+            with mock.patch.object(upstream.httpx.AsyncClient, 'send', side_effect=asyncio.CancelledError):
+                with self.assertRaises(asyncio.CancelledError):
+                    asyncio.run(upstream.aget(url))
+        self.assert_interrupted_trial_reopens_breaker(interrupt)
+
+    @skipUnless(upstream.httpx, 'httpx is not installed')
+    def test_async_clients_closed_with_their_loop(self):
+        clients = []
+
+        async def fetch(url):
+            clients.append((await upstream._async_client())[0])
+            return await upstream.aget(url)
+
+        with FakeCatalogServer() as server:
+            # Each call runs in a new event loop, as async views do under WSGI
+            for _ in range(2):
+                self.assertEqual(async_to_sync(fetch)(server.url).status_code, 200)
+        self.assertEqual(len(clients), 2)
+        self.assertTrue(all(client.is_closed for client in clients))
+        self.assertEqual(len(upstream._async_clients), 0)
+
+    @override_settings(UPSTREAM_RETRY_BUDGET=0, UPSTREAM_RETRY_RESERVE=1)
+    def test_retry_budget_caps_retries(self):
+        with FakeCatalogServer(status=500) as server:
+            upstream.get(server.url)
+            upstream.get(server.url)
+        # One retry from the reserve, none after it is spent
+        self.assertEqual(server.requests, 3)
+        self.assertEqual(self.endpoint_stats(server)['retries'], 1)
+
+    @override_settings(UPSTREAM_RETRIES=0, UPSTREAM_BREAKER_THRESHOLD=1)
+    def test_catalog_fails_fast_while_breaker_open(self):
+        with FakeCatalogServer(status=500) as server:
+            with self.assertRaisesMessage(CatalogError, 'Failed to fetch products'):
+                catalog.fetch_catalog(server.url, 1)
+            with self.assertRaisesMessage(CatalogError, 'temporarily unavailable'):
+                catalog.fetch_catalog(server.url, 1)
+        self.assertEqual(server.requests, 1)
+
+
+class AllProductViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='shopper', email='shopper@example.com', password='pw-12345678', name='Shopper')
+        self.client.force_login(self.user)
+        catalog._catalog_cache = None
+
+    def tearDown(self):
+        catalog._catalog_cache = None
+
+    def test_renders_upstream_catalog(self):
+        with FakeCatalogServer() as upstream, self.settings(CATALOG_API_URL=upstream.url):
+            response = self.client.get(reverse('allProduct'))
+        self.assertContains(response, 'data-product-title="Backpack"')
+
+    def test_not_modified_until_catalog_changes(self):
+        with FakeCatalogServer() as upstream, self.settings(CATALOG_API_URL=upstream.url):
+            response = self.client.get(reverse('allProduct'))
+            etag = response['ETag']
+            response = self.client.get(reverse('allProduct'), HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.content, b'')
+            self.assertEqual(upstream.requests, 1)
+
+            catalog.get_catalog_cache().clear()
+            upstream.products = [dict(SAMPLE_PRODUCTS[0], price=99.0)]
+            response = self.client.get(reverse('allProduct'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_not_modified_from_database_catalog(self):
+        CatalogItem.objects.create(external_id=1, title='Backpack', price=Decimal('109.95'), rate=Decimal('3.9'), count=120)
+        with self.settings(CATALOG_SOURCE='db'):
+            etag = self.client.get(reverse('allProduct'))['ETag']
+            with mock.patch.object(views, 'search_catalog') as search:
+                self.assertEqual(self.client.get(reverse('allProduct'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            search.assert_not_called()
+            CatalogItem.objects.update(title='Rucksack', updated_at=timezone.now())
+            self.assertEqual(self.client.get(reverse('allProduct'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_shows_error_when_upstream_fails(self):
+        with FakeCatalogServer(status=503) as upstream, self.settings(CATALOG_API_URL=upstream.url):
+            response = self.client.get(reverse('allProduct'))
+        self.assertContains(response, 'Failed to fetch products')
+
+
+@override_settings(CATALOG_SOURCE='db')
+class CollectionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='shopper', email='shopper@example.com', password='pw-12345678', name='Shopper')
+        self.other = User.objects.create_user(username='other', email='other@example.com', password='pw-12345678', name='Other')
+        self.client.force_login(self.user)
+        # Ids after the sample product's
+        self.synced = [dict(item, id=item['id'] + 1) for item in synthetic_products(2)]
+        for item in SAMPLE_PRODUCTS + self.synced:
+            CatalogItem.objects.create(content_hash=catalog.item_hash(item), **catalog.item_fields(item))
+        catalog._catalog_cache = None
+
+    def tearDown(self):
+        catalog._catalog_cache = None
+
+    def add(self, data, user=None):
+        if user is not None:
+            self.client.force_login(user)
+        return self.client.post(reverse('add_product'), data, content_type='application/json').json()
+
+    def test_users_share_one_catalog_item(self):
+        self.assertEqual(self.add(SAMPLE_PRODUCTS[0])['status'], 'success')
+        self.assertEqual(self.add(SAMPLE_PRODUCTS[0], user=self.other)['status'], 'success')
+        item = CatalogItem.objects.get(external_id=SAMPLE_PRODUCTS[0]['id'])
+        self.assertEqual(sorted(item.collected.values_list('user__username', flat=True)), ['other', 'shopper'])
+
+    def test_posted_data_does_not_change_stored_items(self):
+        self.add(dict(SAMPLE_PRODUCTS[0], title='Free backpack', price=0))
+        item = CatalogItem.objects.get(external_id=SAMPLE_PRODUCTS[0]['id'])
+        self.assertEqual(item.price, Decimal(str(SAMPLE_PRODUCTS[0]['price'])))
+        self.assertEqual(str(Product.objects.get()), f'{SAMPLE_PRODUCTS[0]["title"]} (by shopper)')
+
+    def test_unknown_items_are_refused(self):
+        count = CatalogItem.objects.count()
+        response = self.add(dict(SAMPLE_PRODUCTS[0], id=999999, title='My own item'))
+        self.assertEqual(response['message'], 'Product is not in the catalog')
+        self.assertEqual(CatalogItem.objects.count(), count)
+        self.assertFalse(Product.objects.exists())
+
+    def test_items_only_in_the_cached_feed_are_stored_from_it(self):
+        feed_item = dict(SAMPLE_PRODUCTS[0], id=500, title='New arrival')
+        with FakeCatalogServer([feed_item]) as upstream, \
+                self.settings(CATALOG_SOURCE='api', CATALOG_API_URL=upstream.url):
+            self.assertEqual(self.add(dict(feed_item, title='Renamed', price=0))['status'], 'success')
+            self.assertEqual(self.add(dict(feed_item, id=501))['message'], 'Product is not in the catalog')
+        item = CatalogItem.objects.get(external_id=500)
+        self.assertEqual((item.title, item.price), ('New arrival', Decimal(str(feed_item['price']))))
+        self.assertEqual(item.content_hash, catalog.item_hash(feed_item))  # the next sync leaves it alone
+        self.assertFalse(CatalogItem.objects.filter(external_id=501).exists())
+
+    def test_legacy_item_merged_when_the_feed_item_is_stored(self):
+        legacy = CatalogItem.objects.create(title='New arrival', price=Decimal('5.00'), rate=Decimal('1.0'), count=1)
+        Product.objects.create(user=self.user, item=legacy, quantity=2)
+        feed_item = dict(SAMPLE_PRODUCTS[0], id=500, title='New arrival')
+        with FakeCatalogServer([feed_item]) as upstream, \
+                self.settings(CATALOG_SOURCE='api', CATALOG_API_URL=upstream.url):
+            self.assertEqual(self.add(feed_item)['message'], 'Product already added to your collection')
+        self.assertFalse(CatalogItem.objects.filter(pk=legacy.pk).exists())
+        self.assertEqual(list(self.user.products.values_list('item__external_id', 'quantity')), [(500, 2)])
+
+    def test_repeat_adds_and_bumps(self):
+        self.add(SAMPLE_PRODUCTS[0])
+        self.assertEqual(self.add(SAMPLE_PRODUCTS[0])['message'], 'Product already added to your collection')
+        self.assertEqual(self.add(dict(SAMPLE_PRODUCTS[0], bump_quantity=True))['message'], 'Quantity updated!')
+        self.assertEqual(Product.objects.get().quantity, 2)
+
+    def test_batch(self):
+        first, second = self.synced
+        self.add(first)
+        batch = [first, second, second, {'title': 'No id'}, dict(second, id=999999)]
+        response = self.client.post(reverse('add_products_batch'), batch, content_type='application/json').json()
+        self.assertEqual(response['added'], 1)
+        self.assertEqual([result['status'] for result in response['results']], ['error', 'success', 'error', 'error', 'error'])
+        self.assertEqual(response['results'][4]['message'], 'Product is not in the catalog')
+        self.assertEqual(self.user.products.count(), 2)
+
+    def test_batch_limits(self):
+        too_many = [self.synced[0]] * (views.MAX_BATCH_ADD + 1)
+        response = self.client.post(reverse('add_products_batch'), too_many, content_type='application/json').json()
+        self.assertEqual(response['status'], 'error')
+        response = self.client.post(reverse('add_products_batch'), {'id': 1}, content_type='application/json').json()
+        self.assertEqual(response['message'], 'Expected a list of products')
+        self.assertFalse(Product.objects.exists())
+
+    def test_add_to_collection_inserts_leaves_or_bumps(self):
+        item = CatalogItem.objects.get(external_id=SAMPLE_PRODUCTS[0]['id'])
+        product_id, created = Product.objects.add_to_collection(Product(user=self.user, item=item, quantity=2))
+        self.assertTrue(created)
+        # DO NOTHING: the existing row is left as it is
+        self.assertEqual(Product.objects.add_to_collection(Product(user=self.user, item=item, quantity=5)), (None, False))
+        self.assertEqual(Product.objects.get(pk=product_id).quantity, 2)
+        # Bumped: same row, quantities added, not reported as created
+        self.assertEqual(
+            Product.objects.add_to_collection(Product(user=self.user, item=item, quantity=2), bump=True),
+            (product_id, False),
+        )
+        self.assertEqual(Product.objects.get(pk=product_id).quantity, 4)
+        # Bumping an item the user does not have yet inserts it
+        other_id, created = Product.objects.add_to_collection(Product(user=self.other, item=item), bump=True)
+        self.assertTrue(created)
+        self.assertNotEqual(other_id, product_id)
+
+    def test_quantity_never_drops_below_one(self):
+        product = Product.objects.create(user=self.user, item=CatalogItem.objects.first())
+
+        def change(delta, product_id=product.id):
+            url = reverse('update_quantity', args=[product_id])
+            return self.client.post(url, {'delta': delta}, content_type='application/json').json()['message']
+
+        self.assertEqual(change(-1), 'Quantity cannot be changed')
+        self.assertEqual(change(2), 'Quantity updated!')
+        self.assertEqual(change(-3), 'Quantity cannot be changed')
+        self.assertEqual(change(-2), 'Quantity updated!')
+        self.assertEqual(change(0), 'Invalid quantity change')
+        self.assertEqual(change(views.MAX_QUANTITY_CHANGE + 1), 'Invalid quantity change')
+        # Other users' rows are not found
+        self.client.force_login(self.other)
+        self.assertEqual(change(1), 'Quantity cannot be changed')
+        product.refresh_from_db()
+        self.assertEqual(product.quantity, 1)
+
+    def test_profile_lists_items(self):
+        self.add(dict(SAMPLE_PRODUCTS[0], bump_quantity=True))
+        self.add(dict(SAMPLE_PRODUCTS[0], bump_quantity=True))
+        response = self.client.get(reverse('profile'))
+        self.assertContains(response, SAMPLE_PRODUCTS[0]['title'])
+        self.assertEqual(response.context['total_quantity'], 2)
+        self.assertEqual(response.context['total_spent'], 2 * Decimal(str(SAMPLE_PRODUCTS[0]['price'])))
+
+
+class SyncCatalogTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='shopper', email='shopper@example.com', password='pw-12345678', name='Shopper')
+        self.other = User.objects.create_user(username='other', email='other@example.com', password='pw-12345678', name='Other')
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.feed_file = os.path.join(directory, 'feed.json')
+
+    def sync(self, feed):
+        with open(self.feed_file, 'w', encoding='utf-8') as f:
+            json.dump(feed, f)
+        out = io.StringIO()
+        call_command('sync_catalog', file=self.feed_file, stdout=out)
+        return out.getvalue()
+
+    def test_legacy_items_merged_into_feed_items(self):
+        # As left by migration 0009: a legacy item for a title collected before the feed was synced
+        legacy = CatalogItem.objects.create(title='Backpack', price=Decimal('5.00'), rate=Decimal('1.0'), count=1)
+        kept = Product.objects.create(user=self.user, item=legacy, quantity=2)
+        moved = Product.objects.create(user=self.other, item=legacy, quantity=1)
+        # ...and the same item synced since, which the user has added again
+        item = CatalogItem.objects.create(content_hash=catalog.item_hash(SAMPLE_PRODUCTS[0]), **catalog.item_fields(SAMPLE_PRODUCTS[0]))
+        Product.objects.create(user=self.user, item=item, quantity=1)
+        # Legacy items whose title has no feed item are left alone
+        CatalogItem.objects.create(title='Gone', price=Decimal('5.00'), rate=Decimal('1.0'), count=1)
+
+        self.assertIn('1 unchanged, 0 malformed skipped, 1 legacy items merged', self.sync(SAMPLE_PRODUCTS))
+        self.assertEqual(list(CatalogItem.objects.filter(external_id=None).values_list('title', flat=True)), ['Gone'])
+        # The user who had both keeps the oldest row, with the quantities summed
+        self.assertEqual(list(self.user.products.values_list('id', 'item', 'quantity')), [(kept.id, item.id, 3)])
+        self.assertEqual(list(self.other.products.values_list('id', 'item', 'quantity')), [(moved.id, item.id, 1)])
+
+    def test_only_changed_items_are_written(self):
+        feed = [dict(SAMPLE_PRODUCTS[0], id=i, title=f'Item {i}') for i in range(1, 4)]
+        self.assertIn('3 created, 0 updated, 0 unchanged', self.sync(feed))
+        untouched = CatalogItem.objects.get(external_id=1).updated_at
+
+        feed[1] = dict(feed[1], price=1.5)
+        self.assertIn('0 created, 1 updated, 2 unchanged', self.sync(feed))
+        self.assertEqual(CatalogItem.objects.get(external_id=2).price, Decimal('1.50'))
+        self.assertEqual(CatalogItem.objects.get(external_id=1).updated_at, untouched)
+
+    def test_malformed_items_are_skipped(self):
+        item = SAMPLE_PRODUCTS[0]
+        feed = [
+            {key: value for key, value in item.items() if key != 'id'},
+            dict(item, id='x'), dict(item, id=-1), dict(item, id=2, price='free'), 'not an item',
+            dict(item, id=3),
+        ]
+        self.assertIn('1 created, 0 updated, 0 unchanged, 5 malformed skipped', self.sync(feed))
+        self.assertEqual(list(CatalogItem.objects.values_list('external_id', flat=True)), [3])
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        for i, title in enumerate(['Blue backpack', 'Red backpack', 'Backpacking stove', 'Green backpack', 'Desk lamp'], 1):
+            CatalogItem.objects.create(
+                external_id=i, title=title, price=Decimal('10.00'), rate=Decimal('4.0'), count=1,
+                category='bags' if 'backpack' in title.lower() else 'home',
+            )
+        # Legacy items (no external_id) are not part of the catalog
+        CatalogItem.objects.create(title='Old backpack', price=Decimal('1.00'), rate=Decimal('1.0'), count=1, category='bags')
+
+    def titles(self, *args, **kwargs):
+        items, next_cursor = search.search_catalog(*args, **kwargs)
+        return [item['title'] for item in items], next_cursor
+
+    def test_every_word_must_match_and_the_last_is_a_prefix(self):
+        self.assertEqual(self.titles('backp')[0], ['Blue backpack', 'Red backpack', 'Backpacking stove', 'Green backpack'])
+        self.assertEqual(self.titles('red back')[0], ['Red backpack'])
+        self.assertEqual(self.titles('backpack', category='home')[0], [])
+        self.assertEqual(self.titles('"); DROP TABLE --')[0], [])
+
+    def test_cursor_walks_every_match_once(self):
+        titles, cursor = self.titles('backpack', limit=2)
+        self.assertEqual(titles, ['Blue backpack', 'Red backpack'])
+        # The last page is full, yet there is no next page
+        self.assertEqual(self.titles('backpack', cursor=cursor, limit=2), (['Backpacking stove', 'Green backpack'], None))
+        self.assertEqual(self.titles('backpack', cursor=cursor, limit=1), (['Backpacking stove'], CatalogItem.objects.get(external_id=3).id))
+
+    def test_view_pages_through_the_catalog(self):
+        user = User.objects.create_user(username='shopper', email='shopper@example.com', password='pw-12345678', name='Shopper')
+        self.client.force_login(user)
+        with self.settings(CATALOG_PAGE_SIZE=3):
+            page = self.client.get(reverse('search_products'), {'category': 'bags'}).json()
+            self.assertEqual((page['count'], page['next_cursor']), (3, CatalogItem.objects.get(external_id=3).id))
+            page = self.client.get(reverse('search_products'), {'category': 'bags', 'cursor': page['next_cursor']}).json()
+        self.assertEqual((page['count'], page['next_cursor']), (1, None))
+        self.assertIn('Green backpack', page['html'])
+        self.assertEqual(self.client.get(reverse('search_products'), {'cursor': 'x'}).status_code, 400)
+
+
+class SuggestTests(TestCase):
+    def setUp(self):
+        suggest._suggest_index = None
+        self.addCleanup(setattr, suggest, '_suggest_index', None)
+
+    def titles(self, index, text):
+        return [entry['title'] for entry in index.suggest(text)['titles']]
+
+    def test_best_rated_titles_first(self):
+        index = suggest.SuggestIndex()
+        index.update([(1, 'Blue backpack', 'bags', 3.0, 10), (2, 'Black backpack', 'bags', 4.5, 3),
+                      (3, 'Backpacking stove', 'outdoor', 4.5, 50), (4, 'Lamp', 'home', 5.0, 1)])
+        self.assertEqual(self.titles(index, 'b'), ['Backpacking stove', 'Black backpack', 'Blue backpack'])
+        self.assertEqual(index.suggest('BL')['titles'][0], {'title': 'Black backpack', 'category': 'bags'})
+        self.assertEqual(index.suggest('o')['categories'], ['outdoor'])
+
+    def test_updates_replace_items_before_and_after_merging(self):
+        index = suggest.SuggestIndex(merge_threshold=1)
+        index.update([(1, 'Blue backpack', 'bags', 3.0, 10), (2, 'Lamp', 'home', 4.0, 1)])  # merged into main
+        index.update([(1, 'Rucksack', 'bags', 3.0, 10)])  # in the delta, masking the main entry
+        self.assertEqual((self.titles(index, 'blue'), self.titles(index, 'ruck')), ([], ['Rucksack']))
+        index.update([(2, 'Desk lamp', 'home', 4.0, 1)])  # merged again
+        self.assertEqual(len(index), 2)
+        self.assertEqual((self.titles(index, 'ruck'), self.titles(index, 'lamp'), self.titles(index, 'desk')),
+                         (['Rucksack'], [], ['Desk lamp']))
+
+    @override_settings(SUGGEST_REFRESH_INTERVAL=0)
+    def test_index_picks_up_catalog_changes(self):
+        item = CatalogItem.objects.create(external_id=1, title='Blue backpack', price=Decimal('10.00'), rate=Decimal('4.0'), count=1)
+        CatalogItem.objects.create(title='Old backpack', price=Decimal('1.00'), rate=Decimal('1.0'), count=1)
+        self.assertEqual(self.titles(suggest.get_suggest_index(), 'b'), ['Blue backpack'])
+        CatalogItem.objects.filter(pk=item.pk).update(title='Rucksack', updated_at=timezone.now())
+        index = suggest.get_suggest_index()
+        self.assertEqual((self.titles(index, 'b'), self.titles(index, 'r')), ([], ['Rucksack']))
+
+
+class MigrationTests(TransactionTestCase):
+    """Migrate the product app back to `before`, and forward to the latest migration afterwards."""
+    before = after = None
+
+    def setUp(self):
+        self.executor = MigrationExecutor(connection)
+        self.addCleanup(self.migrate, self.executor.loader.graph.leaf_nodes('product'))
+
+    def migrate(self, targets):
+        self.executor.loader.build_graph()
+        self.executor.migrate(targets)
+        return self.executor.loader.project_state(targets).apps
+
+
+class MergeDuplicatesMigrationTests(MigrationTests):
+    before, after = ('product', '0006_product_user_created_idx'), ('product', '0007_product_unique_user_title')
+
+    def test_duplicates_merged_into_the_oldest_row(self):
+        apps = self.migrate([self.before])
+        Product = apps.get_model('product', 'Product')
+        HistoricalUser = apps.get_model('user', 'User')
+        shopper = HistoricalUser.objects.create(username='shopper', email='shopper@example.com', name='Shopper')
+        other = HistoricalUser.objects.create(username='other', email='other@example.com', name='Other')
+        fields = dict(price=Decimal('10.00'), description='', category='bags', image_url='', rate=Decimal('4.0'), count=1)
+        oldest = Product.objects.create(user=shopper, title='Backpack', quantity=1, **fields)
+        Product.objects.create(user=shopper, title='Backpack', quantity=2, **fields)
+        Product.objects.create(user=shopper, title='Backpack', quantity=3, **fields)
+        lamp = Product.objects.create(user=shopper, title='Lamp', quantity=1, **fields)
+        others = Product.objects.create(user=other, title='Backpack', quantity=4, **fields)
+
+        Product = self.migrate([self.after]).get_model('product', 'Product')
+        self.assertEqual(
+            sorted(Product.objects.values_list('id', 'quantity')),
+            [(oldest.id, 6), (lamp.id, 1), (others.id, 4)],
+        )
+
+
+class CatalogItemMigrationTests(MigrationTests):
+    before, after = ('product', '0008_product_user_updated_idx'), ('product', '0009_product_catalog_item')
+
+    def test_collection_rows_unlinked_on_reverse(self):
+        apps = self.migrate([self.before])
+        Product, CatalogItem = apps.get_model('product', 'Product'), apps.get_model('product', 'CatalogItem')
+        shopper = apps.get_model('user', 'User').objects.create(username='shopper', email='shopper@example.com', name='Shopper')
+        fields = dict(description='', category='bags', image_url='', rate=Decimal('4.0'), count=1)
+        CatalogItem.objects.create(external_id=1, title='Backpack', price=Decimal('10.00'), content_hash='', **fields)
+        Product.objects.create(user=shopper, title='Backpack', price=Decimal('9.00'), quantity=2, **fields)
+        Product.objects.create(user=shopper, title='Lamp', price=Decimal('5.00'), quantity=1, **fields)
+
+        apps = self.migrate([self.after])
+        Product, CatalogItem = apps.get_model('product', 'Product'), apps.get_model('product', 'CatalogItem')
+        self.assertEqual(sorted(Product.objects.values_list('item__title', 'item__external_id')),
+                         [('Backpack', 1), ('Lamp', None)])
+        # A second feed item with the same title, collected by the same user
+        twin = CatalogItem.objects.create(external_id=2, title='Backpack', price=Decimal('12.00'), content_hash='', **fields)
+        Product.objects.create(user_id=shopper.id, item=twin, quantity=3)
+
+        apps = self.migrate([self.before])
+        Product, CatalogItem = apps.get_model('product', 'Product'), apps.get_model('product', 'CatalogItem')
+        # Copies come back from the items; the two Backpack rows are merged into the oldest
+        self.assertEqual(sorted(Product.objects.values_list('title', 'price', 'quantity')),
+                         [('Backpack', Decimal('10.00'), 5), ('Lamp', Decimal('5.00'), 1)])
+        self.assertEqual(sorted(CatalogItem.objects.values_list('external_id', flat=True)), [1, 2])
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'product_catalogitem_fts_%'")
+            self.assertEqual(cursor.fetchone(), (3,))
+
+
+
+class ApiTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='shopper', email='shopper@example.com', password='pw-12345678', name='Shopper')
+        self.client.force_login(self.user)
+        self.products = synthetic_products(5)
+        for item in self.products:
+            CatalogItem.objects.create(content_hash='', **catalog.item_fields(item))
+        catalog._catalog_cache = None
+        self.addCleanup(setattr, catalog, '_catalog_cache', None)
+
+    def get(self, name, **params):
+        return self.client.get(reverse(name), params).json()
+
+    def pages(self, name, **params):
+        results, cursor = [], None
+        while True:
+            # The cursor goes into the URL as it is, like a client building the next link by hand
+            url = reverse(name) + '?' + urlencode(params) + (f'&cursor={cursor}' if cursor else '')
+            data = self.client.get(url).json()
+            results += data['results']
+            cursor = data['next_cursor']
+            if cursor is None:
+                return results
+
+    def test_catalog_from_db(self):
+        with self.settings(CATALOG_SOURCE='db'), self.assertNumQueries(3):  # session, user, one page
+            data = self.get('api_catalog', fields='id,price', limit=2)
+        first = self.products[0]
+        self.assertEqual(data['results'][0], {'id': first['id'], 'price': first['price']})
+        with self.settings(CATALOG_SOURCE='db'):
+            self.assertEqual([row['id'] for row in self.pages('api_catalog', limit=2)], [p['id'] for p in self.products])
+
+    def test_catalog_from_feed_matches_db(self):
+        with FakeCatalogServer(self.products) as upstream, self.settings(CATALOG_API_URL=upstream.url):
+            from_feed = self.pages('api_catalog', limit=2)
+        with self.settings(CATALOG_SOURCE='db'):
+            self.assertEqual(from_feed, self.pages('api_catalog', limit=3))
+        self.assertEqual(from_feed[0]['rate'], self.products[0]['rating']['rate'])
+
+    def test_collection(self):
+        for item in self.products:
+            self.client.post(reverse('add_product'), item, content_type='application/json')
+        results = self.pages('api_collection', fields='catalog_id,quantity', limit=2)
+        self.assertEqual(results, [{'catalog_id': p['id'], 'quantity': 1} for p in reversed(self.products)])
+        other = User.objects.create_user(username='other', email='other@example.com', password='pw-12345678', name='Other')
+        self.client.force_login(other)
+        self.assertEqual(self.get('api_collection')['results'], [])
+
+    def test_invalid_parameters(self):
+        for params in ({'fields': 'title,password'}, {'limit': '0'}, {'cursor': 'x'}):
+            for name in ('api_catalog', 'api_collection'):
+                with self.subTest(name=name, **params):
+                    response = self.client.get(reverse(name), params)
+                    self.assertEqual(response.status_code, 400)
+                    self.assertEqual(response.json()['status'], 'error')
+
+    @skipUnless(fastjson.orjson, 'orjson is not installed')
+    def test_encoders_agree_and_responses_are_compressed(self):
+        self.client.post(reverse('add_product'), self.products[0], content_type='application/json')
+        bodies = []
+        for encoder in ('json', 'orjson'):
+            with self.subTest(encoder=encoder), self.settings(API_JSON_ENCODER=encoder, CATALOG_SOURCE='db'):
+                for name in ('api_catalog', 'api_collection'):
+                    response = self.client.get(reverse(name), HTTP_ACCEPT_ENCODING='gzip')
+                    self.assertEqual(response['Content-Encoding'], 'gzip')
+                    bodies.append(gzip.decompress(response.content))
+        self.assertEqual(bodies[:2], bodies[2:])
+        self.assertIn(b'"created_at":"', bodies[1])
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='shopper', email='shopper@example.com', password='pw-12345678', name='Shopper')
+        cls.products = synthetic_products(5)
+        for item in cls.products:
+            catalog_item = CatalogItem.objects.create(content_hash='', **catalog.item_fields(item))
+            Product.objects.create(user=cls.user, item=catalog_item, quantity=item['id'])
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def export(self, **params):
+        response = self.client.get(reverse('export_collection'), params)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def test_csv(self):
+        response, body = self.export(fields='catalog_id,title,quantity')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="collection-shopper.csv"')
+        rows = list(csv.reader(io.StringIO(body.decode())))
+        self.assertEqual(rows[0], ['catalog_id', 'title', 'quantity'])
+        self.assertEqual(rows[1:], [[str(p['id']), p['title'], str(p['id'])] for p in self.products])
+
+    def test_csv_formulas_are_neutralised(self):
+        CatalogItem.objects.filter(external_id=1).update(title='=HYPERLINK("http://evil.example")', description='@SUM(1)')
+        CatalogItem.objects.filter(external_id=2).update(title='-5 + 3', price=Decimal('-1.00'))
+        _, body = self.export(fields='catalog_id,title,description,price')
+        rows = list(csv.reader(io.StringIO(body.decode())))
+        self.assertEqual(rows[1][1:3], ['\'=HYPERLINK("http://evil.example")', "'@SUM(1)"])
+        # Only text is quoted; numbers stay numbers
+        self.assertEqual(rows[2][1::2], ["'-5 + 3", '-1.00'])
+        _, body = self.export(format='ndjson', fields='title')
+        self.assertEqual(json.loads(body.splitlines()[0]), {'title': '=HYPERLINK("http://evil.example")'})
+
+    def test_ndjson_gzipped(self):
+        response = self.client.get(reverse('export_collection'), {'format': 'ndjson'}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        lines = gzip.decompress(b''.join(response.streaming_content)).splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(set(json.loads(lines[0])), set(api.COLLECTION_FIELDS))
+
+    def test_header_is_sent_before_rows_are_read(self):
+        with self.assertNumQueries(2):  # session and user
+            response = self.client.get(reverse('export_collection'), {'fields': 'title'})
+            chunks = iter(response.streaming_content)
+            self.assertEqual(next(chunks), b'title\r\n')
+        with self.assertNumQueries(1):
+            self.assertEqual(len(b''.join(chunks).splitlines()), 5)
+
+    async def test_streamed_under_asgi(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('export_collection'), {'fields': 'title'})
+        # An async iterator, which Django sends chunk by chunk instead of reading it into a list first
+        self.assertTrue(response.is_async)
+        chunks = aiter(response.streaming_content)
+        self.assertEqual(await anext(chunks), b'title\r\n')
+        rows = await anext(chunks)
+        self.assertEqual(rows.decode().splitlines(), [p['title'] for p in self.products])
+        with self.assertRaises(StopAsyncIteration):
+            await anext(chunks)
+
+    def test_other_users_need_staff(self):
+        other = User.objects.create_user(username='other', email='other@example.com', password='pw-12345678', name='Other')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(reverse('export_collection'), {'user': 'shopper'}).status_code, 403)
+        User.objects.filter(pk=other.pk).update(is_staff=True)
+        response, body = self.export(user='shopper', format='ndjson', fields='title')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="collection-shopper.ndjson"')
+        self.assertEqual(len(body.splitlines()), 5)
+        self.assertEqual(self.client.get(reverse('export_collection'), {'user': 'nobody'}).status_code, 404)
+        self.assertEqual(self.client.get(reverse('export_collection'), {'format': 'xml'}).status_code, 400)
+
+
+class ProductCardsTests(SimpleTestCase):
+    template = Template('{% load product_cards %}{% product_cards products version grid=grid %}')
+
+    def setUp(self):
+        caches['template_fragments'].clear()
+        self.products = [dict(SAMPLE_PRODUCTS[0], id=i, title=f'Product {i}') for i in range(1, 4)]
+
+    def render(self, version, user=None, grid=False, products=None):
+        user = user or User(username='shopper')
+        context = Context({'products': products or self.products, 'version': version, 'user': user, 'grid': grid})
+        with mock.patch.object(product_cards, '_render', side_effect=product_cards._render) as render_card:
+            html = self.template.render(context)
+        return html, render_card.call_count
+
+    def test_cards_cached_per_version(self):
+        uncached, rendered = self.render(None)
+        self.assertEqual(rendered, 3)
+        self.assertEqual(self.render('v1'), (uncached, 3))
+        self.assertEqual(self.render('v1'), (uncached, 0))
+        self.assertEqual(self.render('v2')[1], 3)
+        self.assertIn('data-product-title="Product 2"', uncached)
+
+    def test_login_state_is_rendered_separately(self):
+        signed_in, _ = self.render('v1')
+        anonymous, rendered = self.render('v1', user=AnonymousUser())
+        self.assertEqual(rendered, 3)
+        self.assertIn('Login to Add', anonymous)
+        self.assertNotIn('Login to Add', signed_in)
+
+    def test_grid_reuses_cards(self):
+        self.render('v1', products=self.products[:2])
+        html, rendered = self.render('v1', grid=True)
+        self.assertEqual(rendered, 1)
+        with mock.patch.object(caches['template_fragments'], 'get_many') as get_many:
+            self.assertEqual(self.render('v1', grid=True), (html, 0))
+        get_many.assert_not_called()
+
+
+def png_bytes(size=(1000, 500), color=(200, 30, 30, 255)):
+    out = io.BytesIO()
+    images.Image.new('RGBA', size, color).save(out, 'PNG')
+    return out.getvalue()
+
+
+@skipUnless(images.Image, 'Pillow is not installed')
+@override_settings(IMAGE_PROXY_ALLOWED_HOSTS=['127.0.0.1'], IMAGE_THUMBNAIL_WIDTHS=(80, 320), UPSTREAM_RETRIES=0)
+class ProductImageTests(SimpleTestCase):
+    def setUp(self):
+        upstream.reset()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(self.settings(MEDIA_ROOT=media_root))
+        png = png_bytes()
+        self.server = self.enterContext(FakeCatalogServer(files={'/a.png': ('image/png', png), '/b.png': ('image/png', png)}))
+
+    def fetch(self, src, width, accept='image/webp,*/*', sig=None):
+        params = {'src': src, 'w': width, 'sig': images.signature(src) if sig is None else sig}
+        return self.client.get(reverse('product_image'), params, HTTP_ACCEPT=accept)
+
+    def open_image(self, response):
+        return images.Image.open(io.BytesIO(b''.join(response.streaming_content)))
+
+    def thumbnail(self, src):
+        return async_to_sync(images.athumbnail)(src, 80, 'webp')
+
+    def test_source_fetched_once_for_every_size_and_format(self):
+        src = self.server.base_url + '/a.png'
+        response = self.fetch(src, 300)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['Vary'], 'Accept')
+        image = self.open_image(response)
+        self.assertEqual((image.format, image.size), ('WEBP', (320, 160)))
+
+        image = self.open_image(self.fetch(src, 50, accept='image/png,*/*'))
+        self.assertEqual((image.format, image.size), ('JPEG', (80, 40)))
+        self.assertEqual(self.server.requests, 1)
+
+    def test_same_image_at_two_urls_is_stored_once(self):
+        self.fetch(self.server.base_url + '/a.png', 80)
+        self.fetch(self.server.base_url + '/b.png', 80)
+        self.assertEqual(self.thumbnail(self.server.base_url + '/a.png'), self.thumbnail(self.server.base_url + '/b.png'))
+        self.assertEqual(self.server.requests, 2)
+
+    async def test_concurrent_first_requests_under_asgi_download_once(self):
+        src = self.server.base_url + '/a.png'
+        params = {'src': src, 'w': 80, 'sig': images.signature(src)}
+        responses = await asyncio.gather(*(
+            self.async_client.get(reverse('product_image'), params, headers={'Accept': accept})
+            for accept in ('image/webp,*/*', '*/*', 'image/webp,*/*')
+        ))
+        self.assertEqual([r['Content-Type'] for r in responses], ['image/webp', 'image/jpeg', 'image/webp'])
+        self.assertEqual(self.server.requests, 1)
+
+    def test_unfetchable_source_redirects_to_it(self):
+        src = self.server.base_url + '/missing.png'
+        self.server.status = 404
+        response = self.fetch(src, 80)
+        self.assertRedirects(response, src, fetch_redirect_response=False)
+
+    def test_other_hosts_are_refused(self):
+        self.assertEqual(self.fetch('https://example.com/1.jpg', 80).status_code, 400)
+
+    def test_unsigned_sources_are_refused(self):
+        src = self.server.base_url + '/a.png'
+        self.assertEqual(self.fetch(src, 80, sig='').status_code, 403)
+        self.assertEqual(self.fetch(src, 80, sig=images.signature(self.server.base_url + '/b.png')).status_code, 403)
+        self.assertEqual(self.server.requests, 0)
+
+    def test_oversized_sources_are_not_thumbnailed(self):
+        src = self.server.base_url + '/a.png'
+        with self.settings(IMAGE_PROXY_MAX_BYTES=10):
+            self.assertRedirects(self.fetch(src, 80), src, fetch_redirect_response=False)
+            with self.assertRaisesMessage(images.ImageError, 'larger than IMAGE_PROXY_MAX_BYTES'):
+                self.thumbnail(src)
+        self.assertFalse(os.path.exists(os.path.join(settings.MEDIA_ROOT, 'thumbs')))
+
+    def test_templates_use_thumbnails(self):
+        src = self.server.base_url + '/a.png'
+        html = Template('{% load product_images %}<img src="{% thumbnail_url src 80 %}" '
+                        'srcset="{% thumbnail_srcset src %}">').render(Context({'src': src}))
+        self.assertIn('<img src="/product/image/?src=http', html)
+        sig = f'&amp;sig={images.signature(src)}'
+        self.assertIn(f'&amp;w=80{sig} 80w, ', html)
+        self.assertIn(f'&amp;w=320{sig} 320w"', html)
+        self.assertEqual(Template('{% load product_images %}{% thumbnail_url src 80 %}').render(
+            Context({'src': 'https://example.com/1.jpg'})), 'https://example.com/1.jpg')
+
+
+class StaticFilesTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.root = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, cls.root)
+        cls.enterClassContext(override_settings(
+            STATIC_MANIFEST=True,
+            STATIC_ROOT=cls.root,
+            STORAGES=dict(settings.STORAGES, staticfiles={
+                'BACKEND': 'main.staticfiles.CompressedManifestStaticFilesStorage',
+            }),
+        ))
+        call_command('collectstatic', interactive=False, verbosity=0)
+        with open(settings.BASE_DIR / 'static' / 'css' / 'card.css', 'rb') as f:
+            cls.card_css = f.read()
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_hashed_names_are_compressed_and_immutable(self):
+        url = static('css/card.css')
+        self.assertRegex(url, r'^/static/css/card\.[0-9a-f]{12}\.css$')
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(gzip.decompress(self.body(response)), self.card_css)
+
+    def test_uncompressed_without_accept_encoding(self):
+        response = self.client.get(static('css/card.css'), HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(self.body(response), self.card_css)
+
+    def test_unhashed_names_revalidate(self):
+        response = self.client.get('/static/css/card.css', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertIn('no-cache', response['Cache-Control'])
+        response = self.client.get('/static/css/card.css', HTTP_ACCEPT_ENCODING='gzip',
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_pages_link_hashed_names(self):
+        response = self.client.get(reverse('login'))
+        self.assertContains(response, static('css/base.css'))
+        self.assertNotContains(response, '/static/css/base.css"')
+
+    @override_settings(DEBUG=True, REQUEST_TIMING_ENABLED=True)
+    def test_not_adapted_under_asgi(self):
+        # Django logs "Synchronous handler adapted for middleware ..." (with DEBUG on) for each
+        # middleware that would move async requests onto a worker thread, and "MiddlewareNotUsed" for
+        # each one left out, so every optional middleware is switched on
+        with self.assertNoLogs('django.request', 'DEBUG'):
+            ASGIHandler()
+
+    async def test_served_under_asgi(self):
+        response = await self.async_client.get(static('css/card.css'), headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join([chunk async for chunk in response])), self.card_css)
+        response = await self.async_client.get(reverse('login'))
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(REQUEST_TIMING_ENABLED=True, REQUEST_TIMING_HEADER=True, REQUEST_TIMING_SAMPLE_RATE=1, REQUEST_TIMING_SLOW_MS=60000,
+                   REQUEST_TIMING_SLOW_QUERIES=1000)
+class RequestTimingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='shopper', email='shopper@example.com', password='pw-12345678', name='Shopper')
+        self.client.force_login(self.user)
+        catalog._catalog_cache = None
+        self.addCleanup(setattr, catalog, '_catalog_cache', None)
+
+    def server_timing(self, response):
+        return dict(part.split(';', 1) for part in response['Server-Timing'].split(', '))
+
+    def test_counts_queries_and_templates(self):
+        CatalogItem.objects.create(external_id=1, title='Backpack', price=Decimal('109.95'), rate=Decimal('3.9'), count=120)
+        with self.settings(CATALOG_SOURCE='db'):
+            response = self.client.get(reverse('allProduct'))
+        timings = self.server_timing(response)
+        self.assertRegex(timings['db'], r'^dur=[\d.]+;desc="[1-9]\d* queries"$')
+        self.assertNotEqual(timings['tpl'], 'dur=0.0')
+        self.assertEqual(timings['upstream'].split(';')[1], 'desc="0 calls"')
+
+    def test_counts_upstream_calls(self):
+        with FakeCatalogServer() as upstream, self.settings(CATALOG_API_URL=upstream.url):
+            response = self.client.get(reverse('allProduct'))
+        self.assertIn('desc="1 calls"', self.server_timing(response)['upstream'])
+
+    def test_slow_requests_are_logged_with_slowest_query(self):
+        with self.settings(REQUEST_TIMING_SLOW_QUERIES=1), self.assertLogs('main.timing', 'WARNING') as logs:
+            self.client.get(reverse('profile'))
+        self.assertIn('Slow request GET /profile/ (200)', logs.output[0])
+        self.assertIn('slowest query', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+    def test_unsampled_requests_are_not_timed(self):
+        with self.settings(REQUEST_TIMING_SAMPLE_RATE=0):
+            response = self.client.get(reverse('profile'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+
+@override_settings(METRICS_TOKEN='s3cret')
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='shopper', email='shopper@example.com', password='pw-12345678', name='Shopper')
+        catalog._catalog_cache = None
+        self.addCleanup(setattr, catalog, '_catalog_cache', None)
+
+    def scrape(self, token='s3cret'):
+        return self.client.get('/metrics', HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def sample(self, series):
+        """Current value of one series, e.g. 'snapnshop_db_queries_count{view="profile"}' (0 if absent)."""
+        match = re.search(r'^%s (\S+)$' % re.escape(series), self.scrape().content.decode(), re.M)
+        return float(match.group(1)) if match else 0
+
+    def test_requests_counted_and_timed_per_url_name(self):
+        self.client.force_login(self.user)
+        series = 'snapnshop_http_requests_total{view="allProduct",method="GET",status="200"}'
+        before = self.sample(series)
+        with FakeCatalogServer() as upstream, self.settings(CATALOG_API_URL=upstream.url):
+            self.client.get(reverse('allProduct'))
+            self.client.get(reverse('allProduct'))
+            endpoint = upstream.url.split('//')[1]
+        self.assertEqual(self.sample(series), before + 2)
+        self.assertGreaterEqual(self.sample('snapnshop_http_request_duration_seconds_bucket{view="allProduct",le="+Inf"}'), 2)
+        self.assertEqual(self.sample(f'snapnshop_upstream_request_duration_seconds_count{{endpoint="{endpoint}"}}'), 1)
+        self.assertEqual(self.sample('snapnshop_catalog_cache_total{result="hits"}'), 1)
+
+    def test_queries_per_request(self):
+        self.client.force_login(self.user)
+        before = self.sample('snapnshop_db_queries_count{view="profile"}')
+        queries = self.sample('snapnshop_db_queries_sum{view="profile"}')
+        self.client.get(reverse('profile'))
+        self.assertEqual(self.sample('snapnshop_db_queries_count{view="profile"}'), before + 1)
+        self.assertGreater(self.sample('snapnshop_db_queries_sum{view="profile"}'), queries)
+
+    def test_upstream_errors(self):
+        upstream.reset()
+        self.addCleanup(upstream.reset)
+        with FakeCatalogServer(status=503) as server, self.settings(UPSTREAM_RETRIES=0):
+            upstream.get(server.url)
+            endpoint = server.url.split('//')[1]
+        self.assertEqual(self.sample(f'snapnshop_upstream_errors_total{{endpoint="{endpoint}",reason="error"}}'), 1)
+
+    def test_processes_sharing_a_directory_are_summed(self):
+        series = 'snapnshop_http_requests_total{view="forked",method="GET",status="200"}'
+        # No background flusher, in this process or the child: the child flushes once by hand,
+        # and a thread left behind would outlive the directory and the settings override
+        with tempfile.TemporaryDirectory() as directory, self.settings(METRICS_DIR=directory), \
+                mock.patch.object(metrics, 'start_flusher'):
+            metrics.inc('snapnshop_http_requests_total', ('forked', 'GET', '200'))
+            pid = os.fork()
+            if pid == 0:
+                # The child starts from zero, records its own request and reports it
+                metrics.inc('snapnshop_http_requests_total', ('forked', 'GET', '200'), 2)
+                metrics._flush()
+                os._exit(0)
+            os.waitpid(pid, 0)
+            self.assertEqual(self.sample(series), 3)
+
+    def test_flusher_survives_errors(self):
+        class Stop(Exception):
+            pass
+
+        with tempfile.TemporaryDirectory() as directory, self.settings(METRICS_DIR=directory), \
+                mock.patch.object(metrics.time, 'sleep', side_effect=[None, None, Stop]), \
+                mock.patch.object(metrics, '_flush', side_effect=OSError('No space left on device')) as flush, \
+                self.assertLogs('main.metrics', 'ERROR') as logs, self.assertRaises(Stop):
+            metrics._flush_forever()
+        self.assertEqual(flush.call_count, 2)
+        self.assertIn('Could not write metrics', logs.output[0])
+
+    def test_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.scrape('wrong').status_code, 403)
+        response = self.scrape()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('# TYPE snapnshop_http_request_duration_seconds histogram', response.content.decode())
+
+    def test_closed_without_a_token(self):
+        with self.settings(METRICS_TOKEN=''):
+            self.assertEqual(self.scrape('').status_code, 403)
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+
+class SQLiteProfileTests(SimpleTestCase):
+    def test_production_profile_writes_without_lock_errors(self):
+        # In a separate process: the test case refuses connections to databases it did not declare
+        result = subprocess.run(
+            [sys.executable, 'manage.py', 'bench_sqlite', '--threads', '8', '--writes', '30'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        )
+        default, production = result.stdout.splitlines()
+        self.assertIn('journal_mode=delete', default)
+        self.assertRegex(production, r'^production \(journal_mode=wal\): 240 writes .* 0 lock errors, 8 connections opened$')
+
+
+class BenchmarkTests(TransactionTestCase):
+    def test_seed_scale_is_repeatable(self):
+        for added in (12, 0):
+            out = io.StringIO()
+            call_command('seed_scale', users=3, products_per_user=4, catalog=10, stdout=out)
+            self.assertIn(f' and {added} products, existing ones skipped', out.getvalue())
+        self.assertEqual(User.objects.filter(username__startswith='scale').count(), 3)
+        self.assertEqual(Product.objects.count(), 12)
+        self.assertEqual(CatalogItem.objects.count(), 10)
+        self.assertTrue(User.objects.get(username='scale0000000').check_password('scale-password'))
+
+    def test_client_run_reports_every_view(self):
+        call_command('seed_scale', users=2, products_per_user=2, catalog=10, stdout=io.StringIO())
+        users = list(User.objects.order_by('username'))
+        products = synthetic_products(10)
+        catalog._catalog_cache = None
+        self.addCleanup(setattr, catalog, '_catalog_cache', None)
+        with FakeCatalogServer(products) as upstream, self.settings(
+                CATALOG_API_URL=upstream.url, RATELIMIT_ENABLED=False, REQUEST_TIMING_SLOW_MS=float('inf')):
+            result = benchmark.run(benchmark.ClientTransport(), users, products, 'scale-password',
+                                   total=30, concurrency=2, seed=0)
+        self.assertEqual(result['overall']['requests'], 30)
+        self.assertEqual(result['overall']['errors'], 0)
+        self.assertEqual(set(result['views']), set(benchmark.schedule(30, 0)))
+        for stats in result['views'].values():
+            self.assertLessEqual(stats['p50_ms'], stats['p95_ms'])
+            self.assertLessEqual(stats['p95_ms'], stats['p99_ms'])
+            self.assertGreater(stats['queries_per_request'], 0)
@@ -0,0 +1,363 @@
+"""HTTP client for upstream services (the fake store API).
+
+Every call goes through a per-endpoint circuit breaker and is retried with
+jittered exponential backoff while the process-wide retry budget allows it.
+Latency and error counters per endpoint are available from stats().
+"""
+import asyncio
+import random
+import threading
+import time
+import weakref
+from urllib.parse import urlsplit
+
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from main import metrics, timing
+
+try:
+    import httpx
+except ImportError:  # optional: without httpx async callers use requests in a worker thread
+    httpx = None
+
+
+class UpstreamError(Exception):
+    """Raised when an upstream call fails at the network level (connect, timeout, ...)."""
+
+
+class CircuitOpenError(UpstreamError):
+    """Raised without calling upstream while the endpoint's circuit breaker is open."""
+
+
+def is_retryable(status_code):
+    return status_code == 429 or status_code >= 500
+
+
+class CircuitBreaker:
+    """Fails fast once an endpoint has failed `threshold` times in a row.
+
+    While open, calls are rejected for `reset_timeout` seconds. After that a
+    single trial call is let through (half-open); its outcome closes the
+    breaker again or re-opens it for another `reset_timeout`.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            # Open, or half-open with the trial call still in flight
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class RetryBudget:
+    """Allows on average `ratio` retries per call, plus a burst of `reserve`.
+
+    Every call deposits `ratio` tokens and every retry spends one, so while
+    upstream is failing retries add at most `ratio` extra load instead of
+    multiplying it by the number of attempts.
+    """
+
+    def __init__(self, ratio=0.2, reserve=10):
+        self.ratio = ratio
+        self.reserve = reserve
+
+        self._lock = threading.Lock()
+        self.tokens = float(reserve)
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.reserve, self.tokens + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class Endpoint:
+    """Circuit breaker and counters for one upstream endpoint (host and path)."""
+
+    def __init__(self, name):
+        self.name = name
+        self.breaker = CircuitBreaker(settings.UPSTREAM_BREAKER_THRESHOLD, settings.UPSTREAM_BREAKER_RESET)
+
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.rejected = 0  # calls refused while the breaker was open
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def as_dict(self):
+        completed = self.calls - self.rejected
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'retries': self.retries,
+            'rejected': self.rejected,
+            'avg_ms': round(self.total_time / completed * 1000, 1) if completed else 0.0,
+            'max_ms': round(self.max_time * 1000, 1),
+            'breaker': self.breaker.state,
+        }
+
+
+_lock = threading.Lock()
+_endpoints = {}
+_budget = None
+
+
+def _endpoint(url, name=None):
+    global _budget
+    if name is None:
+        parts = urlsplit(url)
+        name = parts.netloc + parts.path
+    with _lock:
+        if _budget is None:
+            _budget = RetryBudget(settings.UPSTREAM_RETRY_BUDGET, settings.UPSTREAM_RETRY_RESERVE)
+        endpoint = _endpoints.get(name)
+        if endpoint is None:
+            endpoint = _endpoints[name] = Endpoint(name)
+        return endpoint
+
+
+def stats():
+    """Counters per endpoint: calls, errors, retries, rejected calls, latency and breaker state."""
+    with _lock:
+        return {name: endpoint.as_dict() for name, endpoint in _endpoints.items()}
+
+
+def reset():
+    """Forget all breakers, counters and the retry budget."""
+    global _budget
+    with _lock:
+        _endpoints.clear()
+        _budget = None
+
+
+class _Call:
+    """Bookkeeping for one logical call to `url`, shared by get() and aget().
+
+    The caller loops: start_attempt(), make the request, then report it with
+    answered() or failed(), which return how long to sleep before retrying,
+    or with aborted() if it raised anything else.
+    """
+
+    def __init__(self, url, endpoint=None):
+        self.endpoint = _endpoint(url, endpoint)
+        self.attempt = 0
+        self.started = time.perf_counter()
+        _budget.deposit()
+
+    def start_attempt(self):
+        if not self.endpoint.breaker.allow():
+            self._finish(rejected=True)
+            raise CircuitOpenError(f'{self.endpoint.name} is unavailable (circuit open)')
+
+    def answered(self, response):
+        """Return the delay before retrying `response`, or None if it is final."""
+        if not is_retryable(response.status_code):
+            self.endpoint.breaker.record_success()
+            self._finish()
+            return None
+        self.endpoint.breaker.record_failure()
+        delay = self._retry_delay()
+        if delay is None:
+            self._finish(error=True)
+        return delay
+
+    def failed(self, error):
+        """Return the delay before retrying after `error`, or raise it if out of retries."""
+        self.endpoint.breaker.record_failure()
+        delay = self._retry_delay()
+        if delay is None:
+            self._finish(error=True)
+            raise error
+        return delay
+
+    def aborted(self):
+        """Record an attempt that ended with neither an answer nor a network error (cancelled, invalid URL, ...).
+
+        It counts as a failure, so a half-open breaker does not wait forever
+        for the outcome of its trial call.
+        """
+        self.endpoint.breaker.record_failure()
+        self._finish(error=True)
+
+    def _retry_delay(self):
+        if self.attempt >= settings.UPSTREAM_RETRIES or not _budget.withdraw():
+            return None
+        self.attempt += 1
+        with _lock:
+            self.endpoint.retries += 1
+        # "Full jitter": spreads retries from many callers over the whole backoff window
+        return random.uniform(0, settings.UPSTREAM_RETRY_BACKOFF * 2 ** (self.attempt - 1))
+
+    def _finish(self, error=False, rejected=False):
+        elapsed = time.perf_counter() - self.started
+        timing.record_upstream(elapsed)
+        endpoint = self.endpoint
+        if rejected:
+            metrics.inc('snapnshop_upstream_errors_total', (endpoint.name, 'circuit_open'))
+        else:
+            metrics.observe('snapnshop_upstream_request_duration_seconds', (endpoint.name,), elapsed)
+            if error:
+                metrics.inc('snapnshop_upstream_errors_total', (endpoint.name, 'error'))
+        with _lock:
+            endpoint.calls += 1
+            if rejected:
+                endpoint.rejected += 1
+                return
+            endpoint.errors += error
+            endpoint.total_time += elapsed
+            endpoint.max_time = max(endpoint.max_time, elapsed)
+
+
+_session = None
+
+
+def session():
+    """Return the process-wide requests.Session, keeping connections to upstream hosts alive."""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                adapter = HTTPAdapter(pool_maxsize=settings.UPSTREAM_MAX_CONCURRENCY)
+                s = requests.Session()
+                s.mount('http://', adapter)
+                s.mount('https://', adapter)
+                _session = s
+    return _session
+
+
+def get(url, timeout=None, endpoint=None, stream=False):
+    """GET `url`, retrying network errors, 429 and 5xx answers.
+
+    Returns the final response, which may still be an error status, and
+    raises UpstreamError when no response could be had (CircuitOpenError
+    without even trying while the endpoint's breaker is open). Calls are
+    counted and broken per host and path unless `endpoint` names a group
+    to share instead (e.g. every image on one host). With `stream` the body
+    is left unread, as with requests' ``stream=True``, and the caller must
+    close the response.
+    """
+    timeouts = (settings.UPSTREAM_CONNECT_TIMEOUT, timeout or settings.CATALOG_FETCH_TIMEOUT)
+    call = _Call(url, endpoint)
+    while True:
+        call.start_attempt()
+        try:
+            response = session().get(url, timeout=timeouts, stream=stream)
+        except requests.exceptions.RequestException as e:
+            delay = call.failed(UpstreamError(str(e)))
+        except BaseException:
+            call.aborted()
+            raise
+        else:
+            delay = call.answered(response)
+            if delay is None:
+                return response
+            response.close()
+        time.sleep(delay)
+
+
+# One pooled client and concurrency limit per event loop. Under uvicorn there
+# is a single long-lived loop per process, so every request shares the same
+# keep-alive connections; httpx clients cannot be shared across loops. Under
+# WSGI each async view runs in a loop of its own, whose client is closed when
+# the loop shuts down (see _close_on_shutdown()).
+_async_clients = weakref.WeakKeyDictionary()
+
+
+async def _close_on_shutdown(loop, client):
+    """Async generator that stays suspended until `loop` shuts down, then closes `client`.
+
+    asyncio.run() (and so async_to_sync() and uvicorn) closes every unfinished
+    async generator of a loop before closing the loop itself, which makes this
+    a loop-shutdown hook.
+    """
+    try:
+        yield
+    finally:
+        # The entry's semaphore and client refer to the loop, so it would never leave the weak dict by itself
+        _async_clients.pop(loop, None)
+        await client.aclose()
+
+
+async def _async_client():
+    loop = asyncio.get_running_loop()
+    entry = _async_clients.get(loop)
+    if entry is None:
+        limit = settings.UPSTREAM_MAX_CONCURRENCY
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(settings.CATALOG_FETCH_TIMEOUT, connect=settings.UPSTREAM_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=limit, max_keepalive_connections=limit, keepalive_expiry=30),
+        )
+        closer = _close_on_shutdown(loop, client)
+        # The entry holds `closer`, keeping it alive (and so registered) for as long as the loop
+        entry = _async_clients[loop] = (client, asyncio.Semaphore(limit), closer)
+        await closer.__anext__()
+    return entry[:2]
+
+
+async def aget(url, timeout=None, endpoint=None, stream=False):
+    """Async get() that does not block the event loop.
+
+    At most UPSTREAM_MAX_CONCURRENCY calls are in flight per loop; callers
+    over the limit wait for a free slot. With `stream` the slot is given back
+    once the headers arrive; the caller reads the body with ``aiter_bytes()``
+    and must ``aclose()`` the response (without httpx, this is get()'s
+    requests response instead).
+    """
+    if httpx is None:
+        return await sync_to_async(get, thread_sensitive=False)(url, timeout, endpoint, stream)
+
+    client, semaphore = await _async_client()
+    timeouts = httpx.Timeout(timeout or settings.CATALOG_FETCH_TIMEOUT, connect=settings.UPSTREAM_CONNECT_TIMEOUT)
+    call = _Call(url, endpoint)
+    while True:
+        call.start_attempt()
+        try:
+            async with semaphore:
+                response = await client.send(client.build_request('GET', url, timeout=timeouts), stream=stream)
+        except httpx.HTTPError as e:
+            delay = call.failed(UpstreamError(str(e)))
+        except BaseException:
+            # Includes CancelledError when the request is cancelled mid-call
+            call.aborted()
+            raise
+        else:
+            delay = call.answered(response)
+            if delay is None:
+                return response
+            await response.aclose()
+        await asyncio.sleep(delay)
@@ -1,7 +1,17 @@
 from django.urls import path
 from .views import *
+from . import api, export
 
 urlpatterns = [
     path("", allProduct, name="allProduct"),
     path("add/", add_product, name="add_product"),
+    path("add/batch/", add_products_batch, name="add_products_batch"),
+    path("<int:product_id>/quantity/", update_quantity, name="update_quantity"),
+    path("search/", search_products, name="search_products"),
+    path("suggest/", suggest_products, name="suggest_products"),
+    path("image/", product_image, name="product_image"),
+    path("upstream/stats/", upstream_stats, name="upstream_stats"),
+    path("api/catalog/", api.catalog, name="api_catalog"),
+    path("api/collection/", api.collection, name="api_collection"),
+    path("export/", export.export_collection, name="export_collection"),
 ]
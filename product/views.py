@@ -1,26 +1,107 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import FileResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseRedirect, JsonResponse
+from django.conf import settings
+from django.template.loader import render_to_string
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib import messages
-from .models import Product
-import requests
+from main.conditional import not_modified, page_etag, with_etag
+from .models import CatalogItem, Product
+from . import images, upstream
+from .catalog import aget_catalog_versioned, collectable_feed, db_catalog_version, get_catalog_cache, CatalogError
+from .search import search_catalog
+from .suggest import get_suggest_index
 import json
 
+SUGGEST_LIMIT = 8
+# Most products accepted by one add_products_batch request
+MAX_BATCH_ADD = 100
+# Largest quantity change accepted by update_quantity
+MAX_QUANTITY_CHANGE = 100
+
+def catalog_item_id(data):
+    """Upstream id of a catalog item posted by card.js, raising ValueError if it is unusable.
+
+    Only the id is taken from the client: the item itself comes from the
+    catalog (see CatalogItemManager.resolve).
+    """
+    external_id = int(data.get('id'))
+    if external_id < 0:
+        raise ValueError('Invalid product id')
+    return external_id
+
+def catalog_page_etag(request, version):
+    """Return ``(etag, response)`` for the catalog page at `version`; `response` is a 304 or None."""
+    etag = page_etag(request, settings.CATALOG_SOURCE, version)
+    return etag, not_modified(request, etag)
+
 @login_required
-def allProduct(request):
+async def allProduct(request):
+    # Async so that, under ASGI, waiting on the upstream API does not tie up a worker thread
+    if settings.CATALOG_SOURCE == 'db':
+        # Revalidate on the catalog version (one indexed query) before searching and rendering
+        version = await sync_to_async(db_catalog_version)()
+        etag, response = await sync_to_async(catalog_page_etag)(request, version)
+        if response is not None:
+            return response
+
+        # Render only the first page; search and "load more" go through search_products
+        products, next_cursor = await sync_to_async(search_catalog)(limit=settings.CATALOG_PAGE_SIZE)
+        context = {'products': products, 'next_cursor': next_cursor, 'server_search': True, 'catalog_version': version}
+        response = await sync_to_async(render)(request, 'product/allproduct.html', context)
+        return with_etag(response, etag)
+
     try:
-        # Fetch products from the fake store API
-        response = requests.get('https://fakestoreapi.com/products')
-        if response.status_code == 200:
-            products = response.json()
-            context = {'products': products}
-        else:
-            context = {'products': [], 'error': 'Failed to fetch products'}
-    except requests.exceptions.RequestException as e:
-        context = {'products': [], 'error': 'Network error occurred'}
-    
-    return render(request, 'product/allproduct.html', context)
+        # Fetch products from the fake store API (cached, see product/catalog.py)
+        products, version = await aget_catalog_versioned()
+    except CatalogError as e:
+        return await sync_to_async(render)(request, 'product/allproduct.html', {'products': [], 'error': str(e)})
+
+    if version is None:
+        # Caching is off, so there is no version to revalidate against
+        return await sync_to_async(render)(request, 'product/allproduct.html', {'products': products})
+
+    etag, response = await sync_to_async(catalog_page_etag)(request, version)
+    if response is not None:
+        return response
+    context = {'products': products, 'catalog_version': version}
+    response = await sync_to_async(render)(request, 'product/allproduct.html', context)
+    return with_etag(response, etag)
+
+@login_required
+def search_products(request):
+    try:
+        cursor = int(request.GET.get('cursor') or 0)
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid cursor'}, status=400)
+
+    products, next_cursor = search_catalog(
+        request.GET.get('q', '').strip(),
+        request.GET.get('category', ''),
+        cursor,
+        settings.CATALOG_PAGE_SIZE,
+    )
+    context = {'products': products, 'catalog_version': db_catalog_version()}
+    html = render_to_string('product/card_list.html', context, request=request)
+
+    return JsonResponse({
+        'status': 'success',
+        'html': html,
+        'count': len(products),
+        'next_cursor': next_cursor,
+    })
+
+@login_required
+def suggest_products(request):
+    # Served from the in-process prefix index, no database round trip per keystroke
+    suggestions = get_suggest_index().suggest(request.GET.get('q', ''), SUGGEST_LIMIT)
+    return JsonResponse({'status': 'success', **suggestions})
 
 @login_required
 # @csrf_exempt
@@ -29,34 +110,26 @@ def add_product(request):
         try:
             data = json.loads(request.body)
             
-            # Check if product already exists for this user
-            existing_product = Product.objects.filter(
-                user=request.user,
-                title=data.get('title')
-            ).first()
+            # Look up (or first store, from the cached feed) the shared catalog item,
+            # then insert, or leave/bump, the user's row in one INSERT ... ON CONFLICT
+            external_id = catalog_item_id(data)
+            item_ids = CatalogItem.objects.resolve([external_id], feed=collectable_feed)
+            if external_id not in item_ids:
+                return JsonResponse({'status': 'error', 'message': 'Product is not in the catalog'})
+            product = Product(user=request.user, item_id=item_ids[external_id])
+            bump = bool(data.get('bump_quantity'))
+            product_id, created = Product.objects.add_to_collection(product, bump=bump)
             
-            if existing_product:
+            if not created and not bump:
                 return JsonResponse({
                     'status': 'error',
                     'message': 'Product already added to your collection'
                 })
             
-            # Create new product
-            product = Product.objects.create(
-                user=request.user,
-                title=data.get('title'),
-                price=data.get('price'),
-                description=data.get('description'),
-                category=data.get('category'),
-                image_url=data.get('image'),
-                rate=data.get('rating', {}).get('rate', 0),
-                count=data.get('rating', {}).get('count', 0)
-            )
-            
             return JsonResponse({
                 'status': 'success',
-                'message': 'Product added successfully!',
-                'product_id': product.id
+                'message': 'Product added successfully!' if created else 'Quantity updated!',
+                'product_id': product_id
             })
             
         except Exception as e:
@@ -66,3 +139,139 @@ def add_product(request):
             })
     
     return JsonResponse({'status': 'error', 'message': 'Invalid request method'})
+
+@login_required
+def add_products_batch(request):
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Invalid request method'})
+
+    try:
+        items = json.loads(request.body)
+    except ValueError:
+        items = None
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        return JsonResponse({'status': 'error', 'message': 'Expected a list of products'})
+    if len(items) > MAX_BATCH_ADD:
+        return JsonResponse({'status': 'error', 'message': f'At most {MAX_BATCH_ADD} products can be added at once'})
+
+    parsed = []
+    for item in items:
+        try:
+            parsed.append(catalog_item_id(item))
+        except (TypeError, ValueError):
+            parsed.append(None)
+
+    # One IN query for the batch's catalog items (plus an insert for any only in the cached feed),
+    # then one for those the user already has
+    item_ids = CatalogItem.objects.resolve(
+        [external_id for external_id in parsed if external_id is not None], feed=collectable_feed,
+    )
+    existing = set(
+        Product.objects.filter(user=request.user, item_id__in=item_ids.values())
+        .values_list('item_id', flat=True)
+    )
+
+    results = []
+    new_products = []
+    for item, external_id in zip(items, parsed):
+        title = item.get('title')
+        if external_id is None:
+            results.append({'title': title, 'status': 'error', 'message': 'Failed to add product'})
+            continue
+        if external_id not in item_ids:
+            results.append({'title': title, 'status': 'error', 'message': 'Product is not in the catalog'})
+            continue
+        item_id = item_ids[external_id]
+        if item_id in existing:
+            results.append({'title': title, 'status': 'error', 'message': 'Product already added to your collection'})
+            continue
+        existing.add(item_id)  # the same item twice in one batch is added once
+        product = Product(user=request.user, item_id=item_id)
+        new_products.append(product)
+        results.append({'title': title, 'status': 'success', 'message': 'Product added successfully!', 'product': product})
+
+    try:
+        with transaction.atomic():
+            Product.objects.bulk_create(new_products)
+    except IntegrityError:
+        # A concurrent request added one of these items after our existence check;
+        # fall back to per-item upserts so the rest of the batch still goes in
+        for result in results:
+            product = result.get('product')
+            if product is None:
+                continue
+            product.id, created = Product.objects.add_to_collection(product)
+            if not created:
+                result.update(status='error', message='Product already added to your collection')
+                result.pop('product')
+
+    for result in results:
+        product = result.pop('product', None)
+        if product is not None:
+            result['product_id'] = product.id
+
+    return JsonResponse({
+        'status': 'success',
+        'added': sum(1 for result in results if result['status'] == 'success'),
+        'results': results,
+    })
+
+@login_required
+def update_quantity(request, product_id):
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Invalid request method'})
+
+    try:
+        delta = int(json.loads(request.body).get('delta'))
+    except (ValueError, TypeError, AttributeError):
+        delta = 0
+    if not delta or abs(delta) > MAX_QUANTITY_CHANGE:
+        return JsonResponse({'status': 'error', 'message': 'Invalid quantity change'})
+
+    # Single UPDATE ... SET quantity = quantity + delta; the row is never loaded.
+    # The quantity filter keeps it from dropping below 1.
+    updated = Product.objects.filter(
+        id=product_id,
+        user=request.user,
+        quantity__gte=1 - delta,
+    ).update(quantity=F('quantity') + delta, updated_at=timezone.now())
+
+    if not updated:
+        return JsonResponse({'status': 'error', 'message': 'Quantity cannot be changed'})
+    return JsonResponse({'status': 'success', 'message': 'Quantity updated!'})
+
+async def product_image(request):
+    """A product image resized to the `w` requested, as WebP if the browser takes it, else JPEG.
+
+    Only URLs signed by the thumbnail_url tag are served, so the proxy cannot
+    be made to download and encode arbitrary images. Thumbnails never change
+    for a given source URL, so browsers and CDNs may keep them for a year. If
+    the source cannot be thumbnailed the browser is sent to it directly.
+    Async, so a first request that downloads and encodes the source never
+    blocks the event loop under ASGI (see product/images.py).
+    """
+    src = request.GET.get('src', '')
+    if not images.allowed(src):
+        return HttpResponseBadRequest('Image source not allowed')
+    if not images.signed(src, request.GET.get('sig')):
+        return HttpResponseForbidden('Invalid image signature')
+    width = images.thumbnail_width(request.GET.get('w'))
+    fmt = 'webp' if 'image/webp' in request.META.get('HTTP_ACCEPT', '') else 'jpeg'
+    try:
+        path = await images.athumbnail(src, width, fmt)
+    except images.ImageError:
+        return HttpResponseRedirect(src)
+    response = FileResponse(open(path, 'rb'), content_type=images.FORMATS[fmt][2])
+    patch_cache_control(response, public=True, max_age=365 * 24 * 3600, immutable=True)
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+
+@staff_member_required
+def upstream_stats(request):
+    # Counters for tuning the upstream timeouts, retries and breaker (per process)
+    return JsonResponse({
+        'status': 'success',
+        'endpoints': upstream.stats(),
+        'catalog_cache': get_catalog_cache().stats(),
+    })
@@ -1,14 +1,50 @@
+// When the catalog is served from the database the grid carries a search URL,
+// and search, filtering and "load more" are done on the server.
+const productsGrid = document.getElementById('productsGrid');
+const searchUrl = productsGrid ? productsGrid.dataset.searchUrl : '';
+let searchTimer = null;
+let searchRequest = 0;
+
+// Title suggestions for the search box, served from /product/suggest/
+const searchInput = document.getElementById('searchProducts');
+const suggestUrl = searchInput.dataset.suggestUrl;
+let suggestTimer = null;
+
 // Search functionality
-document.getElementById('searchProducts').addEventListener('input', function() {
-    const searchTerm = this.value.toLowerCase();
-    filterProducts();
+searchInput.addEventListener('input', function() {
+    if (searchUrl) {
+        // Debounce so we send one request per pause in typing, not per keystroke
+        clearTimeout(searchTimer);
+        searchTimer = setTimeout(() => loadProducts(false), 250);
+    } else {
+        filterProducts();
+    }
 });
 
+// Suggestions are debounced separately; they are cheap, so they refresh sooner than results
+if (suggestUrl) {
+    searchInput.addEventListener('input', function() {
+        clearTimeout(suggestTimer);
+        suggestTimer = setTimeout(loadSuggestions, 100);
+    });
+}
+
 // Category filter
 document.getElementById('categoryFilter').addEventListener('change', function() {
-    filterProducts();
+    if (searchUrl) {
+        loadProducts(false);
+    } else {
+        filterProducts();
+    }
 });
 
+// Load more button
+if (searchUrl) {
+    document.getElementById('loadMoreProducts').addEventListener('click', function() {
+        loadProducts(true);
+    });
+}
+
 function filterProducts() {
     const searchTerm = document.getElementById('searchProducts').value.toLowerCase();
     const selectedCategory = document.getElementById('categoryFilter').value.toLowerCase();
@@ -17,14 +53,83 @@ function filterProducts() {
     productCards.forEach(card => {
         const title = card.querySelector('.card-title').textContent.toLowerCase();
         const category = card.querySelector('.card-category').textContent.toLowerCase();
-        
+
         const matchesSearch = title.includes(searchTerm);
         const matchesCategory = !selectedCategory || category.includes(selectedCategory);
-        
+
         if (matchesSearch && matchesCategory) {
             card.style.display = 'block';
         } else {
             card.style.display = 'none';
         }
     });
-}
\ No newline at end of file
+}
+
+// Fetch a page of products from the server; append loads the next page,
+// otherwise the grid is replaced with the first page of the new results
+async function loadProducts(append) {
+    const params = new URLSearchParams({
+        q: document.getElementById('searchProducts').value.trim(),
+        category: document.getElementById('categoryFilter').value,
+    });
+    if (append) {
+        params.set('cursor', productsGrid.dataset.nextCursor);
+    }
+
+    const requestId = ++searchRequest;
+    const spinner = document.getElementById('loadingSpinner');
+    const loadMore = document.getElementById('loadMoreProducts');
+    spinner.classList.remove('d-none');
+
+    try {
+        const response = await fetch(`${searchUrl}?${params}`);
+        const result = await response.json();
+
+        // Ignore responses to searches the user has already typed past
+        if (requestId !== searchRequest || result.status !== 'success') {
+            return;
+        }
+
+        const container = document.createElement('div');
+        container.innerHTML = result.html;
+        convertPricesToINR(container);
+
+        if (!append) {
+            productsGrid.innerHTML = '';
+        }
+        productsGrid.append(...container.children);
+        productsGrid.dataset.nextCursor = result.next_cursor || '';
+        loadMore.classList.toggle('d-none', !result.next_cursor);
+    } catch (error) {
+        console.error('Error loading products:', error);
+        showToast('Network error. Please try again.', 'error');
+    } finally {
+        if (requestId === searchRequest) {
+            spinner.classList.add('d-none');
+        }
+    }
+}
+
+// Fill the search box's datalist with the best matching titles
+async function loadSuggestions() {
+    const list = document.getElementById('searchSuggestions');
+    const query = searchInput.value.trim();
+    if (!query) {
+        list.innerHTML = '';
+        return;
+    }
+
+    try {
+        const response = await fetch(`${suggestUrl}?${new URLSearchParams({ q: query })}`);
+        const result = await response.json();
+
+        list.innerHTML = '';
+        result.titles.forEach(item => {
+            const option = document.createElement('option');
+            option.value = item.title;
+            list.appendChild(option);
+        });
+    } catch (error) {
+        console.error('Error loading suggestions:', error);
+    }
+}
@@ -6,8 +6,15 @@ function flipCard(button) {
     card.classList.toggle('flipped');
 }
 
+// Adds are queued briefly and sent together to /product/add/batch/,
+// so clicking several products costs one request instead of one each
+const addQueue = [];
+let addFlushTimer = null;
+const ADD_FLUSH_DELAY = 300;
+const ADD_BATCH_SIZE = 20;
+
 // Add product to collection
-async function addProduct(button) {
+function addProduct(button) {
     const card = button.closest('.product-card');
     const productData = {
         id: card.dataset.productId,
@@ -26,48 +33,79 @@ async function addProduct(button) {
     button.classList.add('loading');
     button.disabled = true;
 
+    addQueue.push({ button, productData });
+    clearTimeout(addFlushTimer);
+    if (addQueue.length >= ADD_BATCH_SIZE) {
+        flushAdds();
+    } else {
+        addFlushTimer = setTimeout(flushAdds, ADD_FLUSH_DELAY);
+    }
+}
+
+// Send every queued add in one request and update each button with its own result
+async function flushAdds() {
+    const batch = addQueue.splice(0, addQueue.length);
+    if (batch.length === 0) return;
+
     try {
-        const response = await fetch('/product/add/', {
+        const response = await fetch('/product/add/batch/', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
                 'X-CSRFToken': getCookie('csrftoken')
             },
-            body: JSON.stringify(productData)
+            body: JSON.stringify(batch.map(entry => entry.productData))
         });
 
         const result = await response.json();
 
-        if (result.status === 'success') {
-            // Success state
-            button.classList.remove('loading');
-            button.classList.add('success');
-            button.innerHTML = '<i class="bi bi-check-circle me-1"></i>Added!';
-            
-            // Show toast notification
-            showToast(result.message, 'success');
-            
-            // Reset button after 3 seconds
-            setTimeout(() => {
-                button.classList.remove('success');
-                button.innerHTML = '<i class="bi bi-plus-circle me-1"></i>Add';
-                button.disabled = false;
-            }, 3000);
-            
-        } else {
-            // Error state
-            button.classList.remove('loading');
-            button.disabled = false;
+        if (result.status !== 'success') {
+            batch.forEach(entry => showAddFailed(entry.button));
             showToast(result.message, 'error');
+            return;
+        }
+
+        result.results.forEach((item, index) => {
+            if (item.status === 'success') {
+                showAddSucceeded(batch[index].button);
+            } else {
+                showAddFailed(batch[index].button);
+            }
+        });
+
+        // Show toast notification
+        if (batch.length === 1) {
+            showToast(result.results[0].message, result.results[0].status);
+        } else {
+            showToast(`${result.added} of ${batch.length} products added to your collection`, result.added ? 'success' : 'error');
         }
     } catch (error) {
-        console.error('Error adding product:', error);
-        button.classList.remove('loading');
-        button.disabled = false;
+        console.error('Error adding products:', error);
+        batch.forEach(entry => showAddFailed(entry.button));
         showToast('Network error. Please try again.', 'error');
     }
 }
 
+function showAddSucceeded(button) {
+    // Success state
+    button.classList.remove('loading');
+    button.classList.add('success');
+    button.innerHTML = '<i class="bi bi-check-circle me-1"></i>Added!';
+
+    // Reset button after 3 seconds
+    setTimeout(() => {
+        button.classList.remove('success');
+        button.innerHTML = '<i class="bi bi-plus-circle me-1"></i>Add';
+        button.disabled = false;
+    }, 3000);
+}
+
+function showAddFailed(button) {
+    // Error state
+    button.classList.remove('loading');
+    button.disabled = false;
+}
+
 // Get CSRF token
 function getCookie(name) {
     let cookieValue = null;
@@ -142,12 +180,12 @@ document.addEventListener('DOMContentLoaded', function() {
 });
 
 
-// Convert all USD prices to INR on page load
-function convertPricesToINR() {
+// Convert all USD prices to INR on page load (or inside `root` for cards loaded later)
+function convertPricesToINR(root = document) {
     console.log('Converting prices to INR...'); // Debug log
     
     // Find all price elements
-    const priceElements = document.querySelectorAll('.price-current, .price-large');
+    const priceElements = root.querySelectorAll('.price-current, .price-large');
     console.log('Found price elements:', priceElements.length); // Debug log
     
     priceElements.forEach((priceElement, index) => {
@@ -168,7 +206,7 @@ function convertPricesToINR() {
     });
     
     // Also update data attributes for accurate calculations
-    const productCards = document.querySelectorAll('.product-card');
+    const productCards = root.querySelectorAll('.product-card');
     productCards.forEach(card => {
         const usdPrice = parseFloat(card.dataset.productPrice);
         if (!isNaN(usdPrice)) {
@@ -187,6 +225,13 @@ function convertToINR(usdPrice) {
 
 // Search functionality
 function searchProducts() {
+    // Server-side search (see allProduct.js) replaces the DOM filter when enabled
+    const grid = document.getElementById('productsGrid');
+    if (grid && grid.dataset.searchUrl) {
+        loadProducts(false);
+        return;
+    }
+
     const searchTerm = document.getElementById('searchProducts').value.toLowerCase();
     const categoryFilter = document.getElementById('categoryFilter').value.toLowerCase();
     const productCards = document.querySelectorAll('.product-card-wrapper');
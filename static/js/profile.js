@@ -15,6 +15,9 @@ function initializeProfile() {
     
     // Initialize tooltips and other interactive elements
     initializeInteractiveElements();
+
+    // Load more products as the user scrolls to the end of the list
+    initializeInfiniteScroll();
 }
 
 function initializeFormValidation() {
@@ -289,12 +292,52 @@ function initializeInteractiveElements() {
     const productImages = document.querySelectorAll('.product-thumb');
     productImages.forEach(img => {
         img.addEventListener('error', function() {
+            this.srcset = '';
             this.src = 'https://via.placeholder.com/80x80?text=No+Image';
             this.alt = 'Product image not available';
         });
     });
 }
 
+function initializeInfiniteScroll() {
+    const productList = document.getElementById('userProducts');
+    const sentinel = document.getElementById('userProductsSentinel');
+    if (!productList || !sentinel || !('IntersectionObserver' in window)) return;
+
+    let loading = false;
+
+    const observer = new IntersectionObserver(async function(entries) {
+        if (!entries[0].isIntersecting || loading || !productList.dataset.nextCursor) return;
+
+        loading = true;
+        try {
+            const params = new URLSearchParams({ cursor: productList.dataset.nextCursor });
+            const response = await fetch(`${productList.dataset.url}?${params}`);
+            const result = await response.json();
+
+            if (result.status === 'success') {
+                productList.insertAdjacentHTML('beforeend', result.html);
+                productList.dataset.nextCursor = result.next_cursor || '';
+            }
+        } catch (error) {
+            console.error('Error loading products:', error);
+        } finally {
+            loading = false;
+        }
+
+        if (!productList.dataset.nextCursor) {
+            sentinel.classList.add('d-none');
+            observer.disconnect();
+        } else {
+            // Re-observe so a sentinel that is still on screen triggers the next page
+            observer.unobserve(sentinel);
+            observer.observe(sentinel);
+        }
+    }, { rootMargin: '200px' });
+
+    observer.observe(sentinel);
+}
+
 // Utility functions
 function debounce(func, wait) {
     let timeout;
@@ -0,0 +1,39 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+
+def find_account(login):
+    """Return the user whose username or email matches `login` (case-insensitive), or None.
+
+    One query on the case-insensitive unique indexes. If the login matches
+    one user's username and another user's email, the username wins.
+    """
+    key = login.lower()
+    candidates = get_user_model()._default_manager.matching(username=login, email=login)[:2]
+    return min(candidates, key=lambda user: user.username.lower() != key, default=None)
+
+
+class UsernameOrEmailBackend(ModelBackend):
+    """Log in with a username or an email address, checking the password once.
+
+    The account found (or None) is left on ``request.login_account`` so the
+    login view can tell a wrong password from an unknown account without
+    looking it up again.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(get_user_model().USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+
+        user = find_account(username)
+        if request is not None:
+            request.login_account = user
+        if user is None:
+            # Hash anyway, so an unknown account takes as long as a wrong password
+            get_user_model()().set_password(password)
+            return None
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
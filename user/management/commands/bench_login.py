@@ -0,0 +1,66 @@
+import time
+
+from django.contrib.auth.backends import ModelBackend
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from user.backends import UsernameOrEmailBackend
+from user.models import User
+
+USERNAME = 'bench-login'
+EMAIL = 'bench-login@example.com'
+PASSWORD = 'bench-password-123'
+
+
+def legacy_login(login, password):
+    """The login view's old flow: username, then email, then two existence checks."""
+    backend = ModelBackend()
+    user = backend.authenticate(None, username=login, password=password)
+    if user is None:
+        try:
+            user_obj = User.objects.get(email__iexact=login)
+            user = backend.authenticate(None, username=user_obj.username, password=password)
+        except User.DoesNotExist:
+            User.objects.filter(username__iexact=login).exists()
+            User.objects.filter(email__iexact=login).exists()
+    return user
+
+
+def backend_login(login, password):
+    return UsernameOrEmailBackend().authenticate(None, username=login, password=password)
+
+
+SCENARIOS = (
+    ('username', USERNAME, PASSWORD),
+    ('email', EMAIL.upper(), PASSWORD),
+    ('wrong password', EMAIL, 'not-the-password'),
+    ('unknown account', 'nobody@example.com', PASSWORD),
+)
+
+
+class Command(BaseCommand):
+    help = 'Measure logins per second on one core, for the old login flow and the username-or-email backend.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=20, help='Timed logins per scenario and flow.')
+
+    def handle(self, *args, **options):
+        user, _ = User.objects.get_or_create(username=USERNAME, defaults={'email': EMAIL, 'name': 'Bench Login'})
+        user.set_password(PASSWORD)
+        user.save()
+        try:
+            for scenario, login, password in SCENARIOS:
+                for name, flow in (('before', legacy_login), ('after', backend_login)):
+                    self.stdout.write(f'{scenario:>16} {name:>6}: {self.measure(flow, login, password, options["logins"])}')
+        finally:
+            user.delete()
+
+    def measure(self, flow, login, password, logins):
+        with CaptureQueriesContext(connection) as queries:
+            flow(login, password)
+        started = time.perf_counter()
+        for _ in range(logins):
+            flow(login, password)
+        elapsed = time.perf_counter() - started
+        return f'{logins / elapsed:6.1f} logins/s, {len(queries)} queries'
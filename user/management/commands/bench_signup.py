@@ -0,0 +1,53 @@
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from user.models import User
+
+
+class Command(BaseCommand):
+    help = 'Measure signups per second through the register view, with rate limiting off.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--signups', type=int, default=40, help='Total signups.')
+        parser.add_argument('--concurrency', type=int, default=4, help='Threads submitting signups at once.')
+
+    def handle(self, *args, **options):
+        prefix = f'bench{uuid.uuid4().hex[:6]}'
+        total, concurrency = options['signups'], options['concurrency']
+        failures = []
+
+        def worker(n):
+            client = Client()
+            for i in range(n, total, concurrency):
+                response = client.post(reverse('register'), {
+                    'name': 'Bench Signup',
+                    'username': f'{prefix}{i}',
+                    'email': f'{prefix}{i}@example.com',
+                    'password': 'bench-password-123',
+                    'confirm_password': 'bench-password-123',
+                    'terms': 'on',
+                })
+                if response.status_code != 302:
+                    failures.append(response.status_code)
+                client.logout()
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+        with override_settings(RATELIMIT_ENABLED=False, ALLOWED_HOSTS=['testserver']):
+            started = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.perf_counter() - started
+
+        User.objects.filter(username__startswith=prefix).delete()
+        self.stdout.write(self.style.SUCCESS(
+            f'{total} signups in {elapsed:.1f}s: {total / elapsed:.2f} signups/s '
+            f'(concurrency {concurrency}, {len(failures)} failed)'
+        ))
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:39
+
+import django.db.models.functions.text
+import user.models
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import Lower
+
+
+def check_case_duplicates(apps, schema_editor):
+    # Accounts that differ only in case would make the constraints fail with a
+    # bare IntegrityError; name them so they can be merged or renamed first.
+    User = apps.get_model('user', 'User')
+    for field in ('username', 'email'):
+        duplicates = list(
+            User.objects.using(schema_editor.connection.alias).values(value=Lower(field)).annotate(rows=Count('id')).filter(rows__gt=1)
+            .values_list('value', flat=True)[:20]
+        )
+        if duplicates:
+            raise RuntimeError(
+                f'Users share a {field} that differs only in case, fix these before migrating: {", ".join(duplicates)}'
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('user', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_case_duplicates, migrations.RunPython.noop),
+        migrations.AlterModelManagers(
+            name='user',
+            managers=[
+                ('objects', user.models.UserManager()),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='user',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('username'), name='user_username_ci_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='user',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('email'), name='user_email_ci_unique'),
+        ),
+    ]
@@ -1,5 +1,24 @@
 from django.db import models
-from django.contrib.auth.models import AbstractUser
+from django.db.models import Q, Value
+from django.db.models.functions import Lower
+from django.contrib.auth.models import AbstractUser, UserManager as BaseUserManager
+
+class UserManager(BaseUserManager):
+    def matching(self, username=None, email=None):
+        """Users whose username or email equals the given value, ignoring case.
+
+        Compares LOWER(username) and LOWER(email) with the database's own
+        LOWER() of the value, so both sides are lookups on the case-insensitive
+        unique indexes below, not table scans.
+        """
+        condition = Q()
+        if username:
+            condition |= Q(username_lower=Lower(Value(username)))
+        if email:
+            condition |= Q(email_lower=Lower(Value(email)))
+        if not condition:
+            return self.none()
+        return self.alias(username_lower=Lower('username'), email_lower=Lower('email')).filter(condition)
 
 class User(AbstractUser):
     ROLE_CHOICES = (
@@ -17,5 +36,14 @@ class User(AbstractUser):
         default='customer'
     )
 
+    objects = UserManager()
+
+    class Meta(AbstractUser.Meta):
+        constraints = [
+            # Usernames and emails are unique regardless of case (also the indexes for matching())
+            models.UniqueConstraint(Lower('username'), name='user_username_ci_unique'),
+            models.UniqueConstraint(Lower('email'), name='user_email_ci_unique'),
+        ]
+
     def __str__(self):
-        return f"{self.username} ({self.role})"
\ No newline at end of file
+        return f"{self.username} ({self.role})"
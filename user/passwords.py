@@ -0,0 +1,33 @@
+"""Password hashing off the request's thread.
+
+Hashing is deliberately slow (PBKDF2 runs for hundreds of milliseconds), so
+async views hand it to a thread instead of stalling the event loop. With
+PASSWORD_HASH_WORKERS set, hashes run in a pool of that many threads, which
+caps how many cores a signup burst can take from other requests.
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix='password-hash')
+    return _executor
+
+
+async def ahash_password(password):
+    """make_password() in a worker thread, in the bounded pool when PASSWORD_HASH_WORKERS is set."""
+    if not settings.PASSWORD_HASH_WORKERS:
+        return await sync_to_async(make_password, thread_sensitive=False)(password)
+    return await asyncio.wrap_future(_get_executor().submit(make_password, password))
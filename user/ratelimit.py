@@ -0,0 +1,120 @@
+"""Token-bucket rate limits for the login and register forms.
+
+Buckets live in the cache named by RATELIMIT_CACHE, so they are per process
+with the default local-memory cache and shared between processes with the
+file or database cache backends (see CACHES in main/settings.py).
+"""
+import functools
+import hashlib
+import math
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+_lock = threading.Lock()
+_counters = {}
+
+
+def client_ip(request):
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def account_key(request):
+    # The username/email typed into the form, whether or not the account exists
+    return (request.POST.get('username') or '').strip().lower()
+
+
+KEY_FUNCTIONS = {
+    'ip': client_ip,
+    'account': account_key,
+}
+
+
+def take(key, burst, per_minute):
+    """Take a token from the bucket `key`.
+
+    The bucket holds up to `burst` tokens and refills at `per_minute` tokens
+    a minute. Returns 0 if a token was taken, otherwise the seconds until one
+    is available. Read-modify-write on the cache is not atomic, so racing
+    requests in different processes may occasionally get an extra token.
+    """
+    cache = caches[settings.RATELIMIT_CACHE]
+    now = time.time()
+    tokens, updated_at = cache.get(key, (burst, now))
+    tokens = min(burst, tokens + (now - updated_at) * per_minute / 60)
+
+    wait = 0
+    if tokens >= 1:
+        tokens -= 1
+    else:
+        wait = (1 - tokens) * 60 / per_minute
+    # Expire the entry once the bucket would be full again; a missing bucket is a full one
+    cache.set(key, (tokens, now), timeout=math.ceil((burst - tokens) * 60 / per_minute) + 1)
+    return wait
+
+
+def _count(rule, blocked):
+    with _lock:
+        hits, blocks = _counters.get(rule, (0, 0))
+        _counters[rule] = (hits + 1, blocks + blocked)
+
+
+def stats():
+    """Checks and blocks per rule (e.g. ``'login:ip'``) in this process."""
+    with _lock:
+        return {rule: {'hits': hits, 'blocks': blocks} for rule, (hits, blocks) in _counters.items()}
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+    caches[settings.RATELIMIT_CACHE].clear()
+
+
+def check(request, scope):
+    """Take a token for every RATELIMITS[scope] rule; return seconds to wait, or 0 if allowed."""
+    wait = 0
+    for name, (burst, per_minute) in settings.RATELIMITS.get(scope, {}).items():
+        value = KEY_FUNCTIONS[name](request)
+        if not value:
+            continue
+        digest = hashlib.sha256(value.encode()).hexdigest()[:32]
+        rule_wait = take(f'ratelimit:{scope}:{name}:{digest}', burst, per_minute)
+        _count(f'{scope}:{name}', rule_wait > 0)
+        wait = max(wait, rule_wait)
+    return wait
+
+
+def _too_many(wait):
+    response = HttpResponse('Too many attempts. Please try again later.', status=429, content_type='text/plain')
+    response['Retry-After'] = str(math.ceil(wait))
+    return response
+
+
+def ratelimit(scope):
+    """Answer POSTs over the RATELIMITS[scope] limits with a 429, before the view does any work."""
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                if request.method == 'POST' and settings.RATELIMIT_ENABLED:
+                    # The buckets may live in the database cache, which is sync-only
+                    wait = await sync_to_async(check)(request, scope)
+                    if wait:
+                        return _too_many(wait)
+                return await view(request, *args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method == 'POST' and settings.RATELIMIT_ENABLED:
+                wait = check(request, scope)
+                if wait:
+                    return _too_many(wait)
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,3 +1,259 @@
-from django.test import TestCase
+import re
+import tempfile
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.db import IntegrityError, connection
+from django.test import TestCase, override_settings, skipUnlessDBFeature
+from django.urls import reverse
+from django.utils import timezone
+
+from product.models import CatalogItem, Product
+
+from . import ratelimit
+from .backends import find_account
+from .models import User
+from .views import taken_by_others
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.PBKDF2PasswordHasher'])
+class LoginTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='shopper', email='Shopper@Example.com', password='pw-12345678', name='Shopper'
+        )
+
+    def setUp(self):
+        ratelimit.reset()
+
+    def post_login(self, login, password='pw-12345678'):
+        return self.client.post(reverse('login'), {'username': login, 'password': password})
+
+    def test_login_with_username_or_email(self):
+        for login in ('shopper', 'SHOPPER', 'shopper@example.com'):
+            with self.subTest(login=login):
+                response = self.post_login(login)
+                self.assertRedirects(response, reverse('front_view'))
+                self.assertEqual(int(self.client.session['_auth_user_id']), self.user.pk)
+                self.client.logout()
+
+    def test_one_query_and_one_hash_per_attempt(self):
+        with mock.patch.object(PBKDF2PasswordHasher, 'encode', autospec=True, side_effect=PBKDF2PasswordHasher.encode) as encode:
+            for login, password in (('shopper@example.com', 'wrong'), ('nobody', 'pw-12345678')):
+                with self.subTest(login=login), self.assertNumQueries(1):
+                    self.post_login(login, password)
+        self.assertEqual(encode.call_count, 2)
+
+    def test_wrong_password(self):
+        response = self.post_login('shopper@example.com', 'wrong-password')
+        self.assertContains(response, 'Invalid password.')
+
+    def test_unknown_account(self):
+        response = self.post_login('nobody@example.com')
+        self.assertContains(response, 'No account found with username/email')
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.PBKDF2PasswordHasher'])
+class RegisterTests(TestCase):
+    form = {
+        'name': 'New Shopper', 'username': 'newshopper', 'email': 'new@example.com',
+        'password': 'pw-12345678', 'confirm_password': 'pw-12345678', 'terms': 'on',
+    }
+
+    def setUp(self):
+        ratelimit.reset()
+
+    def test_signup_hashes_once_and_logs_in(self):
+        for workers in (0, 2):
+            with self.subTest(workers=workers), self.settings(PASSWORD_HASH_WORKERS=workers), \
+                    mock.patch.object(PBKDF2PasswordHasher, 'encode', autospec=True, side_effect=PBKDF2PasswordHasher.encode) as encode:
+                form = dict(self.form, username=f'shopper{workers}', email=f'shopper{workers}@example.com')
+                response = self.client.post(reverse('register'), form)
+                self.assertEqual(encode.call_count, 1)
+                self.assertRedirects(response, reverse('front_view'))
+                user = User.objects.get(username=form['username'])
+                self.assertEqual(int(self.client.session['_auth_user_id']), user.pk)
+                self.assertTrue(user.check_password('pw-12345678'))
+                self.client.logout()
+
+    def test_taken_username(self):
+        User.objects.create(username='NewShopper', email='other@example.com', name='Other')
+        response = self.client.post(reverse('register'), self.form)
+        self.assertContains(response, 'is already taken')
+
+
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.PBKDF2PasswordHasher'],
+    RATELIMITS={'login': {'ip': (4, 10), 'account': (2, 1)}, 'register': {'ip': (1, 1)}},
+)
+class RateLimitTests(TestCase):
+    def setUp(self):
+        ratelimit.reset()
+
+    def post_login(self, login):
+        return self.client.post(reverse('login'), {'username': login, 'password': 'wrong-password'})
+
+    @mock.patch.object(ratelimit.time, 'time', return_value=1_000_000.0)
+    def test_account_bucket_blocks_before_hashing(self, _):
+        # Freeze the clock so slow password hashing doesn't refill the bucket
+        self.post_login('shopper')
+        self.post_login('shopper')
+        with mock.patch.object(PBKDF2PasswordHasher, 'encode') as encode, self.assertNumQueries(0):
+            response = self.post_login('SHOPPER')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '60')
+        encode.assert_not_called()
+
+    def test_ip_bucket_spans_accounts(self):
+        for login in ('a', 'b', 'c', 'd'):
+            self.assertEqual(self.post_login(login).status_code, 200)
+        self.assertEqual(self.post_login('e').status_code, 429)
+        self.assertEqual(ratelimit.stats()['login:ip'], {'hits': 5, 'blocks': 1})
+
+    def test_register_limited_by_ip(self):
+        form = {'name': 'New', 'username': 'new', 'email': 'new@example.com', 'password': 'short', 'confirm_password': 'short'}
+        self.assertEqual(self.client.post(reverse('register'), form).status_code, 200)
+        self.assertEqual(self.client.post(reverse('register'), form).status_code, 429)
+        self.assertEqual(self.client.get(reverse('register')).status_code, 200)
+
+    def test_file_cache_backend(self):
+        with tempfile.TemporaryDirectory() as location, self.settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'ratelimit': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location},
+        }):
+            self.post_login('shopper')
+            self.post_login('shopper')
+            self.assertEqual(self.post_login('shopper').status_code, 429)
+
+
+class CaseInsensitiveLookupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.bulk_create(
+            User(username=f'user{i}', email=f'user{i}@example.com', name=f'User {i}', password='!')
+            for i in range(5000)
+        )
+        cls.user = User.objects.get(username='user42')
+
+    def test_taken_by_others(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(taken_by_others('USER42', 'new@example.com'), (True, False))
+        self.assertEqual(taken_by_others('new', 'User42@Example.com'), (False, True))
+        self.assertEqual(taken_by_others('user42', 'user42@example.com', exclude=self.user), (False, False))
+
+    def test_case_insensitive_uniqueness(self):
+        with self.assertRaises(IntegrityError):
+            User.objects.create(username='USER7', email='other@example.com', name='Dup')
+
+    @skipUnlessDBFeature('supports_expression_indexes')
+    def test_lookups_use_indexes(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('EXPLAIN QUERY PLAN output is SQLite-specific')
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        queries = {
+            'login': User.objects.matching(username='User42@example.com', email='User42@example.com'),
+            'register': User.objects.matching(username='user42', email='x@example.com'),
+            'profile': User.objects.matching(username='user42', email='x@example.com').exclude(id=self.user.id),
+        }
+        for name, queryset in queries.items():
+            with self.subTest(name):
+                sql, params = queryset.query.sql_with_params()
+                with connection.cursor() as cursor:
+                    cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                    plan = ' / '.join(row[-1] for row in cursor.fetchall())
+                self.assertIn('USING INDEX user_username_ci_unique', plan)
+                self.assertIn('USING INDEX user_email_ci_unique', plan)
+                self.assertNotIn('SCAN user_user', plan)
+        self.assertEqual(find_account('USER42@EXAMPLE.COM'), self.user)
+
+
+class ProfileETagTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='shopper', email='shopper@example.com', password='pw-12345678', name='Shopper')
+        item = CatalogItem.objects.create(external_id=1, title='Backpack', price=Decimal('10.00'), rate=Decimal('4.0'), count=1)
+        cls.item = item
+        cls.product = Product.objects.create(user=cls.user, item=item)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.etag = self.client.get(reverse('profile'))['ETag']
+
+    def get_profile(self):
+        return self.client.get(reverse('profile'), HTTP_IF_NONE_MATCH=self.etag)
+
+    def test_not_modified_with_one_query_after_login(self):
+        # Session and user lookups, then the ETag aggregate; no list or statistics queries
+        with self.assertNumQueries(3):
+            response = self.get_profile()
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], self.etag)
+
+    def test_product_changes_invalidate(self):
+        self.client.post(reverse('update_quantity', args=[self.product.id]), '{"delta": 1}', content_type='application/json')
+        self.assertEqual(self.get_profile().status_code, 200)
+
+    def test_catalog_item_changes_invalidate(self):
+        # A sync rewrites the shared item; the user's own row is untouched
+        CatalogItem.objects.filter(pk=self.item.pk).update(price=Decimal('12.00'), updated_at=timezone.now())
+        self.assertEqual(self.get_profile().status_code, 200)
+
+    def test_profile_changes_invalidate(self):
+        User.objects.filter(pk=self.user.pk).update(name='Renamed')
+        self.assertEqual(self.get_profile().status_code, 200)
+
+
+class ProfilePageTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='shopper', email='shopper@example.com', password='pw-12345678', name='Shopper')
+        self.client.force_login(self.user)
+
+    def add(self, title, category, price, quantity):
+        item = CatalogItem.objects.create(title=title, category=category, price=Decimal(price), rate=Decimal('4.0'), count=1)
+        return Product.objects.create(user=self.user, item=item, quantity=quantity)
+
+    def test_statistics(self):
+        self.add('Backpack', 'bags', '10.00', 3)
+        self.add('Tote', 'bags', '5.50', 1)
+        self.add('Lamp', 'home', '20.00', 2)
+        other = User.objects.create_user(username='other', email='other@example.com', password='pw-12345678', name='Other')
+        Product.objects.create(user=other, item=CatalogItem.objects.get(title='Lamp'), quantity=9)
+
+        context = self.client.get(reverse('profile')).context
+        self.assertEqual((context['total_products'], context['total_quantity']), (3, 6))
+        self.assertEqual(context['total_spent'], Decimal('75.50'))
+        self.assertEqual(context['category_stats'], {
+            'bags': {'count': 4, 'amount': Decimal('35.50')},
+            'home': {'count': 2, 'amount': Decimal('40.00')},
+        })
+        self.assertEqual(context['most_purchased_category'], 'bags')
+        self.assertEqual(context['average_price'], Decimal('75.50') / 6)
+
+    def test_empty_collection(self):
+        context = self.client.get(reverse('profile')).context
+        self.assertEqual((context['total_products'], context['total_spent'], context['most_purchased_category']),
+                         (0, Decimal('0'), None))
+
+    @override_settings(PROFILE_PAGE_SIZE=2)
+    def test_pages_split_rows_with_the_same_timestamp(self):
+        products = [self.add(f'Item {i}', 'bags', '1.00', 1) for i in range(5)]
+        # Rows added in the same instant are ordered by id, so none is skipped or repeated across pages
+        Product.objects.filter(pk__in=[p.pk for p in products[1:4]]).update(created_at=products[0].created_at)
+        expected = [title for _, _, title in sorted(Product.objects.values_list('created_at', 'id', 'item__title'), reverse=True)]
+
+        response = self.client.get(reverse('profile'))
+        seen = [product.item.title for product in response.context['user_products']]
+        cursor = response.context['next_cursor']
+        while cursor:
+            # Put into the URL as it is, without percent-encoding
+            page = self.client.get(f"{reverse('profile_products')}?cursor={cursor}").json()
+            seen += re.findall(r'>(Item \d)</h6>', page['html'])
+            cursor = page['next_cursor']
+        self.assertEqual(seen, expected)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('profile_products'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
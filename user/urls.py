@@ -7,4 +7,6 @@ urlpatterns = [
     path('register/', register, name='register'),
     path('logout/', logout_view, name='logout'),
     path('profile/', profile_view, name='profile'),
+    path('profile/products/', profile_products, name='profile_products'),
+    path('ratelimit/stats/', ratelimit_stats, name='ratelimit_stats'),
 ]
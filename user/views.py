@@ -1,13 +1,37 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect
-from django.contrib.auth import authenticate, login as auth_login, logout as auth_logout
-from django.contrib.auth.hashers import make_password
+from django.http import JsonResponse
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.auth.decorators import login_required
+from django.template.loader import render_to_string
+from django.contrib.auth import alogin, authenticate, login as auth_login, logout as auth_logout
 from django.contrib import messages
+from django.middleware.csrf import get_token
 from django.db import IntegrityError
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Max, Q, Sum
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from main.conditional import not_modified, page_etag, with_etag
 from .models import User
+from .passwords import ahash_password
+from .ratelimit import ratelimit, stats as rate_limit_counters
+
+def taken_by_others(username, email, exclude=None):
+    """Return (username_taken, email_taken), ignoring case and the `exclude` user."""
+    others = User.objects.matching(username=username, email=email)
+    if exclude is not None:
+        others = others.exclude(id=exclude.id)
+    username_taken = email_taken = False
+    for other_username, other_email in others.values_list('username', 'email'):
+        username_taken |= other_username.lower() == (username or '').lower()
+        email_taken |= other_email.lower() == (email or '').lower()
+    return username_taken, email_taken
 
 def landing_view(request):
     return render(request, 'base.html')
 
+@ratelimit('login')
 def login(request):
     if request.method == 'POST':
         username = request.POST.get('username')
@@ -18,46 +42,37 @@ def login(request):
             messages.error(request, 'Please enter both username/email and password.')
             return render(request, 'user/login.html')
         
-        # Try to authenticate with username first, then email
+        # One lookup by username or email and one password check (see user/backends.py)
         user = authenticate(request, username=username, password=password)
         
-        if not user:
-            # Try to find user by email and authenticate
-            try:
-                user_obj = User.objects.get(email__iexact=username)
-                user = authenticate(request, username=user_obj.username, password=password)
-            except User.DoesNotExist:
-                # Check if the user exists but password is wrong
-                user_exists_by_username = User.objects.filter(username__iexact=username).exists()
-                user_exists_by_email = User.objects.filter(email__iexact=username).exists()
-                
-                if user_exists_by_username or user_exists_by_email:
-                    messages.error(request, 'Invalid password. Please check your password and try again.')
-                else:
-                    messages.error(request, f'No account found with username/email "{username}". <a href="{request.build_absolute_uri("/register/")}" class="text-primary-custom">Create an account</a>?')
-                
-                return render(request, 'user/login.html')
-        
-        if user is not None:
-            auth_login(request, user)
-            
-            # Set session expiry based on remember me
-            if not remember_me:
-                request.session.set_expiry(0)  # Session expires when browser closes
-            
-            messages.success(request, f'Welcome back, {user.name}!')
-            
-            # Redirect based on user role
-            if user.role == 'vendor':
-                return redirect('vendor_dashboard')  # Create this URL later
+        if user is None:
+            # The backend leaves the account it found, so no second lookup is needed
+            if getattr(request, 'login_account', None) is not None:
+                messages.error(request, 'Invalid password. Please check your password and try again.')
             else:
-                return redirect('front_view')  # Redirect to home page
+                messages.error(request, f'No account found with username/email "{username}". <a href="{request.build_absolute_uri("/register/")}" class="text-primary-custom">Create an account</a>?')
+            
+            return render(request, 'user/login.html')
+        
+        auth_login(request, user)
+        
+        # Set session expiry based on remember me
+        if not remember_me:
+            request.session.set_expiry(0)  # Session expires when browser closes
+        
+        messages.success(request, f'Welcome back, {user.name}!')
+        
+        # Redirect based on user role
+        if user.role == 'vendor':
+            return redirect('vendor_dashboard')  # Create this URL later
         else:
-            messages.error(request, 'Invalid credentials. Please check your username/email and password.')
+            return redirect('front_view')  # Redirect to home page
     
     return render(request, 'user/login.html')
 
-def register(request):
+@ratelimit('register')
+async def register(request):
+    # Async so that, under ASGI, the password hash runs off the event loop (see user/passwords.py)
     if request.method == 'POST':
         name = request.POST.get('name')
         username = request.POST.get('username')
@@ -82,12 +97,12 @@ def register(request):
         if not terms:
             errors.append('You must accept the terms and conditions.')
         
-        # Check if username already exists (case-insensitive)
-        if User.objects.filter(username__iexact=username).exists():
+        # Check if username or email already exists (case-insensitive), in one indexed query
+        username_taken, email_taken = await sync_to_async(taken_by_others)(username, email)
+        if username_taken:
             errors.append(f'Username "{username}" is already taken. Please choose a different username.')
         
-        # Check if email already exists (case-insensitive)
-        if User.objects.filter(email__iexact=email).exists():
+        if email_taken:
             errors.append(f'Email "{email}" is already registered. Please use a different email address or <a href="{request.build_absolute_uri("/login/")}" class="text-primary-custom">login here</a>.')
         
         # Additional validations
@@ -114,36 +129,82 @@ def register(request):
                     'role': role,
                 }
             }
-            return render(request, 'user/register.html', context)
+            return await sync_to_async(render)(request, 'user/register.html', context)
         
+        password_hash = await ahash_password(password)
         try:
             # Create new user
-            user = User.objects.create(
+            user = await User.objects.acreate(
                 name=name,
                 username=username,
                 email=email,
-                password=make_password(password),  # Hash the password
+                password=password_hash,
                 role=role
             )
-            
-            # Log the user in automatically after registration
-            user = authenticate(request, username=username, password=password)
-            if user:
-                auth_login(request, user)
-                messages.success(request, f'Welcome to SnapNShop, {name}! Your account has been created successfully.')
-                
-                # Redirect based on role
-                if role == 'vendor':
-                    # messages.info(request, 'As a vendor, you can start adding your products after account verification.')
-                    return redirect('front_view')  # Create this URL later
-                else:
-                    return redirect('front_view')
-            
-        except IntegrityError as e:
+        except IntegrityError:
             messages.error(request, 'An error occurred while creating your account. This username or email might already be in use. Please try again with different credentials.')
-            return render(request, 'user/register.html')
+            return await sync_to_async(render)(request, 'user/register.html')
+        
+        # Log the user in automatically; the password was just set, so no authenticate() (a second hash)
+        await alogin(request, user, backend=settings.AUTHENTICATION_BACKENDS[0])
+        messages.success(request, f'Welcome to SnapNShop, {name}! Your account has been created successfully.')
+        
+        # Redirect based on role
+        if role == 'vendor':
+            # messages.info(request, 'As a vendor, you can start adding your products after account verification.')
+            return redirect('front_view')  # Create this URL later
+        else:
+            return redirect('front_view')
     
-    return render(request, 'user/register.html')
+    return await sync_to_async(render)(request, 'user/register.html')
+
+# Columns the profile product list actually renders, the item's joined in (skips its description TextField).
+# `user` is kept because the related manager attaches the owner to each row.
+PRODUCT_LIST_FIELDS = (
+    'id', 'user', 'quantity', 'created_at', 'item__title', 'item__category', 'item__image_url', 'item__price',
+)
+
+def products_page(user, cursor=None):
+    """Return one page of the user's products, newest first, and the cursor for the next page.
+
+    Pages are keyset-paginated on (created_at, id), so every page costs the
+    same however far down the list it is.
+    """
+    products = user.products.select_related('item').only(*PRODUCT_LIST_FIELDS).order_by('-created_at', '-id')
+    if cursor:
+        created_at, product_id = cursor
+        products = products.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=product_id)
+        )
+
+    page_size = settings.PROFILE_PAGE_SIZE
+    products = list(products[:page_size + 1])
+    next_cursor = None
+    if len(products) > page_size:
+        last = products[page_size - 1]
+        next_cursor = make_cursor(last.created_at, last.id)
+    return products[:page_size], next_cursor
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+def make_cursor(created_at, product_id):
+    """Cursor for the rows after (created_at, product_id): ``<epoch microseconds>_<id>``.
+
+    Digits and an underscore only, so it survives a query string unencoded
+    (an ISO timestamp's ``+00:00`` would come back as `` 00:00``).
+    """
+    return f'{(created_at - _EPOCH) // _MICROSECOND}_{product_id}'
+
+def parse_cursor(value):
+    """Parse a cursor made by make_cursor, returning None if it is malformed."""
+    micros, _, product_id = value.partition('_')
+    if not (micros.isdecimal() and product_id.isdecimal()):
+        return None
+    try:
+        return _EPOCH + int(micros) * _MICROSECOND, int(product_id)
+    except OverflowError:
+        return None
 
 def logout_view(request):
     auth_logout(request)
@@ -156,6 +217,22 @@ def profile_view(request):
         return redirect('login')
     
     user = request.user
+    etag = None
+    
+    if request.method == 'GET':
+        # Revalidate on the user's latest product change and the latest sync of
+        # their catalog items (one query) before the product list and statistics queries run
+        changes = user.products.aggregate(
+            latest=Max('updated_at'), item_latest=Max('item__updated_at'), count=Count('id'),
+        )
+        get_token(request)  # the page embeds a CSRF token, so its secret is part of the ETag
+        etag = page_etag(
+            request, user.username, user.email, user.role,
+            changes['latest'], changes['item_latest'], changes['count'],
+        )
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
     
     # Handle POST request for updating profile
     if request.method == 'POST':
@@ -169,12 +246,12 @@ def profile_view(request):
         if not all([name, username, email]):
             errors.append('All fields are required.')
         
-        # Check if username already exists for other users
-        if User.objects.filter(username__iexact=username).exclude(id=user.id).exists():
+        # Check if username or email already exists for other users, in one indexed query
+        username_taken, email_taken = taken_by_others(username, email, exclude=user)
+        if username_taken:
             errors.append(f'Username "{username}" is already taken by another user.')
         
-        # Check if email already exists for other users
-        if User.objects.filter(email__iexact=email).exclude(id=user.id).exists():
+        if email_taken:
             errors.append(f'Email "{email}" is already registered by another user.')
         
         # Additional validations
@@ -204,33 +281,39 @@ def profile_view(request):
             except IntegrityError:
                 messages.error(request, 'An error occurred while updating your profile. Please try again.')
     
-    # Get user's products and statistics
-    user_products = user.products.all().order_by('-created_at')
+    # Get the first page of the user's products; the rest is loaded by profile_products
+    user_products, next_cursor = products_page(user)
     
     # USD to INR conversion rate
     # USD_TO_INR_RATE = 83
     
-    # Calculate statistics (convert USD prices to INR)
-    total_products = user_products.count()
-    total_quantity = sum(product.quantity for product in user_products)
-    total_spent = sum((product.price) * product.quantity for product in user_products)
+    # Per-category totals, aggregated by the database (one row per category)
+    category_rows = (
+        user.products.order_by()
+        .values(category=F('item__category'))
+        .annotate(
+            products=Count('id'),
+            count=Sum('quantity'),
+            amount=Sum(
+                ExpressionWrapper(F('item__price') * F('quantity'), output_field=DecimalField(max_digits=14, decimal_places=2))
+            ),
+        )
+        .order_by('-count', 'category')
+    )
     
     # Category statistics
-    category_stats = {}
-    for product in user_products:
-        category = product.category
-        inr_price = product.price
-        if category in category_stats:
-            category_stats[category]['count'] += product.quantity
-            category_stats[category]['amount'] += inr_price * product.quantity
-        else:
-            category_stats[category] = {
-                'count': product.quantity,
-                'amount': inr_price * product.quantity
-            }
+    category_stats = {
+        row['category']: {'count': row['count'], 'amount': row['amount']}
+        for row in category_rows
+    }
+    
+    # Calculate statistics (convert USD prices to INR)
+    total_products = sum(row['products'] for row in category_rows)
+    total_quantity = sum(stats['count'] for stats in category_stats.values())
+    total_spent = sum((stats['amount'] for stats in category_stats.values()), Decimal('0'))
     
-    # Most purchased category
-    most_purchased_category = max(category_stats.items(), key=lambda x: x[1]['count'])[0] if category_stats else None
+    # Most purchased category (rows are ordered by quantity)
+    most_purchased_category = next(iter(category_stats), None)
     
     # Average product price (in INR)
     average_price = total_spent / total_quantity if total_quantity > 0 else 0
@@ -238,6 +321,7 @@ def profile_view(request):
     context = {
         'user': user,
         'user_products': user_products,
+        'next_cursor': next_cursor,
         'total_products': total_products,
         'total_quantity': total_quantity,
         'total_spent': total_spent,
@@ -246,4 +330,26 @@ def profile_view(request):
         'average_price': average_price,
     }
     
-    return render(request, 'user/profile.html', context)
+    response = render(request, 'user/profile.html', context)
+    return with_etag(response, etag) if etag else response
+
+@login_required
+def profile_products(request):
+    # Next page of the profile product list, for infinite scroll
+    cursor = parse_cursor(request.GET.get('cursor', ''))
+    if cursor is None:
+        return JsonResponse({'status': 'error', 'message': 'Invalid cursor'}, status=400)
+
+    user_products, next_cursor = products_page(request.user, cursor)
+    html = render_to_string('user/product_items.html', {'user_products': user_products}, request=request)
+
+    return JsonResponse({
+        'status': 'success',
+        'html': html,
+        'next_cursor': next_cursor,
+    })
+
+@staff_member_required
+def ratelimit_stats(request):
+    # Login/register rate-limit checks and blocks (this process only)
+    return JsonResponse({'status': 'success', 'rules': rate_limit_counters()})